@@ -0,0 +1,204 @@
+"""
+ACS census tract indicators rolled up to county, state and national level.
+
+Every column is declared in ``MEASURES`` as a count, which is summed, or a rate (a percentage, median or average),
+which becomes a population-weighted mean; a column that is not declared stops the build. Both reduce to
+additive partials (sums of values, sums of population x value and of the population behind every non-missing value)
+computed for every county in one group-by per chunk of tracts, and every coarser level is a group-by of those partials,
+so the whole cube is built from a single pass over every tract table. Tables are streamed one at a time, so a tract
+counts towards the features of every table that has data for it; a column held by several tables is taken from the
+first of them, as in ``queries.census_tracts_query``. Levels are written as parquet tables under
+``Data/cube/<data version>/`` and loaded once per process; the tract level is the tract data itself.
+"""
+import os
+import numpy as np
+import pandas as pd
+
+import queries
+from constants import DATA_VERSION
+
+CUBE_DIR = os.path.join('Data', 'cube')
+
+LEVELS = ['tract', 'county', 'state', 'nation']
+
+LEVEL_KEYS = {
+    'county': ['county_id', 'county_name', 'state_name'],
+    'state': ['state_name'],
+    'nation': ['nation'],
+}
+
+NATION = 'United States'
+
+WEIGHT = 'tot_population_census_2010'
+
+# Columns that identify a tract rather than describe it
+ID_COLUMNS = {'Census Tract', 'tract_id', 'tract', 'county_id', 'county_name', 'state_id', 'state_name', 'geom',
+              'index', 'id', 'geoid', 'fips', 'state_fips', 'cnty_fips'}
+
+ALL = '*'
+
+# How the columns of every census table roll up, declared as::
+#
+#     table: {'rates': [...], 'counts': [...]}
+#
+# where ALL stands for every column of the table not listed under the other kind. household_job_availability and
+# level_of_urbanicity are not classified yet, so the cube cannot be built over them until they are declared here
+MEASURES = {
+    'commuting_characteristics': {
+        'rates': ['percent_drive_alone', 'percent_public_transport', 'percent_bicycle', 'mean_travel_time'],
+        'counts': ['total_workers_commute'],
+    },
+    'disability_status': {'counts': ALL},
+    'educational_attainment': {'counts': ALL},
+    'employment_status': {'counts': ALL},
+    'english_proficiency': {'counts': ALL},
+    'family_type': {'counts': ALL},
+    'group_quarters_population': {'counts': ALL},
+    'hispanic_or_latino_origin_by_race': {'counts': ALL},
+    'household_technology_availability': {'counts': ALL},
+    'household_vehicle_availability': {'rates': ['percent_hh_0_veh']},
+    'housing_units_in_structure': {'counts': ALL},
+    'median_household_income': {'rates': ALL},
+    'occupants_per_bedroom': {'counts': ALL},
+    'per_capita_income': {'rates': ALL},
+    'population_below_poverty_double': {'counts': ALL},
+    'poverty_status': {'counts': ALL},
+    'resident_population_census_tract': {'counts': ALL},
+    'sex_by_age': {'counts': ALL},
+    'sex_of_workers_by_vehicles_available': {'counts': ALL},
+    # Average vehicle miles traveled (BTS LATCH estimates)
+    'trip_miles': {'rates': ['vehicle_miles_traveled']},
+}
+
+_levels = {}
+
+
+def is_rate(table: str, column: str) -> bool:
+    """Whether ``column`` of ``table`` is declared a rate in ``MEASURES``; raises ValueError when it is not declared."""
+    declared = MEASURES.get(table, {})
+    listed = {kind: columns for kind, columns in declared.items() if columns != ALL}
+    if column in listed.get('rates', []) or column in listed.get('counts', []):
+        return column in listed.get('rates', [])
+    if ALL in declared.values():
+        return declared.get('rates') == ALL
+    raise ValueError(f"Column '{column}' of census table '{table}' is not declared as a rate or a count in MEASURES")
+
+
+def feature_columns(tracts: pd.DataFrame) -> list:
+    tracts = tracts.loc[:, ~tracts.columns.duplicated()]
+    return [c for c in tracts.columns
+            if c not in ID_COLUMNS and c != WEIGHT and pd.api.types.is_numeric_dtype(tracts[c])]
+
+
+def partials(tracts: pd.DataFrame, keys: list, features: list) -> pd.DataFrame:
+    """Additive partial sums of ``features`` per ``keys`` group of tracts."""
+    tracts = tracts.loc[:, ~tracts.columns.duplicated()]
+    values = tracts.reindex(columns=features).apply(pd.to_numeric, errors='coerce').to_numpy(dtype='float64')
+    weight = pd.to_numeric(tracts[WEIGHT], errors='coerce').fillna(0).to_numpy(dtype='float64')
+    valid = ~np.isnan(values)
+    values = np.where(valid, values, 0)
+    block = np.hstack([values, values * weight[:, None], valid * weight[:, None], valid])
+    columns = (features + [f + ' weighted' for f in features] + [f + ' weight' for f in features] +
+               [f + ' count' for f in features])
+    frame = pd.DataFrame(block, columns=columns)
+    for key in keys:
+        frame[key] = tracts[key].to_numpy()
+    return frame.groupby(keys, sort=True)[columns].sum().reset_index()
+
+
+def coverage(tracts: pd.DataFrame, keys: list) -> pd.DataFrame:
+    """Population and number of distinct tracts per ``keys`` group."""
+    tracts = tracts.drop_duplicates('Census Tract')
+    weight = pd.to_numeric(tracts[WEIGHT], errors='coerce').fillna(0)
+    grouped = weight.groupby([tracts[k] for k in keys], sort=True)
+    return pd.DataFrame({WEIGHT: grouped.sum(), 'tracts': grouped.size().astype('float64')}).reset_index()
+
+
+def roll_up(parts: pd.DataFrame, keys: list) -> pd.DataFrame:
+    value_columns = [c for c in parts.columns if c not in sum(LEVEL_KEYS.values(), [])]
+    return parts.groupby(keys, sort=True)[value_columns].sum().reset_index()
+
+
+def finalize(parts: pd.DataFrame, keys: list, features: list, rates: set) -> pd.DataFrame:
+    """Sums for count features and population-weighted means for ``rates``, NaN where no tract had a value."""
+    res = parts[keys + [WEIGHT, 'tracts']].copy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for f in features:
+            if f in rates:
+                values = parts[f + ' weighted'] / parts[f + ' weight']
+            else:
+                values = parts[f]
+            res[f] = values.where(parts[f + ' count'] > 0)
+    return res
+
+
+def build_levels(chunks) -> dict:
+    """Every aggregate level from an iterable of (table, tract frame) chunks."""
+    keys = LEVEL_KEYS['county']
+    owners = {}
+    rates = set()
+    county_parts = []
+    tracts = []
+    for table, chunk in chunks:
+        # Tables can hold a tract more than once; its counts must only be summed once
+        chunk = chunk.loc[:, ~chunk.columns.duplicated()].drop_duplicates('Census Tract')
+        chunk_features = feature_columns(chunk)
+        for f in chunk_features:
+            if owners.setdefault(f, table) == table and is_rate(table, f):
+                rates.add(f)
+        county_parts.append(partials(chunk, keys, [f for f in chunk_features if owners[f] == table]))
+        tracts.append(chunk[['Census Tract'] + keys + [WEIGHT]])
+    if not owners:
+        return {}
+    features = list(owners)
+    county_parts.append(coverage(pd.concat(tracts, ignore_index=True), keys))
+    # Counties lacking a table have no partials for its features; those sum as zero counts
+    counties = roll_up(pd.concat(county_parts, ignore_index=True), keys)
+    states = roll_up(counties, LEVEL_KEYS['state'])
+    nation = roll_up(states.assign(nation=NATION), LEVEL_KEYS['nation'])
+    return {
+        'county': finalize(counties, LEVEL_KEYS['county'], features, rates),
+        'state': finalize(states, LEVEL_KEYS['state'], features, rates),
+        'nation': finalize(nation, LEVEL_KEYS['nation'], features, rates),
+    }
+
+
+def build_cube(states: list = None, chunk_counties: int = queries.CHUNK_COUNTIES, directory: str = CUBE_DIR) -> dict:
+    """Streams every census table for ``states`` (all by default) and writes the aggregate levels."""
+    counties = queries.all_counties_query()
+    if states is not None:
+        counties = counties.loc[counties['state_name'].isin(states)]
+    county_ids = counties.sort_values(['state_name', 'county_id'])['county_id'].drop_duplicates().to_list()
+    levels = build_levels((table, chunk) for table in queries.CENSUS_TABLES
+                          for chunk in queries.iter_census_tracts(county_ids, [table], None, chunk_counties))
+    path = os.path.join(directory, DATA_VERSION)
+    os.makedirs(path, exist_ok=True)
+    for level, frame in levels.items():
+        frame.to_parquet(os.path.join(path, level + '.parquet'), index=False)
+        _levels.pop((level, directory), None)
+    return {level: len(frame) for level, frame in levels.items()}
+
+
+def load_level(level: str, directory: str = CUBE_DIR):
+    """Aggregates at ``level`` (county, state or nation), or None when the cube has not been built."""
+    if (level, directory) not in _levels:
+        path = os.path.join(directory, DATA_VERSION, level + '.parquet')
+        if not os.path.exists(path):
+            return None
+        _levels[(level, directory)] = pd.read_parquet(path)
+    return _levels[(level, directory)]
+
+
+def features(level: str = 'county', directory: str = CUBE_DIR) -> list:
+    frame = load_level(level, directory)
+    if frame is None:
+        return []
+    return [c for c in frame.columns if c not in LEVEL_KEYS[level] + [WEIGHT, 'tracts']]
+
+
+def county_features(county_ids: list, columns: list, directory: str = CUBE_DIR):
+    """``columns`` of the county level for ``county_ids`` keyed by county_id, or None when the cube is missing."""
+    frame = load_level('county', directory)
+    if frame is None:
+        return None
+    return frame.loc[frame['county_id'].isin(county_ids), ['county_id'] + list(columns)]
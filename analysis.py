@@ -2,10 +2,11 @@ import math
 import itertools
 import pandas as pd
 import numpy as np
-import sklearn.preprocessing as pre
 import streamlit as st
 
 import queries
+import utils
+from constants import BURDENED_HOUSEHOLD_PROPORTION, DATA_VERSION
 
 
 def percent_to_population(feature: str, name: str, df: pd.DataFrame) -> pd.DataFrame:
@@ -14,60 +15,208 @@ def percent_to_population(feature: str, name: str, df: pd.DataFrame) -> pd.DataF
     return df
 
 
-def cross_features(df: pd.DataFrame) -> pd.DataFrame:
-    cols = ['Pop Below Poverty Level', 'Pop Unemployed', 'Income Inequality (Ratio)', 'Non-Home Ownership Pop',
-            'Num Burdened Households', 'Num Single Parent Households']
-    all_combinations = []
-    for r in range(2, 3):
-        combinations_list = list(itertools.combinations(cols, r))
-        all_combinations += combinations_list
-    new_cols = []
-    for combo in all_combinations:
-        new_cols.append(cross(combo, df))
-
-    crossed_df = pd.DataFrame(new_cols)
-    crossed_df = crossed_df.T
+CROSS_COLUMNS = ['Pop Below Poverty Level', 'Pop Unemployed', 'Income Inequality (Ratio)', 'Non-Home Ownership Pop',
+                 'Num Burdened Households', 'Num Single Parent Households']
+
+# Upper bound on the scratch memory used by a batch of interaction products (the returned crosses are not included)
+CROSS_MEMORY_BUDGET = 64 * 1024 ** 2
+
+
+def interaction_features(matrix: np.ndarray, max_order: int = 2, memory_budget: int = CROSS_MEMORY_BUDGET,
+                         mean_only: bool = False) -> tuple:
+    """
+    Absolute products of every combination of 2..max_order columns of ``matrix``, computed in column batches whose
+    running product and gathered factor stay within ``memory_budget`` bytes. NaNs are skipped like pandas' ``product``.
+    With ``mean_only`` the crosses are reduced straight to their row mean and never materialized; otherwise every
+    cross is returned, and that output (rows x combinations) is not bounded by the budget.
+    """
+    filled = np.where(np.isnan(matrix), 1.0, matrix)
+    n_rows, n_cols = filled.shape
+    batch = max(1, int(memory_budget // (2 * max(n_rows, 1) * filled.itemsize)))
+    # Scratch buffers reused by every batch; a short last batch uses a contiguous prefix of them
+    product_buffer = np.empty(n_rows * batch)
+    factor_buffer = np.empty(n_rows * batch)
+    combos = []
+    blocks = []
+    total = np.zeros(n_rows)
+    for r in range(2, min(max_order, n_cols) + 1):
+        order_combos = itertools.combinations(range(n_cols), r)
+        while True:
+            chunk = np.array(list(itertools.islice(order_combos, batch)), dtype='int64')
+            if len(chunk) == 0:
+                break
+            product = product_buffer[:n_rows * len(chunk)].reshape(n_rows, len(chunk))
+            factor = factor_buffer[:n_rows * len(chunk)].reshape(n_rows, len(chunk))
+            np.take(filled, chunk[:, 0], axis=1, out=product)
+            for j in range(1, r):
+                np.take(filled, chunk[:, j], axis=1, out=factor)
+                np.multiply(product, factor, out=product)
+            np.abs(product, out=product)
+            if mean_only:
+                total += product.sum(axis=1)
+            else:
+                blocks.append(product.copy())
+            combos += [tuple(c) for c in chunk]
+    if mean_only:
+        return total / max(len(combos), 1), combos
+    crossed = np.concatenate(blocks, axis=1) if blocks else np.empty((n_rows, 0))
+    return crossed, combos
+
+
+def cross_features(df: pd.DataFrame, cols: list = None, max_order: int = 2, mean_only: bool = False,
+                   memory_budget: int = CROSS_MEMORY_BUDGET) -> pd.DataFrame:
+    cols = CROSS_COLUMNS if cols is None else cols
+    crossed, combos = interaction_features(df[cols].to_numpy(dtype='float64'), max_order, memory_budget, mean_only)
+    if mean_only:
+        return pd.DataFrame({'Mean': crossed}, index=df.index)
+
+    crossed_df = pd.DataFrame(crossed, index=df.index, columns=['_X_'.join(cols[i] for i in c) for c in combos])
     crossed_df['Mean'] = crossed_df.mean(axis=1)
 
     return crossed_df
 
 
-def prepare_analysis_data(df: pd.DataFrame) -> pd.DataFrame:
-    temp_df=df.copy()
-    cols_to_drop = ['Population Below Poverty Line (%)',
-                    'Unemployment Rate (%)',
-                    'Burdened Households (%)',
-                    'Single Parent Households (%)',
-                    'Non-White Population (%)',
-                    ]
-    for col in list(temp_df.columns):
+PERCENT_COLS_TO_DROP = [
+    'Population Below Poverty Line (%)',
+    'Unemployment Rate (%)',
+    'Burdened Households (%)',
+    'Single Parent Households (%)',
+    'Non-White Population (%)',
+]
+
+
+def analysis_columns(columns: list) -> tuple:
+    # Maps each output column to its source column and whether it is a percentage converted to a population count,
+    # keeping the column order of the original column-by-column conversion.
+    sources = {col: (col, False) for col in columns}
+    for col in columns:
         if '(%)' in col:
-            if col == 'Unemployment Rate (%)':
-                temp_df = percent_to_population('Unemployment Rate (%)', 'Population Unemployed', temp_df)
-            else:
-                temp_df = percent_to_population(col, col.replace(' (%)', ''), temp_df)
+            name = 'Population Unemployed' if col == 'Unemployment Rate (%)' else col.replace(' (%)', '')
+            sources[name] = (col, True)
+    for col in ['Policy Value', 'Countdown'] + PERCENT_COLS_TO_DROP:
+        sources.pop(col, None)
+    out_cols = list(sources.keys())
+    return out_cols, [sources[c][0] for c in out_cols], np.array([sources[c][1] for c in out_cols], dtype=bool)
+
+
+def analysis_matrix(df: pd.DataFrame) -> tuple:
+    out_cols, src_cols, is_percent = analysis_columns(list(df.columns))
+    matrix = df[src_cols].to_numpy(dtype='float64', copy=True)
+    if is_percent.any():
+        population = df['Total Population'].to_numpy(dtype='float64')
+        # percent / 100 * population * 1000
+        matrix[:, is_percent] *= population[:, None] * 10
+    return matrix, out_cols
+
+
+def max_abs_normalize(matrix: np.ndarray) -> np.ndarray:
+    scale = np.fmax.reduce(np.abs(matrix), axis=0)
+    scale[~(scale > 0)] = 1
+    matrix /= scale
+    return matrix
+
+
+def relative_risk(normalized: np.ndarray) -> np.ndarray:
+    risk = np.nansum(normalized, axis=1)
+    max_sum = np.fmax.reduce(risk) if len(risk) else np.nan
+    return risk / max_sum
+
+
+def priority_rank(risk: np.ndarray, policy_value: np.ndarray, countdown: np.ndarray) -> np.ndarray:
+    # Vectorized priority_indicator
+    time_left = np.where(countdown < 1, 1, countdown)
+    return risk * (1 - policy_value) / np.sqrt(time_left)
+
+
+def feature_specs(columns: list) -> list:
+    # Every (source column, converted to population) variant a selection of these columns can produce
+    specs = []
+    for col in columns:
+        if col not in PERCENT_COLS_TO_DROP + ['Policy Value', 'Countdown']:
+            specs.append((col, False))
+        if '(%)' in col:
+            specs.append((col, True))
+    return specs
+
+
+def normalized_feature_matrix(df: pd.DataFrame, columns: list) -> tuple:
+    specs = feature_specs(columns)
+    matrix = df[[src for src, _ in specs]].to_numpy(dtype='float64', copy=True)
+    is_percent = np.array([pct for _, pct in specs], dtype=bool)
+    if is_percent.any():
+        matrix[:, is_percent] *= df['Total Population'].to_numpy(dtype='float64')[:, None] * 10
+    return max_abs_normalize(matrix), specs
+
+
+@st.experimental_memo
+def cached_feature_matrix(_df: pd.DataFrame, geography_key: str, columns: tuple,
+                          data_version: str = DATA_VERSION) -> tuple:
+    return normalized_feature_matrix(_df, list(columns))
+
+
+class RelativeRiskAccumulator(object):
+    """
+    Running weighted sum of normalized feature columns, updated only for the features that changed. Missing values
+    add nothing to the sum, as in relative_risk, but stay missing in the displayed features.
+    """
+
+    def __init__(self, matrix: np.ndarray, specs: list):
+        self.matrix = matrix
+        self.index = {spec: i for i, spec in enumerate(specs)}
+        self.weights = {}
+        self.total = np.zeros(len(matrix))
+
+    def update(self, columns: list, weights: dict = None) -> np.ndarray:
+        weights = {} if weights is None else weights
+        _, src_cols, is_percent = analysis_columns(columns)
+        target = {(src, bool(pct)): float(weights.get(src, 1.0)) for src, pct in zip(src_cols, is_percent)}
+        for spec in set(self.weights) | set(target):
+            delta = target.get(spec, 0.0) - self.weights.get(spec, 0.0)
+            if delta != 0:
+                self.total += delta * np.nan_to_num(self.matrix[:, self.index[spec]], nan=0.0)
+        self.weights = target
+        return self.total
+
+    def frame(self, df: pd.DataFrame, columns: list) -> pd.DataFrame:
+        out_cols, src_cols, is_percent = analysis_columns(columns)
+        positions = [self.index[(src, bool(pct))] for src, pct in zip(src_cols, is_percent)]
+        analysis_df = pd.DataFrame(self.matrix[:, positions], index=df.index, columns=out_cols)
+        analysis_df['Relative Risk'] = relative_risk(self.total[:, None])
+        if 'Policy Value' in columns:
+            analysis_df['Policy Value'] = df['Policy Value']
+            analysis_df['Countdown'] = df['Countdown']
+            analysis_df['Rank'] = priority_rank(analysis_df['Relative Risk'].to_numpy(),
+                                                df['Policy Value'].to_numpy(dtype='float64'),
+                                                df['Countdown'].to_numpy(dtype='float64'))
+        return analysis_df
+
+
+def incremental_rank_counties(df: pd.DataFrame, candidates: list, columns: list, geography_key: str,
+                              weights: dict = None) -> pd.DataFrame:
+    matrix, specs = cached_feature_matrix(df, geography_key, tuple(candidates))
+    state = st.session_state.get('relative_risk_accumulator')
+    if state is None or state[0] != (geography_key, tuple(candidates)):
+        state = ((geography_key, tuple(candidates)), RelativeRiskAccumulator(matrix, specs))
+        st.session_state['relative_risk_accumulator'] = state
+    accumulator = state[1]
+    accumulator.update(columns, weights)
+    return accumulator.frame(df, columns)
 
-    if 'Policy Value' in list(temp_df.columns) or 'Countdown' in list(temp_df.columns):
-        temp_df = temp_df.drop(['Policy Value', 'Countdown'], axis=1)
 
-    for col in cols_to_drop:
-        try:
-            temp_df.drop([col], axis=1, inplace=True)
-        except:
-            pass
-    return temp_df
+def prepare_analysis_data(df: pd.DataFrame) -> pd.DataFrame:
+    matrix, columns = analysis_matrix(df)
+    return pd.DataFrame(matrix, index=df.index, columns=columns)
 
 
 def normalize(df: pd.DataFrame) -> pd.DataFrame:
-    scaler = pre.MaxAbsScaler()
-    df_scaled = pd.DataFrame(scaler.fit_transform(df), index=df.index, columns=df.columns)
+    df_scaled = pd.DataFrame(max_abs_normalize(df.to_numpy(dtype='float64', copy=True)), index=df.index,
+                             columns=df.columns)
 
     return df_scaled
 
 
 def normalize_column(df: pd.DataFrame, col: str) -> pd.DataFrame:
-    scaler = pre.MaxAbsScaler()
-    df[col] = scaler.fit_transform(df[col].values.reshape(-1, 1))
+    df[col] = max_abs_normalize(df[col].to_numpy(dtype='float64', copy=True).reshape(-1, 1))[:, 0]
 
     return df
 
@@ -91,49 +240,122 @@ def priority_indicator(socioeconomic_index: float, policy_index: float, time_lef
     return float(socioeconomic_index) * (1 - float(policy_index)) / math.sqrt(time_left)
 
 
-def rank_counties(df: pd.DataFrame, label: str) -> pd.DataFrame:
-    analysis_df = prepare_analysis_data(df)
-    analysis_df = normalize(analysis_df)
+def rank_counties(df: pd.DataFrame, label: str, sink: str = 'excel', crossed_order: int = 0) -> pd.DataFrame:
+    matrix, columns = analysis_matrix(df)
+    matrix = max_abs_normalize(matrix)
 
-    # crossed = cross_features(analysis_df)
-    # analysis_df['Crossed'] = crossed['Mean']
-    # analysis_df = normalize_column(analysis_df, 'Crossed')
+    if crossed_order >= 2:
+        crossed, _ = interaction_features(matrix, max_order=crossed_order, mean_only=True)
+        matrix = np.column_stack([matrix, max_abs_normalize(crossed[:, None])])
+        columns = columns + ['Crossed']
 
-    analysis_df['Relative Risk'] = analysis_df.sum(axis=1)
-    max_sum = analysis_df['Relative Risk'].max()
-    analysis_df['Relative Risk'] = (analysis_df['Relative Risk'] / max_sum)
+    analysis_df = pd.DataFrame(matrix, index=df.index, columns=columns)
+    analysis_df['Relative Risk'] = relative_risk(matrix)
 
     if 'Policy Value' in list(df.columns):
         analysis_df['Policy Value'] = df['Policy Value']
         analysis_df['Countdown'] = df['Countdown']
-        analysis_df['Rank'] = analysis_df.apply(
-            lambda x: priority_indicator(x['Relative Risk'], x['Policy Value'], x['Countdown']), axis=1
-        )
+        analysis_df['Rank'] = priority_rank(analysis_df['Relative Risk'].to_numpy(),
+                                            df['Policy Value'].to_numpy(dtype='float64'),
+                                            df['Countdown'].to_numpy(dtype='float64'))
 
-    analysis_df.to_excel('Output/' + label + '_overall_vulnerability.xlsx')
+    utils.write_output(analysis_df, 'Output/' + label + '_overall_vulnerability', sink)
 
     return analysis_df
 
 
-def calculate_cost_estimate(df: pd.DataFrame, pct_burdened: float, distribution: dict,
-                            rent_type: str = 'fmr') -> pd.DataFrame:
-    if rent_type == 'fmr':
-        cost_df = queries.static_data_single_table('fair_market_rents_new', queries.STATIC_COLUMNS['fair_market_rents'])
-    elif rent_type == 'rent50':
-        cost_df = queries.static_data_single_table('median_rents_new', queries.STATIC_COLUMNS['median_rents'])
+def vulnerability_index(normalized: pd.DataFrame, weights: dict) -> tuple:
+    """
+    Transportation Vulnerability Index for every tract: the normalized indicator matrix times the weight vector.
+    Returns the index values and the weighted (tracts, indicators) contributions they sum.
+    """
+    indicators = list(weights)
+    matrix = np.nan_to_num(normalized[indicators].to_numpy(dtype='float64'), nan=0.0)
+    weight_vector = np.array([weights[i] for i in indicators], dtype='float64')
+    return matrix @ weight_vector, matrix * weight_vector
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Positions of the k highest scores, highest first, without sorting the rest. Equal scores keep their order and
+    NaN scores rank last.
+    """
+    scores = np.where(np.isnan(scores), -np.inf, np.asarray(scores, dtype='float64'))
+    k = min(max(k, 0), len(scores))
+    if k == 0:
+        return np.empty(0, dtype='int64')
+    kth = -np.partition(-scores, k - 1)[k - 1]
+    above = np.flatnonzero(scores > kth)
+    ties = np.flatnonzero(scores == kth)[:k - len(above)]
+    top = np.sort(np.concatenate([above, ties]))
+    return top[np.argsort(-scores[top], kind='stable')]
+
 
+BEDROOMS = [0, 1, 2, 3, 4]
 
-    df = df.reset_index().merge(cost_df, how="left", on='county_id').set_index(['State', 'County Name'])
+RENT_TYPES = ['fmr', 'rent50']
 
-    df['br_cost_0'] = distribution[0] * df[f'{rent_type}_0'] * (df['Renter Occupied Units']) * (df['burdened_households'] / 100) * (pct_burdened / 100)
-    df['br_cost_1'] = distribution[1] * df[f'{rent_type}_1'] * (df['Renter Occupied Units']) * (df['burdened_households'] / 100) * (pct_burdened / 100)
-    df['br_cost_2'] = distribution[2] * df[f'{rent_type}_2'] * (df['Renter Occupied Units']) * (df['burdened_households'] / 100) * (pct_burdened / 100)
-    df['br_cost_3'] = distribution[3] * df[f'{rent_type}_3'] * (df['Renter Occupied Units']) * (df['burdened_households'] / 100) * (pct_burdened / 100)
-    df['br_cost_4'] = distribution[4] * df[f'{rent_type}_4'] * (df['Renter Occupied Units']) * (df['burdened_households'] / 100) * (pct_burdened / 100)
-    df['total_cost'] = np.sum([df['br_cost_0'], df['br_cost_1'], df['br_cost_2'], df['br_cost_3'], df['br_cost_4']], axis=0)
+
+def rent_matrix(county_ids: pd.Series, rent_type: str) -> np.ndarray:
+    # Gathers (counties, bedrooms) rents from the cached reference by integer county id
+    table = queries.rent_reference()[rent_type]
+    ids = pd.to_numeric(pd.Series(county_ids), errors='coerce').to_numpy(dtype='float64')
+    valid = ~np.isnan(ids) & (ids >= 0) & (ids < len(table))
+    rents = np.full((len(ids), table.shape[1]), np.nan)
+    rents[valid] = table[ids[valid].astype('int64')]
+    return rents
+
+
+def calculate_cost_estimate(df: pd.DataFrame, pct_burdened: float, distribution: dict,
+                            rent_type: str = 'fmr') -> pd.DataFrame:
+    df = df.copy()
+    rents = rent_matrix(df['county_id'], rent_type)
+    burdened_units = (df['Renter Occupied Units'].to_numpy(dtype='float64') *
+                      (df['burdened_households'].to_numpy(dtype='float64') / 100) * (pct_burdened / 100))
+    costs = rents * np.array([distribution[b] for b in BEDROOMS], dtype='float64') * burdened_units[:, None]
+
+    for b in BEDROOMS:
+        df[f'{rent_type}_{b}'] = rents[:, b]
+    for b in BEDROOMS:
+        df[f'br_cost_{b}'] = costs[:, b]
+    df['total_cost'] = costs.sum(axis=1)
     return df
 
 
+def cost_scenario_sweep(df: pd.DataFrame, metro_areas: pd.DataFrame, proportions: list = None,
+                        rent_types: list = None) -> pd.DataFrame:
+    """
+    Monthly cost to avoid evictions for every county x housing distribution x burdened proportion x rent type,
+    computed as a single broadcast. Returns one tidy row per scenario and county.
+    """
+    proportions = BURDENED_HOUSEHOLD_PROPORTION if proportions is None else proportions
+    rent_types = RENT_TYPES if rent_types is None else rent_types
+    counties = df.reset_index()
+
+    # (rent types, counties, bedrooms)
+    rents = np.stack([rent_matrix(counties['county_id'], r) for r in rent_types])
+    # (distributions, bedrooms)
+    distributions = metro_areas[[f'{b}_br_pct' for b in BEDROOMS]].to_numpy(dtype='float64')
+    burdened_units = (counties['Renter Occupied Units'].to_numpy(dtype='float64') *
+                      counties['burdened_households'].to_numpy(dtype='float64') / 100)
+    pct = np.asarray(proportions, dtype='float64') / 100
+
+    # (rent types, distributions, proportions, counties)
+    per_unit = np.einsum('rcb,db->rdc', rents, distributions)
+    total = per_unit[:, :, None, :] * pct[None, None, :, None] * burdened_units[None, None, None, :]
+
+    scenarios = pd.MultiIndex.from_product(
+        [rent_types, list(metro_areas.index), list(proportions), np.arange(len(counties))],
+        names=['rent_type', 'location', 'pct_burdened', 'row'])
+    sweep_df = scenarios.to_frame(index=False)
+    rows = sweep_df.pop('row').to_numpy()
+    for col in ['county_id', 'State', 'County Name']:
+        if col in counties.columns:
+            sweep_df[col] = counties[col].to_numpy()[rows]
+    sweep_df['total_cost'] = total.ravel()
+    return sweep_df
+
+
 def cost_of_evictions(df, metro_areas, locations):
     rent_type = st.selectbox('Rent Type', ['Fair Market', 'Median'])
     location = st.selectbox('Select a location to assume a housing distribution:', locations)
@@ -0,0 +1,123 @@
+"""
+Chart-ready frames for the Altair charts.
+
+Charts get only the fields they encode, categorical charts get counts computed in pandas, and frames above
+``MAX_ROWS`` are reduced to evenly spaced rows of the sorted values so the Vega-Lite spec stays small (and under
+Altair's 5000 row limit) whatever the size of the selected region.
+"""
+import numpy as np
+import pandas as pd
+
+MAX_ROWS = 2000
+
+
+def project(df: pd.DataFrame, fields: list) -> pd.DataFrame:
+    """Copy of just the encoded ``fields`` (index levels included) with a plain index."""
+    fields = list(dict.fromkeys(fields))
+    in_index = [f for f in fields if f not in df.columns and f in (df.index.names or [])]
+    if in_index:
+        df = df.reset_index(level=in_index)
+    df = df.loc[:, ~df.columns.duplicated()]
+    return df[fields].reset_index(drop=True)
+
+
+def count_by(df: pd.DataFrame, group: str, feature: str, name: str = 'tract count') -> pd.DataFrame:
+    return project(df, [group, feature]).groupby([group, feature]).size().rename(name).reset_index()
+
+
+def downsample(df: pd.DataFrame, sort_by: str, max_rows: int = MAX_ROWS) -> pd.DataFrame:
+    """
+    Evenly spaced rows of ``df`` ordered by ``sort_by``; the minimum and maximum are always kept, so a sorted bar
+    chart keeps its shape. Rows with a missing value are dropped first, as Vega-Lite would skip them anyway.
+    """
+    df = df.loc[df[sort_by].notna()]
+    if len(df) <= max_rows:
+        return df
+    order = np.argsort(df[sort_by].to_numpy(), kind='stable')
+    keep = order[np.unique(np.linspace(0, len(order) - 1, max_rows).round().astype('int64'))]
+    return df.iloc[np.sort(keep)].reset_index(drop=True)
+
+
+def bar_data(df: pd.DataFrame, x: str, y: str, extra: list = None, max_rows: int = MAX_ROWS) -> tuple:
+    """Projected, downsampled rows for a per-row bar chart, and the number of rows before downsampling."""
+    data_df = project(df, [x, y] + (extra or []))
+    return downsample(data_df, y, max_rows), len(data_df)
+
+
+# Scatter plots above this many points switch to sampling (or hexagonal bins)
+SCATTER_MAX_POINTS = 3000
+
+SCATTER_BINS = 40
+
+HEX_GRIDSIZE = 30
+
+
+def outlier_mask(values: np.ndarray) -> np.ndarray:
+    """Points outside the 1.5 x IQR fences."""
+    q1, q3 = np.nanpercentile(values, [25, 75])
+    spread = 1.5 * (q3 - q1)
+    return (values < q1 - spread) | (values > q3 + spread)
+
+
+def _scaled(values: np.ndarray) -> np.ndarray:
+    low, high = np.nanmin(values), np.nanmax(values)
+    return (values - low) / (high - low if high > low else 1)
+
+
+def scatter_sample(df: pd.DataFrame, x: str, y: str, max_points: int = SCATTER_MAX_POINTS,
+                   bins: int = SCATTER_BINS, seed: int = 0) -> pd.DataFrame:
+    """
+    Every outlier plus a sample of the remaining points drawn per cell of a ``bins`` x ``bins`` grid in proportion to
+    the cell's count (at least one point per occupied cell), so the density of the cloud is preserved.
+    """
+    df = df.loc[df[x].notna() & df[y].notna()]
+    if len(df) <= max_points:
+        return df
+    xv = df[x].to_numpy(dtype='float64')
+    yv = df[y].to_numpy(dtype='float64')
+    outliers = outlier_mask(xv) | outlier_mask(yv)
+    rest = np.flatnonzero(~outliers)
+    budget = max(max_points - int(outliers.sum()), 0)
+
+    cx = np.minimum((_scaled(xv[rest]) * bins).astype('int64'), bins - 1)
+    cy = np.minimum((_scaled(yv[rest]) * bins).astype('int64'), bins - 1)
+    cell = cx * bins + cy
+    counts = np.bincount(cell, minlength=bins * bins)
+    quota = np.maximum(1, np.floor(counts * budget / max(len(rest), 1)))
+
+    # Random order within each cell, then the first quota points of every cell
+    order = np.lexsort((np.random.default_rng(seed).random(len(rest)), cell))
+    sorted_cells = cell[order]
+    rank = np.arange(len(order)) - np.searchsorted(sorted_cells, sorted_cells)
+    keep = order[rank < quota[sorted_cells]]
+    rows = np.sort(np.concatenate([np.flatnonzero(outliers), rest[keep]]))
+    return df.iloc[rows]
+
+
+def hexbin(df: pd.DataFrame, x: str, y: str, gridsize: int = HEX_GRIDSIZE) -> pd.DataFrame:
+    """Point counts on a pointy-top hexagonal grid ``gridsize`` hexagons wide, with hexagon centers in data units."""
+    df = df.loc[df[x].notna() & df[y].notna()]
+    xv = df[x].to_numpy(dtype='float64')
+    yv = df[y].to_numpy(dtype='float64')
+    px, py = _scaled(xv) * gridsize, _scaled(yv) * gridsize
+    # Axial coordinates with cube rounding
+    q = np.sqrt(3) / 3 * px - py / 3
+    r = 2 / 3 * py
+    cq, cr = np.round(q), np.round(r)
+    cs = np.round(-q - r)
+    dq, dr, ds = np.abs(cq - q), np.abs(cr - r), np.abs(cs + q + r)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    cq = np.where(fix_q, -cr - cs, cq)
+    cr = np.where(fix_r, -cq - cs, cr)
+
+    cells, points = np.unique(np.column_stack([cq, cr]), axis=0, return_counts=True)
+    hx = np.sqrt(3) * (cells[:, 0] + cells[:, 1] / 2) / gridsize
+    hy = 1.5 * cells[:, 1] / gridsize
+    x_low, x_high = np.nanmin(xv), np.nanmax(xv)
+    y_low, y_high = np.nanmin(yv), np.nanmax(yv)
+    return pd.DataFrame({
+        x: x_low + hx * (x_high - x_low if x_high > x_low else 1),
+        y: y_low + hy * (y_high - y_low if y_high > y_low else 1),
+        'points': points,
+    })
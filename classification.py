@@ -0,0 +1,142 @@
+"""
+Choropleth classification for the maps.
+
+A scheme turns a feature's values into an array of class upper bounds; ``classify`` then assigns every value to a class
+with a single ``np.digitize`` call and ``class_colors`` looks the classes up in ``COLOR_RANGE``. Equal-interval breaks
+are ``BREAKS`` stretched over the value range (the original map colors), quantile breaks put the same number of
+geographies in every class and natural breaks (Jenks) minimize the within-class squared deviations with a dynamic
+program over a sorted sample. Break arrays are cached per feature, region, values and data version.
+"""
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from constants import BREAKS, COLOR_RANGE, DATA_VERSION
+
+EQUAL_INTERVAL = 'Equal Interval'
+QUANTILE = 'Quantile'
+NATURAL_BREAKS = 'Natural Breaks'
+
+SCHEMES = [EQUAL_INTERVAL, QUANTILE, NATURAL_BREAKS]
+
+N_CLASSES = len(COLOR_RANGE)
+
+# Values the natural breaks dynamic program runs on; larger inputs are reduced to evenly spaced quantiles
+JENKS_SAMPLE = 1000
+
+PALETTE = np.array(COLOR_RANGE, dtype='uint8')
+
+
+def _finite(values) -> np.ndarray:
+    values = pd.to_numeric(pd.Series(np.asarray(values).ravel()), errors='coerce').to_numpy(dtype='float64')
+    return values[np.isfinite(values)]
+
+
+def equal_interval_breaks(values, k: int = N_CLASSES) -> np.ndarray:
+    values = _finite(values)
+    if len(values) == 0:
+        return np.empty(0)
+    low, high = values.min(), values.max()
+    fractions = np.asarray(BREAKS, dtype='float64') if k == len(BREAKS) else np.linspace(0, 1, k)
+    return low + fractions * (high - low)
+
+
+def quantile_breaks(values, k: int = N_CLASSES) -> np.ndarray:
+    values = _finite(values)
+    if len(values) == 0:
+        return np.empty(0)
+    return np.quantile(values, np.arange(1, k + 1) / k)
+
+
+def jenks_breaks(values, k: int = N_CLASSES, sample_size: int = JENKS_SAMPLE) -> np.ndarray:
+    """Fisher-Jenks optimal breaks of ``values`` (on at most ``sample_size`` evenly spaced sorted values)."""
+    x = np.sort(_finite(values))
+    if len(x) == 0:
+        return np.empty(0)
+    if len(x) > sample_size:
+        x = x[np.linspace(0, len(x) - 1, sample_size).round().astype('int64')]
+    unique = np.unique(x)
+    if len(unique) <= k:
+        return np.concatenate([unique, np.full(k - len(unique), unique[-1])])
+
+    n = len(x)
+    s1 = np.concatenate([[0], np.cumsum(x - x.mean())])
+    s2 = np.concatenate([[0], np.cumsum((x - x.mean()) ** 2)])
+    # ssd[m, i]: squared deviations of x[m..i] from their mean
+    m = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ssd = s2[i + 1] - s2[m] - (s1[i + 1] - s1[m]) ** 2 / (i + 1 - m)
+    ssd = np.where(m <= i, np.maximum(ssd, 0), np.inf)
+
+    # cost[i]: best total for x[0..i] split into the classes so far; start[c][i]: first index of its last class
+    cost = ssd[0]
+    starts = []
+    for _ in range(1, k):
+        prev = np.concatenate([[np.inf], cost[:-1]])
+        total = prev[:, None] + ssd
+        first = np.argmin(total, axis=0)
+        cost = total[first, np.arange(n)]
+        starts.append(first)
+
+    breaks = [x[-1]]
+    end = n - 1
+    for first in reversed(starts):
+        end = first[end] - 1
+        breaks.append(x[max(end, 0)])
+    return np.array(breaks[::-1])
+
+
+BREAK_FUNCTIONS = {
+    EQUAL_INTERVAL: equal_interval_breaks,
+    QUANTILE: quantile_breaks,
+    NATURAL_BREAKS: jenks_breaks,
+}
+
+
+def breaks(values, scheme: str = EQUAL_INTERVAL, k: int = N_CLASSES) -> np.ndarray:
+    return BREAK_FUNCTIONS[scheme](values, k)
+
+
+def fingerprint(values) -> int:
+    """Order-independent hash of the finite values, which are all the breaks depend on."""
+    return int(pd.util.hash_array(_finite(values)).sum())
+
+
+@st.experimental_memo
+def cached_breaks(_values, feature: str, region: str, content_hash: int, scheme: str = EQUAL_INTERVAL,
+                  k: int = N_CLASSES, data_version: str = DATA_VERSION) -> np.ndarray:
+    return breaks(_values, scheme, k)
+
+
+def classify(values, class_breaks: np.ndarray) -> np.ndarray:
+    """Class of every value: the first break it does not exceed (values above the last break and NaN go last)."""
+    values = pd.to_numeric(pd.Series(np.asarray(values).ravel()), errors='coerce').to_numpy(dtype='float64')
+    if len(class_breaks) == 0:
+        return np.zeros(len(values), dtype='int64')
+    return np.minimum(np.digitize(values, class_breaks, right=True), len(class_breaks) - 1)
+
+
+def class_colors(classes: np.ndarray, k: int = N_CLASSES) -> np.ndarray:
+    """RGB rows for ``classes`` out of ``k``, spread over the whole color range when there are fewer than it has."""
+    palette = PALETTE[np.linspace(0, len(PALETTE) - 1, max(k, 1)).round().astype('int64')]
+    return palette[np.clip(classes, 0, len(palette) - 1)]
+
+
+def rgba(rgb: np.ndarray, alpha=255) -> np.ndarray:
+    """(n, 4) uint8 colors from RGB rows and a scalar or per-row alpha."""
+    rgb = np.asarray(rgb, dtype='uint8').reshape(-1, 3)
+    res = np.empty((len(rgb), 4), dtype='uint8')
+    res[:, :3] = rgb
+    res[:, 3] = alpha
+    return res
+
+
+def colors(values, scheme: str = EQUAL_INTERVAL, feature: str = None, region: str = None,
+           k: int = N_CLASSES) -> np.ndarray:
+    """RGB color of every value; breaks are cached when the feature and region are known."""
+    if feature is not None and region is not None:
+        class_breaks = cached_breaks(values, feature, region, fingerprint(values), scheme, k)
+    else:
+        class_breaks = breaks(values, scheme, k)
+    return class_colors(classify(values, class_breaks), len(class_breaks) or k)
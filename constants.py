@@ -67,6 +67,12 @@ HOUSING_STOCK_DISTRIBUTION = {
 
 BURDENED_HOUSEHOLD_PROPORTION = [5, 25, 33, 50, 75]
 
+# Bump whenever the database tables are refreshed. It keys cached reference data, and precomputed stores are written
+# under it so that stores built from older tables are ignored until they are rebuilt.
+# Memoized wrappers take their frames as underscore arguments, which st.experimental_memo does not hash; the other
+# arguments (a region, dataset or selection key) together with data_version identify the frame instead
+DATA_VERSION = '2019.1'
+
 COLOR_RANGE = [
     [65, 182, 196],
     [127, 205, 187],
@@ -0,0 +1,77 @@
+"""
+Pairwise Pearson correlations for the correlation plots.
+
+Matches ``DataFrame.corr()`` (pairwise complete observations) but works on column blocks with matrix products: for a
+validity mask ``M`` and zero-filled values ``X`` every pairwise count, sum and cross product is a single BLAS product
+accumulated over row blocks. The full matrix is computed once per dataset and data version and sliced for any subset
+of columns.
+"""
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from constants import DATA_VERSION
+
+# Rows converted to float per block; bounds the float copy for wide national frames
+ROW_BLOCK = 20000
+
+
+def numeric_columns(df: pd.DataFrame) -> list:
+    df = df.loc[:, ~df.columns.duplicated()]
+    return [col for col in df.columns if pd.api.types.is_numeric_dtype(df[col])]
+
+
+def correlation_matrix(df: pd.DataFrame, columns: list = None) -> pd.DataFrame:
+    columns = numeric_columns(df) if columns is None else list(columns)
+    k = len(columns)
+    # Centering on the column means keeps the one-pass sums well conditioned
+    center = df[columns].astype('float64').mean().to_numpy() if k else np.empty(0)
+    n = np.zeros((k, k))
+    sx = np.zeros((k, k))
+    sxx = np.zeros((k, k))
+    sxy = np.zeros((k, k))
+    for start in range(0, len(df), ROW_BLOCK):
+        values = df[columns].iloc[start:start + ROW_BLOCK].to_numpy(dtype='float64') - center
+        mask = (~np.isnan(values)).astype('float64')
+        values = np.nan_to_num(values, nan=0.0)
+        n += mask.T @ mask
+        sx += values.T @ mask
+        sxx += (values ** 2).T @ mask
+        sxy += values.T @ values
+    # sx[i, j] sums column i over rows where j is present; the transposes give column j over rows where i is present
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = n * sxy - sx * sx.T
+        var = (n * sxx - sx ** 2) * (n * sxx.T - sx.T ** 2)
+        corr = np.where(n > 1, cov / np.sqrt(var), np.nan)
+    corr = np.clip(corr, -1, 1)
+    np.fill_diagonal(corr, np.where((np.diag(n) > 1) & (np.diag(var) > 0), 1.0, np.nan))
+    return pd.DataFrame(corr, index=columns, columns=columns)
+
+
+@st.experimental_memo
+def cached_correlation_matrix(_df: pd.DataFrame, dataset: str, data_version: str = DATA_VERSION) -> pd.DataFrame:
+    return correlation_matrix(_df)
+
+
+def correlations(df: pd.DataFrame, columns: list, dataset: str = None) -> pd.DataFrame:
+    """Correlation matrix of ``columns``, sliced from the cached full matrix when a dataset key is given."""
+    if dataset is None:
+        return correlation_matrix(df, columns)
+    full = cached_correlation_matrix(df, dataset)
+    missing = [c for c in columns if c not in full.index]
+    if missing:
+        return correlation_matrix(df, columns)
+    return full.loc[columns, columns]
+
+
+def top_pairs(corr: pd.DataFrame, n: int) -> pd.DataFrame:
+    """The ``n`` pairs with the strongest absolute correlation (each unordered pair once)."""
+    values = corr.to_numpy()
+    i, j = np.triu_indices(len(values), k=1)
+    strength = np.abs(values[i, j])
+    order = np.argsort(-np.nan_to_num(strength, nan=-1), kind='stable')[:n]
+    return pd.DataFrame({
+        'variable': corr.index[i[order]],
+        'variable2': corr.columns[j[order]],
+        'correlation': values[i[order], j[order]],
+    })
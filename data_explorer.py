@@ -1,5 +1,10 @@
 import streamlit as st
 
+import aggregation_cube
+import classification
+import derived_metrics
+import feature_store
+import geography
 import queries
 import utils
 import visualization
@@ -18,7 +23,7 @@ def county_data_explorer():
         counties = st.multiselect('Please specify one or more counties', county_list)
         # counties = [_.strip().lower() for _ in counties]
         if len(counties) > 0:
-            county_ids = county_df.query(f'county_name in {counties}')['county_id'].to_list()
+            county_ids = county_df[county_df['county_name'].isin(counties)]['county_id'].to_list()
             df = queries.get_county_data(state, county_ids)
             name = f"{state}_county_data"
     elif task == 'State':
@@ -41,20 +46,25 @@ def county_data_explorer():
         st.write('''### View Feature''')
         temp = df.copy()
         temp.reset_index(inplace=True)
+        tract_features = []
+        if len(aggregation_cube.features()) > 0:
+            tract_features = st.multiselect('Add census tract indicators aggregated to counties',
+                                            aggregation_cube.features())
+        if len(tract_features) > 0:
+            temp = temp.merge(aggregation_cube.county_features(temp['county_id'], tract_features),
+                              on='county_id', how='left')
         feature_labels = list(
             set(temp.columns) - {'County Name', 'State', 'county_id', 'state_id', 'pop10_sqmi', 'pop2010','fips','cnty_fips','state_fips'})
         feature_labels.sort()
         single_feature = st.selectbox('Feature', feature_labels, 0)
 
-        visualization.make_chart(temp, single_feature, st.session_state.data_format)
-        counties = temp['County Name'].to_list()
-        if task != 'National':
-            geo_df = queries.get_county_geoms(counties, state)
-            visualization.make_map(geo_df, temp, single_feature, st.session_state.data_format)
-        else:
-            county_ids = temp['county_id'].to_list()
-            geo_df = queries.get_county_geoms_by_id(county_ids)
-            visualization.make_map(geo_df, temp, single_feature, st.session_state.data_format)
+        county_ids = temp['county_id'].to_list()
+        region = (f"{name}:{','.join(tract_features)}:" + ','.join(map(str, sorted(county_ids))) + ':' +
+                  derived_metrics.fingerprint(temp))
+        visualization.make_chart(temp, single_feature, st.session_state.data_format, region)
+        geo_df = queries.get_county_geoms(county_ids)
+        scheme = st.selectbox('Color classes', classification.SCHEMES)
+        visualization.make_map(geo_df, temp, single_feature, st.session_state.data_format, scheme=scheme, region=region)
         st.write('''
             ### Compare Features
             Select two features to compare on the X and Y axes. Only numerical data can be compared.
@@ -67,15 +77,16 @@ def county_data_explorer():
         with col3:
             scaling_feature = st.selectbox('Scaling Feature', feature_labels, len(feature_labels) - 1)
         if feature_1 and feature_2 and scaling_feature:
-            visualization.make_scatter_plot_counties(temp, feature_1, feature_2, scaling_feature, st.session_state.data_format)
+            visualization.make_scatter_plot_counties(temp, feature_1, feature_2, scaling_feature,
+                                                     st.session_state.data_format, region)
         temp.drop(['State', 'County Name', 'county_id'], inplace=True, axis=1)
-        visualization.make_correlation_plot(temp, feature_labels)
+        visualization.make_correlation_plot(temp, feature_labels, dataset=region)
 
 
 def census_data_explorer():
     state = st.selectbox("Select a state", STATES).strip()
-    county_list = queries.all_counties_query()
-    county_list = county_list[county_list['state_name'] == state]['county_name'].to_list()
+    county_df = queries.all_counties_query()
+    county_list = county_df[county_df['state_name'] == state]['county_name'].to_list()
     county_list.sort()
     counties = st.multiselect('Please a county', ['All'] + county_list)
     tables = st.multiselect('Please specify one or more datasets to view', queries.CENSUS_TABLES)
@@ -83,10 +94,10 @@ def census_data_explorer():
     tables.sort()
 
     if len(tables) > 0 and len(counties) > 0:
-        if 'All' in counties:
-            df = queries.latest_data_census_tracts(state, county_list, tables)
-        else:
-            df = queries.latest_data_census_tracts(state, counties, tables)
+        county_ids = geography.county_ids(county_df, state, county_list if 'All' in counties else counties)
+        df = feature_store.census_tracts(state, county_ids, tables)
+        if df is None:
+            df = queries.latest_data_census_tracts(county_ids, tables)
 
         if st.checkbox('Show raw data'):
             st.subheader('Raw Data')
@@ -106,6 +117,16 @@ def census_data_explorer():
             set(df.columns) - {'County Name', 'county_id', 'index', 'county_name', 'Census Tract', 'geom',
                                'state_id', 'state_name', 'tract'})
         feature_labels.sort()
+
+        data_format = st.session_state.data_format
+        denominators = derived_metrics.tract_denominators(df['Census Tract'])
+        if denominators is not None:
+            for col in denominators.columns:
+                df[col] = denominators[col].to_numpy()
+        elif data_format != derived_metrics.RAW_VALUES:
+            st.warning('Census tract areas and populations have not been precomputed; showing raw values.')
+            data_format = derived_metrics.RAW_VALUES
+
         st.write('''
                 ### View Feature
                 Select a feature to view for each county
@@ -113,11 +134,14 @@ def census_data_explorer():
         single_feature = st.selectbox('Feature', feature_labels, 0)
         geo_df = df.copy()
         df.drop(['geom'], inplace=True, axis=1)
-        visualization.make_census_chart(df, single_feature)
+        dataset = (f"{state}:{','.join(tables)}:" + ','.join(map(str, sorted(county_ids))) + ':' +
+                   derived_metrics.fingerprint(df))
+        visualization.make_census_chart(df, single_feature, data_format, dataset)
 
         geo_df = geo_df[['geom', 'Census Tract']]
         show_transit=st.checkbox('Show transit lines and stops')
-        visualization.make_map(geo_df, df, single_feature, show_transit=show_transit)
+        scheme = st.selectbox('Color classes', classification.SCHEMES)
+        visualization.make_map(geo_df, df, single_feature, data_format, show_transit, scheme, dataset)
         if len(feature_labels) > 2:
             st.write('''
                 ### Compare Features
@@ -131,11 +155,12 @@ def census_data_explorer():
                 with col3:
                     scaling_feature = st.selectbox('Scaling Feature', feature_labels, len(feature_labels) - 1)
             if feature_1 and feature_2:
-                visualization.make_scatter_plot_census_tracts(df, feature_1, feature_2, scaling_feature)
+                visualization.make_scatter_plot_census_tracts(df, feature_1, feature_2, scaling_feature, data_format,
+                                                              dataset)
 
         df.drop(list(set(df.columns) - set(feature_labels)), axis=1, inplace=True)
         display_columns = []
         for col in df.columns:
             display_columns.append(col)
         display_columns.sort()
-        visualization.make_correlation_plot(df, display_columns)
+        visualization.make_correlation_plot(df, display_columns, dataset=dataset)
@@ -0,0 +1,104 @@
+"""
+Per Capita and Per Square Mile variants of numeric features.
+
+Every numeric feature of a dataset is divided by each denominator in one array operation and the resulting block of
+columns (``<feature> per capita``, ``<feature> per sqmi``) is cached per dataset and data version. The explorers
+include the ``fingerprint`` of the frame, taken once per rerun, in their dataset keys. Charts and maps read the columns
+they plot from the block instead of adding them to the frame they were given. County frames carry their denominators;
+census tract denominators are precomputed with the tract geometries (see ``geometry_store``).
+"""
+import hashlib
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+import correlation
+import geometry_store
+from constants import DATA_VERSION
+
+RAW_VALUES = 'Raw Values'
+
+FORMATS = [RAW_VALUES, 'Per Capita', 'Per Square Mile']
+
+# Denominator column and label suffix of every derived format
+DENOMINATORS = {
+    'Per Capita': ('Total Population', 'per capita'),
+    'Per Square Mile': ('sqmi', 'per sqmi'),
+}
+
+
+def label(feature: str, data_format: str = RAW_VALUES) -> str:
+    if data_format not in DENOMINATORS:
+        return feature
+    return f'{feature} {DENOMINATORS[data_format][1]}'
+
+
+def derived_metrics(df: pd.DataFrame, features: list = None) -> pd.DataFrame:
+    """Every numeric feature divided by every denominator present in ``df``, with a positional index."""
+    df = df.loc[:, ~df.columns.duplicated()]
+    features = correlation.numeric_columns(df) if features is None else list(features)
+    values = df[features].apply(pd.to_numeric, errors='coerce').to_numpy(dtype='float64')
+    blocks = []
+    for data_format, (denominator, suffix) in DENOMINATORS.items():
+        if denominator not in df.columns:
+            continue
+        denominators = pd.to_numeric(df[denominator], errors='coerce').to_numpy(dtype='float64')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratios = values / denominators[:, None]
+        blocks.append(pd.DataFrame(ratios, columns=[f'{f} {suffix}' for f in features]))
+    if not blocks:
+        return pd.DataFrame(index=pd.RangeIndex(len(df)))
+    return pd.concat(blocks, axis=1)
+
+
+def fingerprint(df: pd.DataFrame) -> str:
+    """Digest of the names, values and row order of the numeric columns ``derived_metrics`` reads."""
+    df = df.loc[:, ~df.columns.duplicated()]
+    columns = correlation.numeric_columns(df)
+    if columns:
+        rows = pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+    else:
+        rows = np.zeros(len(df), dtype='uint64')
+    digest = hashlib.sha1(rows.tobytes())
+    digest.update('\0'.join(map(str, columns)).encode())
+    return digest.hexdigest()
+
+
+@st.experimental_memo
+def cached_derived_metrics(_df: pd.DataFrame, dataset: str, data_version: str = DATA_VERSION) -> pd.DataFrame:
+    return derived_metrics(_df)
+
+
+def feature_values(df: pd.DataFrame, features: list, data_format: str = RAW_VALUES,
+                   dataset: str = None) -> pd.DataFrame:
+    """Columns for ``features`` in ``data_format``, aligned to ``df``'s index; ``df`` itself is left unchanged."""
+    if data_format not in DENOMINATORS:
+        return df.loc[:, ~df.columns.duplicated()][features].copy()
+    labels = [label(f, data_format) for f in features]
+    block = cached_derived_metrics(df, dataset) if dataset is not None else None
+    if block is None or not set(labels) <= set(block.columns):
+        block = derived_metrics(df, features)
+    res = block[labels].copy()
+    res.index = df.index
+    return res
+
+
+def with_feature_values(df: pd.DataFrame, features: list, data_format: str = RAW_VALUES, keep: list = None,
+                        dataset: str = None) -> pd.DataFrame:
+    """New frame of the ``keep`` columns of ``df`` followed by ``features`` in ``data_format``."""
+    values = feature_values(df, features, data_format, dataset)
+    keep = [c for c in dict.fromkeys(keep or []) if c not in values.columns]
+    res = df.loc[:, ~df.columns.duplicated()][keep].copy()
+    for i, col in enumerate(values.columns):
+        res[col] = values.iloc[:, i].to_numpy()
+    return res
+
+
+def tract_denominators(tract_ids):
+    """Population and land area of census tracts from the geometry store, or None when they have not been built."""
+    store = geometry_store.load_store('tract')
+    attributes = store.attributes(tract_ids) if store is not None else None
+    if attributes is None:
+        return None
+    return attributes.rename(columns={'population': DENOMINATORS['Per Capita'][0],
+                                      'sqmi': DENOMINATORS['Per Square Mile'][0]})
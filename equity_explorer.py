@@ -1,7 +1,12 @@
 import pandas as pd
 import streamlit as st
 
+import analysis
+import classification
+import equity_store
+import geography
 import queries
+import spatial_weights
 import utils
 import visualization
 from constants import STATES, EQUITY_DATA_TABLE, TRANSPORT_DATA_TABLE, LINKS
@@ -19,22 +24,26 @@ def census_equity_explorer():
     col1, col2 = st.columns((1 + indent, 1))
     with col1:
         state = st.selectbox("Select a state", STATES).strip()
-        county_list = queries.all_counties_query()
-        county_list = county_list[county_list['state_name'] == state]['county_name'].to_list()
+        county_df = queries.all_counties_query()
+        county_list = county_df[county_df['state_name'] == state]['county_name'].to_list()
         county_list.sort()
         counties = st.multiselect('Select a county', ['All'] + county_list)
+        county_ids = geography.county_ids(county_df, state, county_list if 'All' in counties else counties)
+        region = state + ':' + ','.join(map(str, sorted(county_ids)))
         tables = queries.EQUITY_CENSUS_TABLES
         tables = [_.strip().lower() for _ in tables]
         tables.sort()
 
     if len(tables) > 0 and len(counties) > 0:
-        try:
-            if 'All' in counties:
-                df = queries.latest_data_census_tracts(state, county_list, tables)
-            else:
-                df = queries.latest_data_census_tracts(state, counties, tables)
-        except:
-            df = pd.DataFrame()
+        # Tables written by the nationwide batch job (scripts.precompute_equity_tables), when available
+        precomputed = equity_store.load_state(state)
+        if precomputed is not None:
+            df = equity_store.tract_frame(precomputed['tracts'], county_ids)
+        else:
+            try:
+                df = queries.latest_data_census_tracts(county_ids, tables, queries.EQUITY_CENSUS_COLUMNS)
+            except:
+                df = pd.DataFrame()
 
         if st.checkbox('Show raw data'):
             st.subheader('Raw Data')
@@ -49,7 +58,8 @@ def census_equity_explorer():
             df['County Name'] = df['county_name']
         df.set_index(['State', 'County Name'], drop=True, inplace=True)
 
-        df = queries.clean_equity_data(df)
+        if precomputed is None:
+            df = queries.clean_equity_data(df)
 
         st.write('''
                 ### Identify Equity Geographies in the Region
@@ -86,10 +96,19 @@ def census_equity_explorer():
         concentration = st.select_slider(
             'Limit the number of equity geographies by increasing the concentration requirements',
             options=['Low', 'Medium', 'High'])
-        coeff = {'Low': 0.5, 'Medium': 1, 'High': 1.5}
+        coeff = queries.EQUITY_COEFFICIENTS
+        # Every concentration level is classified once per selection; moving the slider is a lookup
+        if precomputed is not None:
+            means, stds = equity_store.pooled_moments(precomputed['stats'], county_ids)
+            equity_classes = queries.classify_equity_geographies(df, means=means, stds=stds)
+            codes = equity_store.stored_codes(precomputed['criteria'], county_ids, df['Census Tract'])
+            if codes is not None:
+                equity_classes.update(codes=codes, criteria_a=(codes & 1) > 0, criteria_b=(codes & 2) > 0)
+        else:
+            equity_classes = queries.cached_equity_classification(df, region)
 
         df, total_census_tracts, concentration_thresholds, averages, epc_averages = queries.get_equity_geographies(
-            df, coeff[concentration])
+            df, coeff[concentration], equity_classes)
 
         geo_df = df.copy()
         geo_total = total_census_tracts.copy()
@@ -122,6 +141,19 @@ def census_equity_explorer():
                 ### How does the Equity Geography average compare to the county-wide average?''')
         visualization.make_horizontal_bar_chart(averages, epc_averages, feature)
 
+        weights = spatial_weights.load_weights(state, 'tract')
+        if weights is not None and st.checkbox('Show spatial clustering of this indicator'):
+            matrix = weights.subset(total_census_tracts['Census Tract'])
+            values = total_census_tracts[feature + ' (%)'].to_numpy(dtype='float64')
+            moran = spatial_weights.morans_i(matrix, values)
+            col1, col2 = st.columns(2)
+            col1.metric("Moran's I", round(moran['I'], 3))
+            col2.metric('Pseudo p-value', round(moran['p_value'], 3))
+            clusters = pd.crosstab(total_census_tracts['Category'].to_numpy(),
+                                   spatial_weights.hotspots(matrix, values))
+            st.caption('Census tracts by Getis-Ord Gi* hotspot classification (queen contiguity)')
+            st.dataframe(clusters)
+
         st.write('### View variation by geography')
 
         filter_level = st.radio('Filter map for:', ('Equity Geographies only', 'All census tracts in selected region'),
@@ -129,7 +161,9 @@ def census_equity_explorer():
         select_data = {'All census tracts in selected region': total_census_tracts, 'Equity Geographies only': df}
         select_geo = {'All census tracts in selected region': geo_total, 'Equity Geographies only': geo_df}
 
-        visualization.make_equity_census_map(select_geo[filter_level], select_data[filter_level], feature + ' (%)')
+        scheme = st.selectbox('Color classes', classification.SCHEMES, key='equity classes')
+        visualization.make_equity_census_map(select_geo[filter_level], select_data[filter_level], feature + ' (%)',
+                                             scheme, f'{region}:{filter_level}:{concentration}')
 
         if st.checkbox('View data at the census tract level'):
             filter_data = (
@@ -144,12 +178,12 @@ def census_equity_explorer():
         tables = [_.strip().lower() for _ in tables]
         tables.sort()
 
-        if len(tables) > 0 and len(counties) > 0:
+        if precomputed is not None:
+            transport_df = equity_store.tract_frame(precomputed['transport'], county_ids)
+        elif len(tables) > 0 and len(counties) > 0:
             try:
-                if 'All' in counties:
-                    transport_df = queries.latest_data_census_tracts(state, county_list, tables)
-                else:
-                    transport_df = queries.latest_data_census_tracts(state, counties, tables)
+                transport_df = queries.latest_data_census_tracts(county_ids, tables,
+                                                                  queries.TRANSPORT_CENSUS_COLUMNS)
             except:
                 transport_df = pd.DataFrame()
 
@@ -160,8 +194,12 @@ def census_equity_explorer():
             transport_df['County Name'] = transport_df['county_name']
         transport_df.set_index(['State', 'County Name'], drop=True, inplace=True)
 
-        transport_epc, transport_df, normalized_data, averages, epc_averages = queries.clean_transport_data(
-            transport_df, df_copy)
+        if precomputed is not None:
+            transport_epc, transport_df, normalized_data, averages, epc_averages = queries.summarize_transport_data(
+                transport_df, df_copy)
+        else:
+            transport_epc, transport_df, normalized_data, averages, epc_averages = queries.clean_transport_data(
+                transport_df, df_copy)
 
         geo_df = transport_df.copy()
         geo_epc = transport_epc.copy()
@@ -197,7 +235,10 @@ def census_equity_explorer():
         select_data = {'All census tracts in selected region': transport_df, 'Equity Geographies only': transport_epc}
         select_geo = {'All census tracts in selected region': geo_df, 'Equity Geographies only': geo_epc}
 
-        visualization.make_transport_census_map(select_geo[radio_data], select_data[radio_data], feature, show_transit=False)
+        scheme = st.selectbox('Color classes', classification.SCHEMES, key='transport classes')
+        visualization.make_transport_census_map(select_geo[radio_data], select_data[radio_data], feature,
+                                                show_transit=False, scheme=scheme,
+                                                region=f'{region}:{radio_data}:{concentration}')
 
         transport_epc.drop(['geom'], inplace=True, axis=1)
         transport_df.drop(['geom'], inplace=True, axis=1)
@@ -246,14 +287,13 @@ def census_equity_explorer():
         st.write('''### Transportation Vulnerability Index''')
         st.caption('Equity geographies are sorted based on each of the transportation vulnerability index values')
 
-        normalized_data = normalized_data.melt('Census Tract', selected_indicators, 'Indicators')
-        normalized_data.rename({'value': 'Index Value'}, axis=1, inplace=True)
-        normalized_data['Index Value'] = normalized_data['Indicators'].apply(lambda x: index_value[x]) * \
-                                         normalized_data['Index Value']
-        transport_index = normalized_data.groupby(['Census Tract'])['Index Value'].sum()
-        visualization.make_stacked(normalized_data)
-
-        transport_index.sort_values(ascending=False, inplace=True)
+        # A tract can appear more than once in the census tables; the chart, map, table and top tracts all use its
+        # first row
+        normalized_data = normalized_data.drop_duplicates('Census Tract')
+        tract_ids = normalized_data['Census Tract'].to_numpy()
+        scores, contributions = analysis.vulnerability_index(normalized_data, index_value)
+        transport_index = pd.Series(scores, index=tract_ids)
+        visualization.make_stacked(tract_ids, contributions, list(index_value))
 
         st.write('#### Locate the census tracts with the highest index values')
         num_tracts = st.slider('Select number of census tracts to view',
@@ -261,11 +301,12 @@ def census_equity_explorer():
                                value=[5 if 5 < len(transport_index) else len(transport_index)]
                                )[0]
 
-        selected = transport_index.head(num_tracts).reset_index()
+        top = analysis.top_k(scores, num_tracts)
+        selected = pd.DataFrame({'Census Tract': tract_ids[top], 'Index Value': scores[top]})
         selected_tracts = transport_epc.copy().loc[transport_epc['Census Tract'].isin(selected['Census Tract'])]
-        selected_tracts['value'] = selected_tracts['Census Tract'].apply(lambda x: transport_index.loc[x])
+        selected_tracts['value'] = selected_tracts['Census Tract'].map(transport_index)
         selected_geo = geo_epc.copy().loc[geo_epc['Census Tract'].isin(selected['Census Tract'])]
-        selected_geo['Index Value'] = selected_geo['Census Tract'].apply(lambda x: round(transport_index.loc[x]))
+        selected_geo['Index Value'] = selected_geo['Census Tract'].map(transport_index).round()
 
         selected_geo_copy = selected_geo.copy()
         selected_tracts_copy = selected_tracts.copy()
@@ -0,0 +1,165 @@
+"""
+Nationwide precomputed equity and transportation tables.
+
+``build_store`` runs the census tract indicator pipeline for every state in a process pool and writes four parquet
+tables per state under ``Data/equity/<data version>/<state>/``:
+
+* ``tracts.parquet``    - equity indicators per tract
+* ``transport.parquet`` - transportation indicators per tract
+* ``stats.parquet``     - per-county count, mean and sum of squared deviations of every equity indicator
+* ``criteria.parquet``  - criteria codes (0 none, 1 A, 2 B, 3 both) of every tract within its state and within its
+                          county, one uint8 column per concentration level
+
+Per-county moments pool exactly into the mean and standard deviation of any selection of counties (the state-wide
+values are the pool of all of them), so the Equity Explorer classifies a selection without querying census tables;
+the criteria of a whole state or a single county are read from the stored codes.
+Tables written for an older ``DATA_VERSION`` are ignored, and the explorer falls back to the database until the
+store is rebuilt.
+Workers query the database directly; the counties and table columns they need are looked up once by ``build_store``.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+import queries
+from constants import DATA_VERSION
+
+STORE_DIR = os.path.join('Data', 'equity')
+
+TABLES = ['tracts', 'transport', 'stats', 'criteria']
+
+KEY_COLUMNS = ['Census Tract', 'county_id', 'state_name', 'county_name']
+
+EQUITY_HEADERS = queries.EQUITY_CENSUS_POC_LOW_INCOME + queries.EQUITY_CENSUS_REMAINING_HEADERS
+
+EQUITY_COLUMNS = [h + ' (%)' for h in EQUITY_HEADERS]
+
+TRANSPORT_COLUMNS = (['tot_population_census_2010'] + queries.TRANSPORT_CENSUS_HEADERS +
+                     queries.POSITIVE_TRANSPORT_CENSUS_HEADERS)
+
+SCOPES = ['State', 'County']
+
+_states = {}
+
+
+def criteria_columns(scope: str) -> list:
+    return [f'{scope} {level}' for level in queries.EQUITY_COEFFICIENTS]
+
+
+def county_moments(tracts: pd.DataFrame) -> pd.DataFrame:
+    """Count, mean and sum of squared deviations of every equity indicator per county (long format)."""
+    long = tracts.melt('county_id', EQUITY_COLUMNS, 'indicator').dropna(subset=['value'])
+    grouped = long.groupby(['county_id', 'indicator'])['value']
+    moments = pd.DataFrame({'n': grouped.count(), 'mean': grouped.mean(), 'm2': grouped.var(ddof=0) * grouped.count()})
+    return moments.reset_index()
+
+
+def pooled_moments(stats: pd.DataFrame, county_ids: list) -> tuple:
+    """Mean and sample standard deviation of each equity indicator over ``county_ids``, in EQUITY_COLUMNS order."""
+    sel = stats.loc[stats['county_id'].isin(county_ids)]
+    n = sel.groupby('indicator')['n'].sum().reindex(EQUITY_COLUMNS, fill_value=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = (sel['n'] * sel['mean']).groupby(sel['indicator']).sum().reindex(EQUITY_COLUMNS) / n
+        deviation = sel['mean'] - sel['indicator'].map(mean)
+        m2 = (sel['m2'] + sel['n'] * deviation ** 2).groupby(sel['indicator']).sum().reindex(EQUITY_COLUMNS)
+        std = np.sqrt(m2 / (n - 1)).where(n > 1)
+    return mean.to_numpy(dtype='float64'), std.to_numpy(dtype='float64')
+
+
+def _codes(tracts: pd.DataFrame, stats: pd.DataFrame, county_ids: list) -> np.ndarray:
+    means, stds = pooled_moments(stats, county_ids)
+    return queries.classify_equity_geographies(tracts, means=means, stds=stds)['codes'].astype('uint8')
+
+
+def criteria_flags(tracts: pd.DataFrame, stats: pd.DataFrame) -> pd.DataFrame:
+    """Criteria codes of every tract at every concentration level, within the state and within its county."""
+    flags = tracts[['Census Tract', 'county_id']].copy()
+    state_codes = _codes(tracts, stats, tracts['county_id'].unique())
+    county_codes = np.zeros(state_codes.shape, dtype='uint8')
+    for county_id, rows in tracts.groupby('county_id').indices.items():
+        county_codes[:, rows] = _codes(tracts.iloc[rows], stats, [county_id])
+    for scope, codes in zip(SCOPES, [state_codes, county_codes]):
+        for col, level_codes in zip(criteria_columns(scope), codes):
+            flags[col] = level_codes
+    return flags
+
+
+def stored_codes(criteria: pd.DataFrame, county_ids: list, tract_ids) -> np.ndarray:
+    """
+    Criteria codes [level, tract] of ``tract_ids`` when ``county_ids`` select the whole state or a single county, or
+    None for any other selection.
+    """
+    if set(county_ids) >= set(criteria['county_id']):
+        scope = 'State'
+    elif len(county_ids) == 1:
+        scope = 'County'
+    else:
+        return None
+    # A tract repeated in the store or in the selection takes the codes of its first stored row
+    codes = (criteria.drop_duplicates('Census Tract').set_index('Census Tract')[criteria_columns(scope)]
+             .reindex(tract_ids))
+    if codes.isna().to_numpy().any():
+        return None
+    return codes.to_numpy(dtype='int8').T
+
+
+def _tract_data(county_ids: list, tables: list, columns: list, table_columns: dict) -> pd.DataFrame:
+    df = queries.census_tracts_query(county_ids, tables, columns, geometry=False, table_columns=table_columns)
+    df = df.loc[:, ~df.columns.duplicated()]
+    return df.reset_index(drop=True)
+
+
+def build_state(state: str, county_ids: list, table_columns: dict, directory: str = STORE_DIR) -> int:
+    """Writes the tables of ``state`` (whose counties are ``county_ids``); returns the number of tracts."""
+    tracts = queries.clean_equity_data(
+        _tract_data(county_ids, queries.EQUITY_CENSUS_TABLES, queries.EQUITY_CENSUS_COLUMNS, table_columns))
+    # A tract can appear more than once in the census tables; the store keeps its first row
+    tracts = (tracts[KEY_COLUMNS + EQUITY_COLUMNS].drop_duplicates('Census Tract').sort_values('Census Tract')
+              .reset_index(drop=True))
+    # Equity indicators are whole percentages
+    tracts[EQUITY_COLUMNS] = tracts[EQUITY_COLUMNS].astype('float32')
+
+    transport = queries.derive_transport_data(
+        _tract_data(county_ids, queries.TRANSPORT_CENSUS_TABLES, queries.TRANSPORT_CENSUS_COLUMNS, table_columns))
+    transport = (transport[KEY_COLUMNS + TRANSPORT_COLUMNS].drop_duplicates('Census Tract')
+                 .sort_values('Census Tract').reset_index(drop=True))
+
+    path = os.path.join(directory, DATA_VERSION, state)
+    os.makedirs(path, exist_ok=True)
+    tracts.to_parquet(os.path.join(path, 'tracts.parquet'), index=False)
+    transport.to_parquet(os.path.join(path, 'transport.parquet'), index=False)
+    stats = county_moments(tracts)
+    stats.to_parquet(os.path.join(path, 'stats.parquet'), index=False)
+    criteria_flags(tracts, stats).to_parquet(os.path.join(path, 'criteria.parquet'), index=False)
+    _states.pop((state, directory), None)
+    return len(tracts)
+
+
+def build_store(states: list, workers: int = None, directory: str = STORE_DIR) -> dict:
+    """Builds every state in a process pool; returns the number of tracts written per state."""
+    counties = queries.all_counties_query()
+    county_ids = [counties.loc[counties['state_name'] == state, 'county_id'].drop_duplicates().to_list()
+                  for state in states]
+    table_columns = queries.table_columns_query(
+        list(dict.fromkeys(queries.EQUITY_CENSUS_TABLES + queries.TRANSPORT_CENSUS_TABLES)))
+    workers = workers or min(os.cpu_count() or 1, 8)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        counts = pool.map(build_state, states, county_ids, [table_columns] * len(states), [directory] * len(states))
+        return dict(zip(states, counts))
+
+
+def load_state(state: str, directory: str = STORE_DIR):
+    """Precomputed tables of ``state`` keyed by table name, or None when the state has not been built."""
+    if (state, directory) not in _states:
+        path = os.path.join(directory, DATA_VERSION, state)
+        if not all(os.path.exists(os.path.join(path, t + '.parquet')) for t in TABLES):
+            return None
+        _states[(state, directory)] = {t: pd.read_parquet(os.path.join(path, t + '.parquet')) for t in TABLES}
+    return _states[(state, directory)]
+
+
+def tract_frame(table: pd.DataFrame, county_ids: list) -> pd.DataFrame:
+    """Rows of a precomputed tract table for ``county_ids`` joined to their geometries."""
+    rows = table.loc[table['county_id'].isin(county_ids)]
+    return queries.census_tracts_geom_query(county_ids).merge(rows, on='Census Tract', how='inner')
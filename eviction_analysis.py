@@ -2,7 +2,9 @@ import pandas as pd
 import streamlit as st
 
 import analysis
+import geography
 import queries
+import sensitivity
 import utils
 import visualization
 from constants import STATES
@@ -46,7 +48,7 @@ def eviction_UI():
             county = res[0].strip()
             state = res[1].strip()
             if county and state:
-                df = queries.get_county_data(state, [county])
+                df = queries.get_county_data(state, geography.county_ids(queries.all_counties_query(), state, [county]))
                 if st.checkbox('Show raw data'):
                     st.subheader('Raw Data')
                     st.dataframe(df)
@@ -79,12 +81,11 @@ def eviction_UI():
 
     elif task == 'Multiple Counties':
         state = st.selectbox("Select a state", STATES).strip()
-        county_list = queries.all_counties_query()
-        county_list = county_list[county_list['state_name'] == state]['county_name'].to_list()
+        county_df = queries.all_counties_query()
+        county_list = county_df[county_df['state_name'] == state]['county_name'].to_list()
         counties = st.multiselect('Please specify one or more counties', county_list)
-        counties = [_.strip().lower() for _ in counties]
         if len(counties) > 0:
-            df = queries.get_county_data(state, counties)
+            df = queries.get_county_data(state, geography.county_ids(county_df, state, counties))
 
             if st.checkbox('Show raw data'):
                 st.subheader('Raw Data')
@@ -194,16 +195,8 @@ def eviction_visualizations(df: pd.DataFrame, state: str = None):
     if state:
         temp = df.copy()
         temp.reset_index(inplace=True)
-        counties = temp['County Name'].to_list()
-        if state.lower() != 'national':
-            geo_df = queries.get_county_geoms(counties, state)
-            visualization.make_map(geo_df, temp, 'Relative Risk')
-        else:
-            frames = []
-            for s in STATES:
-                frames.append(queries.get_county_geoms(counties, s))
-            geo_df = pd.concat(frames)
-            visualization.make_map(geo_df, temp, 'Relative Risk')
+        geo_df = queries.get_county_geoms(temp['county_id'].to_list())
+        visualization.make_map(geo_df, temp, 'Relative Risk')
 
 
 def relative_risk_ranking(df: pd.DataFrame, label: str) -> pd.DataFrame:
@@ -211,9 +204,10 @@ def relative_risk_ranking(df: pd.DataFrame, label: str) -> pd.DataFrame:
     st.write('Relative Risk is a metric to compare the potential risk of eviction between multiple counties. '
              'Values are normalized and combined to create the Relative Risk index. '
              'You can add or remove features, or just use our defaults which we developed working with our partners.')
+    feature_options = list(set(df.columns) - {'county_id', 'state_id', 'cnty_fips', 'fips',
+                                              'pop_sqmi', 'pop2010', 'pop2010_sqmi'})
     columns_to_consider = st.multiselect('Features to consider in Relative Risk',
-                                         list(set(df.columns) - {'county_id', 'state_id', 'cnty_fips', 'fips',
-                                                                 'pop_sqmi', 'pop2010', 'pop2010_sqmi'}),
+                                         feature_options,
                                          ["burdened_households",
                                           "income_inequality",
                                           "population_below_poverty",
@@ -224,9 +218,43 @@ def relative_risk_ranking(df: pd.DataFrame, label: str) -> pd.DataFrame:
                                           "Vacant Units",
                                           "Renter Occupied Units",
                                           "Non-White Population (%)"]) + ['Total Population']
-    ranks = analysis.rank_counties(df[columns_to_consider], label + '_selected_counties').sort_values(
-        by='Relative Risk',
-        ascending=False)
+    crossed_order = 0
+    if st.checkbox('Include feature interactions in Relative Risk'):
+        crossed_order = st.slider('Highest interaction order', 2, 4, value=2)
+    weights = None
+    if crossed_order:
+        st.info('Feature interactions are ranked with equal weights, so custom feature weights are not available.')
+    elif st.checkbox('Customize feature weights'):
+        weight_cols = st.columns(3)
+        weights = {}
+        for i, feature in enumerate(columns_to_consider):
+            with weight_cols[i % 3]:
+                weights[feature] = st.number_input(feature, min_value=0.0, value=1.0, step=0.1,
+                                                   key=f'weight_{feature}')
+
+    geography_key = label + ':' + ','.join(str(c) for c in sorted(df['county_id'].to_list()))
+    if crossed_order:
+        ranks = analysis.rank_counties(df[columns_to_consider], label + '_selected_counties', sink='none',
+                                       crossed_order=crossed_order)
+    else:
+        candidates = sorted(set(df[feature_options].select_dtypes('number').columns) | set(columns_to_consider))
+        ranks = analysis.incremental_rank_counties(df, candidates, columns_to_consider, geography_key, weights)
+    ranks = ranks.sort_values(by='Relative Risk', ascending=False)
+    if st.checkbox('Test how stable the ranking is'):
+        st.write('This samples thousands of alternative feature weights around the ones used for Relative Risk '
+                 '(and optional noise in the underlying data) and reports the range of ranks each county takes.')
+        n_samples = st.slider('Number of weightings to sample', 500, 10000, value=2000, step=500)
+        perturbation = st.slider('Feature noise (standard deviation)', 0.0, 0.5, value=0.0, step=0.05)
+        features = ranks.drop(['Relative Risk', 'Policy Value', 'Countdown', 'Rank'], axis=1, errors='ignore')
+        # Weights are keyed by the selected columns; percentages are ranked as the population columns they convert to
+        out_cols, src_cols, _ = analysis.analysis_columns(columns_to_consider)
+        feature_weights = tuple((out, float(weights.get(src, 1.0))) for out, src in zip(out_cols, src_cols)
+                                if weights is not None and out in features.columns)
+        selection = geography_key + ':' + ','.join(features.columns) + f':{crossed_order}'
+        stability = sensitivity.cached_rank_sensitivity(features, selection, feature_weights, n_samples, perturbation)
+        st.dataframe(stability)
+        st.download_button('Download ranking stability', utils.to_excel(stability),
+                           file_name=f'{label}_rank_stability.xlsx')
     ranks['county_id'] = df['county_id']
     ranks['state_id'] = df['state_id']
     st.write('Higher values correspond to more relative risk. Values can be between 0 and 1.')
@@ -275,4 +303,11 @@ def cost_of_evictions(df: pd.DataFrame, metro_areas, locations):
                  ' burdened population for each type of unit. `total_cost` is sum of the `br_cost_` for each type of'
                  ' housing unit.')
         st.dataframe(cost_df)
+    if st.checkbox('Compare all scenarios'):
+        st.write('Total monthly cost for every housing distribution, rent type and proportion of the burdened '
+                 'population, summed across the selected counties.')
+        sweep_df = analysis.cost_scenario_sweep(df, metro_areas)
+        visualization.make_scenario_chart(sweep_df)
+        st.download_button('Download scenario data', sweep_df.to_csv(index=False).encode('utf-8'),
+                           file_name='cost_scenarios.csv')
     return cost_df
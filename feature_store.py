@@ -0,0 +1,146 @@
+"""
+Wide columnar store of every census tract table.
+
+Each state is one parquet partition under ``Data/features/<data version>/`` holding every ``CENSUS_TABLES`` column
+for every tract of the state, sorted by tract id, plus a ``has_<table>`` flag per table. Table columns are stored as
+``<table>/<column>``, so a column several tables hold keeps each table's values, and ``tables.parquet`` records which
+columns each table contributes. Selecting tables is a projection of those columns over the state partition, keeping the tracts every
+selected table has data for and taking a shared column from the first selected table holding it (as the joins in
+``queries.census_tracts_query`` do). Partitions are read column by column and kept in memory, so adding a table to a
+selection only reads the columns not loaded yet.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+
+import queries
+from constants import DATA_VERSION
+
+STORE_DIR = os.path.join('Data', 'features')
+
+MANIFEST = 'tables.parquet'
+
+KEY_COLUMNS = ['Census Tract', 'county_id', 'county_name', 'state_name', 'tot_population_census_2010']
+
+_partitions = {}
+_manifests = {}
+
+
+def presence_column(table: str) -> str:
+    return f'has_{table}'
+
+
+def stored_column(table: str, column: str) -> str:
+    return f'{table}/{column}'
+
+
+def partition_path(state: str, directory: str = STORE_DIR) -> str:
+    return os.path.join(directory, DATA_VERSION, state + '.parquet')
+
+
+def build_state(state: str, county_ids: list, directory: str = STORE_DIR) -> pd.DataFrame:
+    """
+    Writes the partition of ``state`` (whose counties are ``county_ids``) and returns the columns of every table as
+    (table, column) rows.
+    """
+    keys = []
+    tables = []
+    manifest = []
+    for table in queries.CENSUS_TABLES:
+        df = queries.census_tracts_query(county_ids, [table], geometry=False)
+        if df is None or len(df) == 0:
+            continue
+        df = df.loc[:, ~df.columns.duplicated()].drop_duplicates('Census Tract')
+        columns = [c for c in df.columns if c not in KEY_COLUMNS]
+        manifest += [(table, c) for c in columns]
+        keys.append(df[KEY_COLUMNS])
+        tables.append((table, df[['Census Tract'] + columns]))
+
+    data = pd.concat(keys).drop_duplicates('Census Tract') if keys else pd.DataFrame(columns=KEY_COLUMNS)
+    data = data.sort_values('Census Tract').reset_index(drop=True)
+    for table, df in tables:
+        df = df.rename(columns={c: stored_column(table, c) for c in df.columns if c != 'Census Tract'})
+        data = data.merge(df, on='Census Tract', how='left')
+        data[presence_column(table)] = data['Census Tract'].isin(df['Census Tract'])
+    for table in queries.CENSUS_TABLES:
+        if presence_column(table) not in data.columns:
+            data[presence_column(table)] = False
+
+    os.makedirs(os.path.dirname(partition_path(state, directory)), exist_ok=True)
+    data.to_parquet(partition_path(state, directory), index=False)
+    _partitions.pop((state, directory), None)
+    return pd.DataFrame(manifest, columns=['table', 'column'])
+
+
+def build_store(states: list, workers: int = None, directory: str = STORE_DIR) -> dict:
+    """Builds every state partition in a process pool; returns the number of table columns found per state."""
+    counties = queries.all_counties_query()
+    county_ids = [counties.loc[counties['state_name'] == state, 'county_id'].drop_duplicates().to_list()
+                  for state in states]
+    workers = workers or min(os.cpu_count() or 1, 8)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        manifests = list(pool.map(build_state, states, county_ids, [directory] * len(states)))
+    manifest = pd.concat(manifests).drop_duplicates().reset_index(drop=True)
+    manifest.to_parquet(os.path.join(directory, DATA_VERSION, MANIFEST), index=False)
+    _manifests.pop(directory, None)
+    return {state: len(m) for state, m in zip(states, manifests)}
+
+
+def load_manifest(directory: str = STORE_DIR):
+    """Columns of every table, or None when the store has not been built."""
+    if directory not in _manifests:
+        path = os.path.join(directory, DATA_VERSION, MANIFEST)
+        if not os.path.exists(path):
+            return None
+        manifest = pd.read_parquet(path)
+        _manifests[directory] = {table: rows['column'].to_list()
+                                 for table, rows in manifest.groupby('table', sort=False)}
+    return _manifests[directory]
+
+
+def load_columns(state: str, columns: list, directory: str = STORE_DIR) -> pd.DataFrame:
+    """The in-memory partition of ``state`` after reading any of ``columns`` (and the keys) not loaded yet."""
+    loaded = _partitions.get((state, directory))
+    missing = [c for c in dict.fromkeys(KEY_COLUMNS + columns) if loaded is None or c not in loaded.columns]
+    if missing:
+        new = pd.read_parquet(partition_path(state, directory), columns=missing)
+        loaded = new if loaded is None else pd.concat([loaded, new], axis=1)
+        _partitions[(state, directory)] = loaded
+    return loaded
+
+
+def table_columns(tables: list, directory: str = STORE_DIR):
+    """
+    Columns of ``tables`` in selection order mapped to the stored column each is read from (that of the first table
+    holding it), or None when a table is not in the store.
+    """
+    manifest = load_manifest(directory)
+    if manifest is None or not all(t in manifest for t in tables):
+        return None
+    columns = {}
+    for table in tables:
+        for c in manifest[table]:
+            if c not in KEY_COLUMNS:
+                columns.setdefault(c, stored_column(table, c))
+    return columns
+
+
+def tract_data(state: str, county_ids: list, tables: list, directory: str = STORE_DIR):
+    """Columns of ``tables`` for the tracts of ``county_ids`` every table has data for, or None without a store."""
+    columns = table_columns(tables, directory)
+    if columns is None or not os.path.exists(partition_path(state, directory)):
+        return None
+    presence = [presence_column(t) for t in tables]
+    partition = load_columns(state, list(columns.values()) + presence, directory)
+    rows = partition['county_id'].isin(county_ids) & partition[presence].all(axis=1)
+    data = partition.loc[rows, KEY_COLUMNS + list(columns.values())].reset_index(drop=True)
+    data.columns = KEY_COLUMNS + list(columns)
+    return data
+
+
+def census_tracts(state: str, county_ids: list, tables: list, directory: str = STORE_DIR):
+    """Store-backed equivalent of ``queries.latest_data_census_tracts``, or None when the store cannot serve it."""
+    data = tract_data(state, county_ids, tables, directory)
+    if data is None:
+        return None
+    return queries.census_tracts_geom_query(county_ids).merge(data, on='Census Tract', how='inner')
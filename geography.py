@@ -0,0 +1,81 @@
+"""
+Integer geography keys.
+
+Frames are normalized to integer FIPS codes as soon as they leave the database so that every merge and ``isin`` filter
+runs on integer keys: ``state_id`` (2 digits), ``county_id`` (5 digits, state * 1000 + county) and ``tract_id`` /
+``Census Tract`` (11 digits). State and county names are only attached for display.
+"""
+import pandas as pd
+
+KEY_DTYPES = {
+    'state_id': 'int32',
+    'state_fips': 'int32',
+    'county_id': 'int32',
+    'fips': 'int32',
+    'cnty_fips': 'int32',
+    'tract_id': 'int64',
+    'Census Tract': 'int64',
+}
+
+KEY_WIDTHS = {
+    'state': 2,
+    'county': 5,
+    'tract': 11,
+}
+
+
+def to_fips(values, dtype: str = 'int32') -> pd.Series:
+    keys = pd.to_numeric(pd.Series(values), errors='coerce')
+    if keys.isnull().any():
+        # Nullable integer keeps missing ids joinable without falling back to float
+        return keys.astype(dtype.capitalize())
+    return keys.astype(dtype)
+
+
+def normalize_keys(df: pd.DataFrame) -> pd.DataFrame:
+    for col, dtype in KEY_DTYPES.items():
+        if col in df.columns and not isinstance(df[col], pd.DataFrame) and str(df[col].dtype).lower() != dtype:
+            df[col] = to_fips(df[col], dtype)
+    return df
+
+
+def sql_in(ids, level: str = 'county') -> str:
+    # Zero-padded literals compare correctly against both integer and text id columns
+    width = KEY_WIDTHS[level]
+    keys = to_fips(ids, 'int64').dropna().unique()
+    if len(keys) == 0:
+        return '(NULL)'
+    return "(" + ",".join("'" + str(int(k)).zfill(width) + "'" for k in keys) + ")"
+
+
+def county_ids(counties_df: pd.DataFrame, state: str, names: list) -> list:
+    names = {str(n).strip().lower() for n in names}
+    in_state = counties_df['state_name'].str.strip().str.lower() == state.strip().lower()
+    selected = counties_df.loc[in_state & counties_df['county_name'].str.strip().str.lower().isin(names), 'county_id']
+    return selected.drop_duplicates().to_list()
+
+
+def attach_county_ids(df: pd.DataFrame, counties_df: pd.DataFrame, states: list = None) -> pd.DataFrame:
+    """
+    Resolves 'County Name' (and 'State' when present) in a frame without ids to integer county ids.
+    Rows that cannot be resolved unambiguously are dropped.
+    """
+    if 'county_id' in df.columns:
+        return normalize_keys(df)
+    lookup = counties_df[['state_name', 'county_name', 'county_id']].drop_duplicates()
+    lookup = lookup.assign(_state=lookup['state_name'].str.strip().str.lower(),
+                           _county=lookup['county_name'].str.strip().str.lower())
+    if states is not None:
+        lookup = lookup[lookup['_state'].isin([str(s).strip().lower() for s in states])]
+
+    left = df.assign(_county=df['County Name'].astype(str).str.strip().str.lower())
+    on = ['_county']
+    if 'State' in df.columns:
+        left['_state'] = left['State'].astype(str).str.strip().str.lower()
+        on.append('_state')
+    else:
+        lookup = lookup[~lookup.duplicated('_county', keep=False)]
+
+    res = left.merge(lookup[on + ['county_id']], on=on, how='inner')
+    res.drop(['_state', '_county'], axis=1, inplace=True, errors='ignore')
+    return normalize_keys(res)
@@ -0,0 +1,273 @@
+"""
+Columnar, memory-mapped geometry store for counties and census tracts.
+
+Each geography kind is kept as a handful of flat ``.npy`` arrays laid out like GeoArrow multipolygons:
+
+* ``geoids``       - sorted int64 ids (county_id or tract_id)
+* ``geom_offsets`` - geometry -> first polygon part
+* ``part_offsets`` - polygon part -> first ring
+* ``ring_offsets`` - ring -> first coordinate
+* ``coords``       - (n, 2) float64 lon/lat buffer
+
+Census tracts also carry ``sqmi`` (equal-area land area) and ``population`` arrays in geoid order, the denominators of
+the Per Square Mile and Per Capita formats.
+
+The arrays are opened with ``mmap_mode='r'`` so every session and every worker process shares the same pages through
+the OS page cache, and slicing a set of geographies never materializes shapely objects.
+Stores live under ``Data/geometry/<data version>/<kind>/``. A rebuild writes a fresh directory and swaps it into
+place, so files mapped by running processes are never truncated and readers never see a partially written store.
+"""
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+from constants import DATA_VERSION
+
+STORE_DIR = os.path.join('Data', 'geometry')
+
+KINDS = {
+    'county': 'county_id',
+    'tract': 'Census Tract',
+}
+
+ARRAYS = ['geoids', 'geom_offsets', 'part_offsets', 'ring_offsets', 'coords']
+
+# Optional per-geography values stored next to the geometry, in geoid order
+ATTRIBUTES = ['sqmi', 'population']
+
+EARTH_RADIUS_KM = 6371.0088
+
+SQKM_PER_SQMI = 2.589988110336
+
+_stores = {}
+
+
+def polygon_parts(geom) -> list:
+    if geom is None or geom.is_empty:
+        return []
+    if geom.geom_type == 'MultiPolygon':
+        return list(geom.geoms)
+    if geom.geom_type == 'Polygon':
+        return [geom]
+    if geom.geom_type == 'GeometryCollection':
+        parts = []
+        for g in geom.geoms:
+            parts += polygon_parts(g)
+        return parts
+    return []
+
+
+def equal_area_sqmi(geoms) -> np.ndarray:
+    """
+    Area of every geometry in square miles, measured in a sinusoidal (equal-area) projection centered on the
+    geometry's mean longitude; holes are subtracted.
+    """
+    coords, owners, ring_starts, exterior = [], [], [], []
+    n_coords = 0
+    for i, geom in enumerate(geoms):
+        for part in polygon_parts(geom):
+            for j, ring in enumerate([part.exterior] + list(part.interiors)):
+                ring_coords = np.asarray(ring.coords, dtype='float64')[:, :2]
+                if len(ring_coords) < 3:
+                    continue
+                coords.append(ring_coords)
+                owners.append(i)
+                ring_starts.append(n_coords)
+                exterior.append(j == 0)
+                n_coords += len(ring_coords)
+    areas = np.zeros(len(geoms))
+    if not coords:
+        return areas
+    coords = np.concatenate(coords)
+    owners = np.asarray(owners, dtype='int64')
+    ring_starts = np.asarray(ring_starts, dtype='int64')
+    ring_of = np.repeat(np.arange(len(ring_starts)), np.diff(np.append(ring_starts, n_coords)))
+
+    lon0 = (np.bincount(owners[ring_of], coords[:, 0], len(geoms)) /
+            np.maximum(np.bincount(owners[ring_of], minlength=len(geoms)), 1))
+    lat = np.deg2rad(coords[:, 1])
+    x = EARTH_RADIUS_KM * np.deg2rad(coords[:, 0] - lon0[owners[ring_of]]) * np.cos(lat)
+    y = EARTH_RADIUS_KM * lat
+    # Shoelace terms against the next vertex of the same ring
+    following = np.arange(n_coords) + 1
+    ring_ends = np.append(ring_starts[1:], n_coords)
+    following[ring_ends - 1] = ring_starts
+    ring_areas = np.abs(np.add.reduceat(x * y[following] - x[following] * y, ring_starts)) / 2
+    np.add.at(areas, owners, np.where(exterior, ring_areas, -ring_areas))
+    return np.maximum(areas, 0) / SQKM_PER_SQMI
+
+
+def build_store(kind: str, geoids, geoms, directory: str = STORE_DIR, attributes: dict = None):
+    """
+    Writes the columnar arrays for ``kind`` from parallel sequences of ids and shapely geometries, along with any
+    ``attributes`` (ATTRIBUTES name -> values parallel to the ids).
+    """
+    geoids = np.asarray(pd.to_numeric(pd.Series(geoids)), dtype='int64')
+    order = np.argsort(geoids, kind='mergesort')
+    geoms = list(geoms)
+
+    coord_chunks = []
+    geom_offsets = [0]
+    part_offsets = [0]
+    ring_offsets = [0]
+    n_coords = 0
+    for i in order:
+        for part in polygon_parts(geoms[i]):
+            for ring in [part.exterior] + list(part.interiors):
+                ring_coords = np.asarray(ring.coords, dtype='float64')[:, :2]
+                coord_chunks.append(ring_coords)
+                n_coords += len(ring_coords)
+                ring_offsets.append(n_coords)
+            part_offsets.append(len(ring_offsets) - 1)
+        geom_offsets.append(len(part_offsets) - 1)
+
+    arrays = {
+        'geoids': geoids[order],
+        'geom_offsets': np.asarray(geom_offsets, dtype='int64'),
+        'part_offsets': np.asarray(part_offsets, dtype='int64'),
+        'ring_offsets': np.asarray(ring_offsets, dtype='int64'),
+        'coords': np.concatenate(coord_chunks) if coord_chunks else np.empty((0, 2), dtype='float64'),
+    }
+    for name in ATTRIBUTES:
+        if attributes is not None and name in attributes:
+            arrays[name] = np.asarray(attributes[name], dtype='float64')[order]
+
+    parent = os.path.join(directory, DATA_VERSION)
+    os.makedirs(parent, exist_ok=True)
+    build = tempfile.mkdtemp(prefix=f'.{kind}-', dir=parent)
+    os.chmod(build, 0o755)
+    for name, arr in arrays.items():
+        np.save(os.path.join(build, name + '.npy'), arr)
+    path = store_path(kind, directory)
+    retired = None
+    if os.path.exists(path):
+        # Unlinking keeps the old files alive for processes that still map them
+        retired = tempfile.mkdtemp(prefix=f'.{kind}-retired-', dir=parent)
+        os.replace(path, os.path.join(retired, kind))
+    os.replace(build, path)
+    if retired is not None:
+        shutil.rmtree(retired, ignore_errors=True)
+    return path
+
+
+def store_path(kind: str, directory: str = STORE_DIR) -> str:
+    return os.path.join(directory, DATA_VERSION, kind)
+
+
+class GeometryStore(object):
+
+    def __init__(self, kind: str, directory: str = STORE_DIR):
+        self.kind = kind
+        self.key = KINDS[kind]
+        path = store_path(kind, directory)
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+        self.attribute_arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                                 for name in ATTRIBUTES if os.path.exists(os.path.join(path, name + '.npy'))}
+
+    def __len__(self):
+        return len(self.geoids)
+
+    def positions(self, ids) -> np.ndarray:
+        """Row positions of ``ids`` in the store, -1 where an id has no geometry."""
+        ids = np.asarray(pd.to_numeric(pd.Series(ids), errors='coerce').fillna(-1), dtype='int64')
+        pos = np.searchsorted(self.geoids, ids)
+        pos = np.minimum(pos, len(self.geoids) - 1) if len(self.geoids) else np.zeros(len(ids), dtype='int64')
+        found = (self.geoids[pos] == ids) if len(self.geoids) else np.zeros(len(ids), dtype=bool)
+        return np.where(found, pos, -1)
+
+    def attributes(self, ids, names: list = None):
+        """Stored attributes of ``ids`` (NaN where an id has no geometry), or None when any of them was not built."""
+        names = ATTRIBUTES if names is None else names
+        if not all(name in self.attribute_arrays for name in names):
+            return None
+        pos = self.positions(ids)
+        valid = pos >= 0
+        res = {}
+        for name in names:
+            values = np.full(len(pos), np.nan)
+            values[valid] = self.attribute_arrays[name][pos[valid]]
+            res[name] = values
+        return pd.DataFrame(res)
+
+    def coordinate_bounds(self, pos: np.ndarray) -> tuple:
+        """Start/end offsets into ``coords`` for each geometry position."""
+        pos = np.asarray(pos, dtype='int64')
+        first_ring = self.part_offsets[self.geom_offsets[pos]]
+        last_ring = self.part_offsets[self.geom_offsets[pos + 1]]
+        return self.ring_offsets[first_ring], self.ring_offsets[last_ring]
+
+    def slice(self, start: int, stop: int) -> np.ndarray:
+        """Zero-copy view of the coordinates of geometries ``start:stop`` (positions, not ids)."""
+        begin, end = self.coordinate_bounds(np.array([start, stop - 1]))
+        return self.coords[begin[0]:end[1]]
+
+    def coordinates(self, ids) -> list:
+        """Per-id zero-copy coordinate views; empty arrays for ids without geometry."""
+        pos = self.positions(ids)
+        valid = pos >= 0
+        starts = np.zeros(len(pos), dtype='int64')
+        ends = np.zeros(len(pos), dtype='int64')
+        if valid.any():
+            starts[valid], ends[valid] = self.coordinate_bounds(pos[valid])
+        return [self.coords[s:e] for s, e in zip(starts, ends)]
+
+    def polygon_paths(self, ids, decimals: int = 6) -> list:
+        """Polygon coordinates in the nested list layout pydeck's PolygonLayer expects."""
+        return [[np.round(c, decimals).tolist()] for c in self.coordinates(ids)]
+
+
+def load_store(kind: str, directory: str = STORE_DIR):
+    """
+    Process-wide store for ``kind``, or None when it has not been built for the current data version.
+    A store rebuilt by another process is a new directory, so it is picked up on the next call.
+    """
+    path = store_path(kind, directory)
+    key = (kind, directory, DATA_VERSION)
+    while True:
+        identity = _identity(path)
+        if identity is None or not os.path.exists(os.path.join(path, 'coords.npy')):
+            return None
+        if key in _stores and _stores[key][0] == identity:
+            return _stores[key][1]
+        store = GeometryStore(kind, directory)
+        # Only keep a store whose directory was not swapped while its arrays were being opened
+        if _identity(path) == identity:
+            _stores[key] = (identity, store)
+
+
+def _identity(path: str):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def polygon_frame(data_df: pd.DataFrame, map_features: list):
+    """
+    Map-ready frame with coordinates, name and features read straight from the store.
+    Returns None when no store exists for the geography of ``data_df``.
+    """
+    kind = 'tract' if 'Census Tract' in data_df.columns else 'county'
+    store = load_store(kind)
+    if store is None:
+        return None
+    key = KINDS[kind]
+    cols = [key] + [f for f in map_features if f != key]
+    if kind == 'county' and 'County Name' in data_df.columns:
+        cols.append('County Name')
+    frame = data_df.loc[:, ~data_df.columns.duplicated()][cols].round(3)
+    paths = store.polygon_paths(frame[key])
+    # Ids without stored geometry are left out, as the merge with the geometry table did; the map's view state is
+    # anchored on the first row's coordinates
+    drawn = np.array([len(path[0]) > 0 for path in paths], dtype=bool)
+    frame = frame.loc[drawn].reset_index(drop=True)
+    frame['coordinates'] = [path for path, keep in zip(paths, drawn) if keep]
+    if kind == 'tract':
+        frame['name'] = frame[key].astype(str)
+    else:
+        frame['name'] = frame['County Name'] if 'County Name' in frame.columns else frame[key].astype(str)
+    return frame
@@ -0,0 +1,156 @@
+"""
+Derived census tract indicators.
+
+Every derived column is declared once in ``INDICATORS`` as::
+
+    name: {'sum': [...], 'subtract': [...], 'times': [...], 'per': [...], 'scale': 1}
+
+which evaluates to ``(sum(sum) - sum(subtract)) * prod(times) / sum(per) * scale``. Entries may refer to raw ACS
+columns or to other entries; the registry is compiled into a dependency graph so each intermediate is evaluated once
+per frame, and ``required_columns`` reports the raw columns a set of indicators needs.
+"""
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+AGE_19_OR_UNDER_COLUMNS = [
+    'female_under_5', 'female_5_to_9', 'female_10_to_14', 'female_15_to_17', 'female_18_and_19',
+    'male_under_5', 'male_5_to_9', 'male_10_to_14', 'male_15_to_17', 'male_18_and_19',
+]
+
+AGE_65_OR_OVER_COLUMNS = [
+    'female_65_and_66', 'female_67_to_69', 'female_70_to_74', 'female_75_to_79', 'female_80_to_84',
+    'female_85_and_over',
+    'male_65_and_66', 'male_67_to_69', 'male_70_to_74', 'male_75_to_79', 'male_80_to_84', 'male_85_and_over',
+]
+
+DISABILITY_COLUMNS = [
+    'male_under_5_w_a_disability', 'male_5_to_17_w_a_disability', 'male_18_to_34_w_a_disability',
+    'male_35_to_64_w_a_disability', 'male_65_to_74_w_a_disability', 'male_75_and_over_w_a_disability',
+    'female_under_5_w_a_disability', 'female_5_to_17_w_a_disability', 'female_18_to_34_w_a_disability',
+    'female_35_to_64_w_a_disability', 'female_65_to_74_w_a_disability', 'female_75_and_over_w_a_disability',
+]
+
+ENGLISH_NOT_WELL_COLUMNS = [
+    'foreign_speak_spanish_speak_eng_not_well', 'foreign_speak_spanish_speak_eng_not_at_all',
+    'foreign_speak_other_indo-euro_speak_eng_not_well', 'foreign_speak_other_indo-euro_speak_eng_not_at_all',
+    'foreign_speak_asian_or_pac_isl_lang_speak_eng_not_well',
+    'foreign_speak_asian_or_pac_isl_lang_speak_eng_not_at_all',
+    'foreign_speak_other_speak_eng_not_well', 'foreign_speak_other_speak_eng_not_at_all',
+]
+
+COMPUTER_COLUMNS = [
+    'household_no_computing_device', 'household_computer', 'household_smartphone_no_computer',
+    'household_no_internet', 'household_broadband',
+]
+
+INDICATORS = {
+    # Intermediates
+    'Age 19 or Under': {'sum': AGE_19_OR_UNDER_COLUMNS},
+    'Age 65 or Over': {'sum': AGE_65_OR_OVER_COLUMNS},
+    'total_w_a_disability': {'sum': DISABILITY_COLUMNS},
+    'speak_eng_not_well': {'sum': ENGLISH_NOT_WELL_COLUMNS},
+    'single_parent': {'sum': ['other_male_householder_no_spouse_w_kids', 'other_female_householder_no_spouse_w_kids']},
+    'non-white': {'sum': ['total_population'], 'subtract': ['not_hisp_or_latino_white']},
+    'number_drive_alone': {'sum': ['percent_drive_alone'], 'times': ['total_workers_commute']},
+
+    # Percentages
+    'People of Color (%)': {'sum': ['non-white'], 'per': ['total_population'], 'scale': 100},
+    '200% Below Poverty Level (%)': {'sum': ['200_below_pov_level'],
+                                     'per': ['population_for_whom_poverty_status_is_determined'], 'scale': 100},
+    'People with Disability (%)': {'sum': ['total_w_a_disability'], 'per': ['male', 'female'], 'scale': 100},
+    'Age 19 or Under (%)': {'sum': ['Age 19 or Under'], 'per': ['total_population'], 'scale': 100},
+    'Age 65 or Over (%)': {'sum': ['Age 65 or Over'], 'per': ['total_population'], 'scale': 100},
+    'Limited English Proficiency (%)': {'sum': ['speak_eng_not_well'], 'per': ['native', 'foreign_born'],
+                                        'scale': 100},
+    'Single Parent Family (%)': {'sum': ['single_parent'], 'per': ['total_families'], 'scale': 100},
+    'Zero-Vehicle Household (%)': {'sum': ['percent_hh_0_veh'], 'scale': 100},
+    'No Computer Households (%)': {'sum': ['household_no_computing_device'], 'per': COMPUTER_COLUMNS, 'scale': 100},
+    'Renter Occupied Units (%)': {'sum': ['renter-occ_units'], 'per': ['occupied_housing_units'], 'scale': 100},
+}
+
+EQUITY_INDICATORS = [
+    'Age 19 or Under', 'Age 65 or Over', 'total_w_a_disability', 'speak_eng_not_well', 'single_parent', 'non-white',
+    'People with Disability (%)', '200% Below Poverty Level (%)', 'Age 19 or Under (%)', 'Age 65 or Over (%)',
+    'Limited English Proficiency (%)', 'Single Parent Family (%)', 'Zero-Vehicle Household (%)', 'People of Color (%)',
+]
+
+TRANSPORT_INDICATORS = [
+    'number_drive_alone', 'non-white', 'People of Color (%)', 'No Computer Households (%)',
+    '200% Below Poverty Level (%)', 'Renter Occupied Units (%)', 'Age 19 or Under', 'Age 19 or Under (%)',
+    'Age 65 or Over', 'Age 65 or Over (%)', 'speak_eng_not_well', 'Limited English Proficiency (%)',
+    'single_parent', 'Single Parent Family (%)',
+]
+
+TERMS = ['sum', 'subtract', 'times', 'per']
+
+
+def dependencies(name: str) -> list:
+    definition = INDICATORS[name]
+    return [col for term in TERMS for col in definition.get(term, [])]
+
+
+@lru_cache(maxsize=None)
+def _compile(names: tuple) -> tuple:
+    order = []
+    raw = set()
+    visiting = set()
+
+    def visit(name):
+        if name in order:
+            return
+        if name in visiting:
+            raise ValueError(f'Circular indicator definition: {name}')
+        visiting.add(name)
+        for dep in dependencies(name):
+            if dep in INDICATORS:
+                visit(dep)
+            else:
+                raw.add(dep)
+        visiting.discard(name)
+        order.append(name)
+
+    for name in names:
+        visit(name)
+    return tuple(order), tuple(sorted(raw))
+
+
+def evaluation_order(names: list) -> list:
+    """Indicators in ``names`` plus everything they depend on, each after its dependencies."""
+    return list(_compile(tuple(names))[0])
+
+
+def required_columns(names: list) -> list:
+    """Raw columns needed to evaluate ``names``."""
+    return list(_compile(tuple(names))[1])
+
+
+def _block(values: dict, data: pd.DataFrame, cols: list) -> np.ndarray:
+    missing = [c for c in cols if c not in values]
+    if missing:
+        block = data[missing].to_numpy(dtype='float64')
+        for i, col in enumerate(missing):
+            values[col] = block[:, i]
+    if len(cols) == 1:
+        return values[cols[0]]
+    return np.sum([values[c] for c in cols], axis=0)
+
+
+def evaluate(data: pd.DataFrame, names: list) -> pd.DataFrame:
+    """Adds ``names`` and their intermediates to ``data`` as columns, evaluating each definition once."""
+    values = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for name in evaluation_order(names):
+            definition = INDICATORS[name]
+            res = _block(values, data, definition['sum'])
+            if definition.get('subtract'):
+                res = res - _block(values, data, definition['subtract'])
+            for col in definition.get('times', []):
+                res = res * _block(values, data, [col])
+            if definition.get('per'):
+                res = res / _block(values, data, definition['per'])
+            if definition.get('scale', 1) != 1:
+                res = res * definition['scale']
+            values[name] = res
+            data[name] = res
+    return data
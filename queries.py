@@ -1,15 +1,18 @@
 import os
 import sys
 import psycopg2
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 from sqlalchemy import create_engine
 from shapely import wkb
 import streamlit as st
-from sklearn import preprocessing
 
 import credentials
-from constants import STATES
+import geography
+import geometry_store
+import indicators
+from constants import STATES, DATA_VERSION
 
 FRED_TABLES = [
     'burdened_households',
@@ -88,6 +91,19 @@ POSITIVE_TRANSPORT_CENSUS_HEADERS = [
     'Bicycle Commuters (%)'
 ]
 
+TRANSPORT_RENAMES = {
+    'percent_hh_0_veh': 'Zero-Vehicle Households (%)',
+    'vehicle_miles_traveled': 'Vehicle Miles Traveled',
+    # 'household_no_computing_device': 'No Computer Households',
+    # 'household_no_internet': 'No Internet Households',
+    'percent_drive_alone': 'Drive Alone Commuters (%)',
+    # 'number_drive_alone': 'Drive Alone (#)',
+    'mean_travel_time': "Average Commute Time (min)",
+    # 'walkability_index': "Walkability Index",
+    'percent_public_transport': 'Public Transport Commuters (%)',
+    'percent_bicycle': 'Bicycle Commuters (%)'
+}
+
 TABLE_UNITS = {
     'burdened_households': '%',
     'homeownership_rate': '%',
@@ -156,6 +172,15 @@ EQUITY_CENSUS_TABLES = [
     'family_type'
 ]
 
+# Raw columns the equity and transport pages read; everything else is left in the database
+EQUITY_CENSUS_COLUMNS = indicators.required_columns(indicators.EQUITY_INDICATORS)
+
+TRANSPORT_CENSUS_COLUMNS = sorted(set(indicators.required_columns(indicators.TRANSPORT_INDICATORS)) |
+                                  set(TRANSPORT_RENAMES))
+
+# Counties fetched per query when streaming tract data
+CHUNK_COUNTIES = 50
+
 TRANSPORT_CENSUS_TABLES = [
     'poverty_status',
     #  'resident_population_census_tract',
@@ -214,7 +239,7 @@ def all_counties_query(where: str = None) -> pd.DataFrame:
     results = cur.fetchall()
     conn.commit()
     df = pd.DataFrame(results, columns=colnames)
-    return df
+    return geography.normalize_keys(df)
 
 
 def table_names_query() -> list:
@@ -255,19 +280,56 @@ def read_table(table: str, columns: list = None, where: str = None, order_by: st
                       AND {table}.date=max_county.date"""
     query += ';'
     df = pd.read_sql(query, con=conn)
-    return df
+    return geography.normalize_keys(df)
 
 
-@st.experimental_memo(ttl=1200)
-def latest_data_census_tracts(state: str, counties: list, tables: list) -> pd.DataFrame:
+@st.experimental_memo
+def table_columns_query(tables: list, data_version: str = DATA_VERSION) -> dict:
     conn = init_connection()
     cur = conn.cursor()
-    tracts_df = census_tracts_geom_query(counties, state)
-    counties_str = str(tuple(counties)).replace(',)', ')')
-    where_clause = f"WHERE id_index.state_name ='{state}' AND id_index.county_name IN {counties_str}"
+    names = ",".join("'" + t + "'" for t in tables)
+    cur.execute(f"""SELECT table_name, column_name FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name IN ({names})
+        ORDER BY table_name, ordinal_position
+        """)
+    results = cur.fetchall()
+    conn.commit()
+
+    res = {t: [] for t in tables}
+    for table_name, column_name in results:
+        res[table_name].append(column_name)
+    return res
+
 
+def census_select_list(tables: list, columns: list = None, table_columns: dict = None) -> dict:
+    """
+    Per-table SELECT lists. With ``columns`` each table only selects the required columns it holds that no earlier
+    table already provides; tables contributing nothing are left out. ``table_columns`` defaults to the cached
+    ``table_columns_query``.
+    """
+    if columns is None:
+        return {t: f"{t}.*" for t in tables}
+    if table_columns is None:
+        table_columns = table_columns_query(tables)
+    remaining = set(columns)
+    selects = {}
     for table_name in tables:
-        query = f"""SELECT {table_name}.*, id_index.county_name, id_index.county_id, id_index.state_name, id_index.tract_id,
+        cols = [c for c in table_columns[table_name] if c in remaining]
+        if len(cols) > 0:
+            remaining.difference_update(cols)
+            selects[table_name] = ", ".join(f'{table_name}."{c}"' for c in cols)
+    return selects
+
+
+def census_tracts_query(county_ids: list, tables: list, columns: list = None, geometry: bool = True,
+                        table_columns: dict = None) -> pd.DataFrame:
+    conn = init_connection()
+    cur = conn.cursor()
+    tracts_df = census_tracts_geom_query(county_ids) if geometry else None
+    where_clause = f"WHERE id_index.county_id IN {geography.sql_in(county_ids)}"
+
+    for table_name, select_list in census_select_list(tables, columns, table_columns).items():
+        query = f"""SELECT {select_list}, id_index.county_name, id_index.county_id, id_index.state_name, id_index.tract_id,
         resident_population_census_tract.tot_population_census_2010
             FROM {table_name} 
             INNER JOIN id_index ON {table_name}.tract_id = id_index.tract_id
@@ -282,13 +344,32 @@ def latest_data_census_tracts(state: str, counties: list, tables: list) -> pd.Da
         df = df.loc[:, ~df.columns.duplicated()]
 
         df.rename({'tract_id': 'Census Tract'}, axis=1, inplace=True)
+        df = geography.normalize_keys(df)
 
+        if tracts_df is None:
+            tracts_df = df
+            continue
         tracts_df = tracts_df.merge(df, on="Census Tract", how="inner", suffixes=('', '_y'))
         tracts_df.drop(tracts_df.filter(regex='_y$').columns.tolist(), axis=1, inplace=True)
         tracts_df = tracts_df.loc[:, ~tracts_df.columns.duplicated()]
     return tracts_df
 
 
+@st.experimental_memo(ttl=1200)
+def latest_data_census_tracts(county_ids: list, tables: list, columns: list = None) -> pd.DataFrame:
+    return census_tracts_query(county_ids, tables, columns)
+
+
+def iter_census_tracts(county_ids: list, tables: list, columns: list = None,
+                       chunk_counties: int = CHUNK_COUNTIES):
+    """Tract data for ``county_ids`` a few counties at a time, without geometry and without caching."""
+    county_ids = list(county_ids)
+    for start in range(0, len(county_ids), chunk_counties):
+        chunk = census_tracts_query(county_ids[start:start + chunk_counties], tables, columns, geometry=False)
+        if chunk is not None and len(chunk) > 0:
+            yield chunk
+
+
 def load_distributions() -> tuple:
     metro_areas = generic_select_query('housing_stock_distribution', [
         'location',
@@ -315,7 +396,7 @@ def policy_query() -> pd.DataFrame:
     results = cur.fetchall()
     conn.commit()
 
-    return pd.DataFrame(results, columns=colnames)
+    return geography.normalize_keys(pd.DataFrame(results, columns=colnames))
 
 
 def latest_data_single_table(table_name: str, require_counties: bool = True) -> pd.DataFrame:
@@ -332,7 +413,7 @@ def latest_data_single_table(table_name: str, require_counties: bool = True) ->
 
     colnames = [desc[0] for desc in cur.description]
 
-    df = pd.DataFrame(results, columns=colnames)
+    df = geography.normalize_keys(pd.DataFrame(results, columns=colnames))
     if require_counties:
         counties_df = all_counties_query()
         df = counties_df.merge(df)
@@ -350,7 +431,8 @@ def fred_query(counties_str: str) -> pd.DataFrame:
         frames.append(f_df)
     fred_df = pd.concat(frames, axis=1)
     fred_df = fred_df.loc[:, ~fred_df.columns.duplicated()]
-    fred_df = fred_df.astype(float)
+    value_cols = list(set(fred_df.columns) - {'county_id'})
+    fred_df[value_cols] = fred_df[value_cols].astype(float)
     chmura_df = static_data_single_table('chmura_economic_vulnerability_index', ['VulnerabilityIndex'])
     fred_df = fred_df.merge(chmura_df, how='outer', on='county_id', suffixes=('', '_DROP')).filter(
         regex='^(?!.*_DROP)')
@@ -360,7 +442,7 @@ def fred_query(counties_str: str) -> pd.DataFrame:
 @st.experimental_memo(ttl=1200)
 def get_all_county_data(state: str, counties: list) -> pd.DataFrame:
     if counties:
-        counties_str = "(" + ",".join(["'" + str(_) + "'" for _ in counties]) + ")"
+        counties_str = geography.sql_in(counties)
         demo_df = read_table('county_demographics', where=f"county_id in {counties_str}")
         fred_df = fred_query(counties_str)
         demo_df = demo_df.merge(fred_df, on='county_id', how='inner', suffixes=('', '_DROP')).filter(
@@ -370,7 +452,7 @@ def get_all_county_data(state: str, counties: list) -> pd.DataFrame:
         demo_df = read_table('county_demographics', where=f"state_name='{state}';")
         counties = all_counties_query(f"state_name='{state}'")
         county_ids = counties['county_id'].to_list()
-        counties_str = "(" + ",".join(["'" + str(_) + "'" for _ in county_ids]) + ")"
+        counties_str = geography.sql_in(county_ids)
         fred_df = fred_query(counties_str=counties_str)
         demo_df = demo_df.merge(fred_df, on='county_id', how='inner', suffixes=('', '_DROP')).filter(
             regex='^(?!.*_DROP)')
@@ -381,7 +463,7 @@ def get_all_county_data(state: str, counties: list) -> pd.DataFrame:
             demo_df['age_under5'] + demo_df['age_5_9'] + demo_df['age_10_14'] + demo_df['age_15_19'])
     demo_df['Age 65 or Over'] = (demo_df['age_65_74'] + demo_df['age_75_84'] + demo_df['age_85_up'])
     demo_df['Non-White Population (%)'] = demo_df['Non-White Population'] / demo_df['population'] * 100
-    demo_df['fips'] = demo_df['fips'].astype(int)
+    demo_df = geography.normalize_keys(demo_df)
 
     demo_df.rename({
         'state_name': 'State',
@@ -420,7 +502,7 @@ def static_data_single_table(table_name: str, columns: list) -> pd.DataFrame:
     df = pd.DataFrame(results, columns=colnames)
     # counties_df = all_counties_query()
     # df = counties_df.merge(df, how='outer')
-    return df
+    return geography.normalize_keys(df)
 
 
 def generic_select_query(table_name: str, columns: list, where: str = None) -> pd.DataFrame:
@@ -436,72 +518,72 @@ def generic_select_query(table_name: str, columns: list, where: str = None) -> p
 
     colnames = [desc[0] for desc in cur.description]
     df = pd.DataFrame(results, columns=colnames)
-    return df
+    return geography.normalize_keys(df)
 
 
-@st.experimental_memo(ttl=1200)
-def get_county_geoms(counties_list: list, state: str) -> pd.DataFrame:
-    conn = init_connection()
-    counties_list = [_.replace("'", "''") for _ in counties_list]
-    counties = "(" + ",".join(["'" + str(_) + "'" for _ in counties_list]) + ")"
-    cur = conn.cursor()
-    query = f"SELECT * FROM county_geoms WHERE state_name='{state}' AND county_name in {counties};"
-    cur.execute(query)
-    results = cur.fetchall()
-    conn.commit()
+def county_geom_columns() -> str:
+    if geometry_store.load_store('county') is not None:
+        return 'county_id, county_name, state_name, sqmi'
+    return '*'
 
-    colnames = [desc[0] for desc in cur.description]
-    df = pd.DataFrame(results, columns=colnames)
+
+def load_geoms(df: pd.DataFrame, kind: str, tolerance: float, preserve_topology: bool) -> pd.Series:
+    # Geometries served from the columnar store are never materialized as shapely objects
+    if 'geom' not in df.columns or geometry_store.load_store(kind) is not None:
+        return pd.Series([None] * len(df), index=df.index, dtype=object)
     parcels = []
     for parcel in df['geom']:
         geom = wkb.loads(parcel, hex=True)
-        parcels.append(geom.simplify(tolerance=0.0001, preserve_topology=True))
-    geom_df = pd.DataFrame()
-    geom_df['county_id'] = df['county_id']
-    geom_df['County Name'] = df['county_name']
-    geom_df['State'] = df['state_name']
-    geom_df['Area sqmi'] = df['sqmi']
-    geom_df['geom'] = pd.Series(parcels)
-    return geom_df
+        parcels.append(geom.simplify(tolerance=tolerance, preserve_topology=preserve_topology))
+    return pd.Series(parcels)
+
+
+@st.experimental_memo
+def rent_reference(data_version: str = DATA_VERSION) -> dict:
+    # Dense per rent type lookup of bedroom 0-4 rents indexed directly by county_id, NaN for unknown counties
+    frames = {
+        'fmr': static_data_single_table('fair_market_rents_new', STATIC_COLUMNS['fair_market_rents']),
+        'rent50': static_data_single_table('median_rents_new', STATIC_COLUMNS['median_rents']),
+    }
+    size = max(int(f['county_id'].max()) for f in frames.values()) + 1
+    reference = {}
+    for rent_type, cost_df in frames.items():
+        cost_df = cost_df.dropna(subset=['county_id']).drop_duplicates(subset=['county_id'])
+        table = np.full((size, 5), np.nan)
+        table[cost_df['county_id'].to_numpy(dtype='int64')] = cost_df[
+            [f'{rent_type}_{b}' for b in range(5)]].to_numpy(dtype='float64')
+        reference[rent_type] = table
+    return reference
 
 
 @st.experimental_memo(ttl=1200)
-def get_county_geoms_by_id(counties_list: list) -> pd.DataFrame:
+def get_county_geoms(county_ids: list) -> pd.DataFrame:
     conn = init_connection()
-    counties = "(" + ",".join(["'" + str(_) + "'" for _ in counties_list]) + ")"
     cur = conn.cursor()
-    query = f"SELECT * FROM county_geoms WHERE county_id in {counties};"
+    query = f"SELECT {county_geom_columns()} FROM county_geoms WHERE county_id in {geography.sql_in(county_ids)};"
     cur.execute(query)
     results = cur.fetchall()
     conn.commit()
 
     colnames = [desc[0] for desc in cur.description]
-    df = pd.DataFrame(results, columns=colnames)
-    parcels = []
-    for parcel in df['geom']:
-        geom = wkb.loads(parcel, hex=True)
-        parcels.append(geom.simplify(tolerance=0.0001, preserve_topology=True))
+    df = geography.normalize_keys(pd.DataFrame(results, columns=colnames))
     geom_df = pd.DataFrame()
     geom_df['county_id'] = df['county_id']
     geom_df['County Name'] = df['county_name']
     geom_df['State'] = df['state_name']
     geom_df['Area sqmi'] = df['sqmi']
-    geom_df['geom'] = pd.Series(parcels)
+    geom_df['geom'] = load_geoms(df, 'county', tolerance=0.0001, preserve_topology=True)
     return geom_df
 
 
 @st.experimental_memo(ttl=1200)
-def census_tracts_geom_query(counties, state) -> pd.DataFrame:
+def census_tracts_geom_query(county_ids: list) -> pd.DataFrame:
     conn = init_connection()
     cur = conn.cursor()
-    if len(counties) > 1:
-        where_clause = 'WHERE id_index.state_name = ' + "'" + state + "'" + ' ' + 'AND id_index.county_name IN ' + str(
-            tuple(counties))
-    if len(counties) == 1:
-        where_clause = 'WHERE id_index.state_name = ' + "'" + state + "'" + ' ' + 'AND id_index.county_name IN (' + "'" + \
-                       counties[0] + "'" + ')'
+    where_clause = f"WHERE id_index.county_id IN {geography.sql_in(county_ids)}"
+    geom_column = '' if geometry_store.load_store('tract') is not None else ', census_tracts_geom.geom'
     query = f"""
-        SELECT id_index.county_name, id_index.state_name, census_tracts_geom.tract_id, census_tracts_geom.geom
+        SELECT id_index.county_name, id_index.state_name, census_tracts_geom.tract_id{geom_column}
         FROM id_index
         INNER JOIN census_tracts_geom ON census_tracts_geom.tract_id=id_index.tract_id
         {where_clause};
@@ -511,14 +593,10 @@ def census_tracts_geom_query(counties, state) -> pd.DataFrame:
     results = cur.fetchall()
     conn.commit()
 
-    df = pd.DataFrame(results, columns=colnames)
-    parcels = []
-    for parcel in df['geom']:
-        geom = wkb.loads(parcel, hex=True)
-        parcels.append(geom.simplify(tolerance=0.00005, preserve_topology=False))
+    df = geography.normalize_keys(pd.DataFrame(results, columns=colnames))
     geom_df = pd.DataFrame()
     geom_df['Census Tract'] = df['tract_id']
-    geom_df['geom'] = pd.Series(parcels)
+    geom_df['geom'] = load_geoms(df, 'tract', tolerance=0.00005, preserve_topology=False)
     return geom_df
 
 
@@ -534,7 +612,7 @@ def get_transit_stops_geoms(columns: list = [], where: str = None) -> pd.DataFra
         query += f" WHERE {where}"
     query += ';'
     df = gpd.read_postgis(query, conn)
-    return df
+    return geography.normalize_keys(df)
 
 
 @st.experimental_memo(ttl=1200)
@@ -550,7 +628,7 @@ def get_transit_shapes_geoms(columns: list = [], where: str = None) -> pd.DataFr
     query += ';'
     df = gpd.read_postgis(query, conn)
     df.drop_duplicates(subset=['geom'], inplace=True)
-    return df
+    return geography.normalize_keys(df)
 
 
 @st.experimental_memo(ttl=1200)
@@ -626,58 +704,12 @@ def clean_data(df: pd.DataFrame) -> pd.DataFrame:
 
 
 def clean_equity_data(data: pd.DataFrame) -> pd.DataFrame:
-    data['Age 19 or Under'] = (
-            data['female_under_5'] + data['female_5_to_9'] + data['female_10_to_14'] +
-            data['female_15_to_17'] + data['female_18_and_19'] +
-            data['male_under_5'] + data['male_5_to_9'] + data['male_10_to_14'] +
-            data['male_15_to_17'] + data['male_18_and_19']
-    )
-    data['Age 65 or Over'] = (
-            data['female_65_and_66'] + data['female_67_to_69'] + data['female_70_to_74'] +
-            data['female_75_to_79'] + data['female_80_to_84'] + data['female_85_and_over'] +
-            data['male_65_and_66'] + data['male_67_to_69'] + data['male_70_to_74'] +
-            data['male_75_to_79'] + data['male_80_to_84'] + data['male_85_and_over']
-    )
-
+    data = indicators.evaluate(data, indicators.EQUITY_INDICATORS)
     data.rename({'below_pov_level': 'Below Poverty Level', '200_below_pov_level': '200% Below Poverty Level'}, axis=1,
                 inplace=True)
 
-    data['total_w_a_disability'] = (data['male_under_5_w_a_disability'] + data['male_5_to_17_w_a_disability'] + data[
-        'male_18_to_34_w_a_disability'] +
-                                    data['male_35_to_64_w_a_disability'] + data['male_65_to_74_w_a_disability'] + data[
-                                        'male_75_and_over_w_a_disability'] +
-                                    data['female_under_5_w_a_disability'] + data['female_5_to_17_w_a_disability'] +
-                                    data['female_18_to_34_w_a_disability'] +
-                                    data['female_35_to_64_w_a_disability'] + data['female_65_to_74_w_a_disability'] +
-                                    data['female_75_and_over_w_a_disability']
-                                    )
-
-    data['speak_eng_not_well'] = (
-            data['foreign_speak_spanish_speak_eng_not_well'] + data['foreign_speak_spanish_speak_eng_not_at_all'] +
-            data['foreign_speak_other_indo-euro_speak_eng_not_well'] + data[
-                'foreign_speak_other_indo-euro_speak_eng_not_at_all'] +
-            data['foreign_speak_asian_or_pac_isl_lang_speak_eng_not_well'] + data[
-                'foreign_speak_asian_or_pac_isl_lang_speak_eng_not_at_all'] +
-            data['foreign_speak_other_speak_eng_not_well'] + data['foreign_speak_other_speak_eng_not_at_all']
-    )
-
-    data['single_parent'] = data['other_male_householder_no_spouse_w_kids'] + data[
-        'other_female_householder_no_spouse_w_kids']
-
-    data['non-white'] = data['total_population'] - data['not_hisp_or_latino_white']
-
-    data['People with Disability (%)'] = data['total_w_a_disability'] / (data['male'] + data['female'])
-    data['200% Below Poverty Level (%)'] = data['200% Below Poverty Level'] / data[
-        'population_for_whom_poverty_status_is_determined']
-    data['Age 19 or Under (%)'] = data['Age 19 or Under'] / data['total_population']
-    data['Age 65 or Over (%)'] = data['Age 65 or Over'] / data['total_population']
-    data['Limited English Proficiency (%)'] = data['speak_eng_not_well'] / (data['native'] + data['foreign_born'])
-    data['Single Parent Family (%)'] = data['single_parent'] / data['total_families']
-    data['Zero-Vehicle Household (%)'] = data['percent_hh_0_veh'] / 100
-    data['People of Color (%)'] = data['non-white'] / data['total_population']
-
     for header in (EQUITY_CENSUS_POC_LOW_INCOME + EQUITY_CENSUS_REMAINING_HEADERS):
-        data[header + ' (%)'] = round(data[header + ' (%)'] * 100)
+        data[header + ' (%)'] = round(data[header + ' (%)'])
 
     data['criteria_A'] = 0
     data['criteria_B'] = 0
@@ -688,203 +720,31 @@ def clean_equity_data(data: pd.DataFrame) -> pd.DataFrame:
     return data
 
 
-def clean_transport_data(data: pd.DataFrame, epc: pd.DataFrame) -> pd.DataFrame:
-    data['walkability_index'] = round(data['walkability_index'])
-    data['number_drive_alone'] = data['percent_drive_alone'] * data['total_workers_commute']
+def derive_transport_data(data: pd.DataFrame) -> pd.DataFrame:
+    data = indicators.evaluate(data, indicators.TRANSPORT_INDICATORS)
     data.drop(['total_workers_commute'], axis=1, inplace=True)
 
-    data['non-white'] = data['total_population'] - data['not_hisp_or_latino_white']
-    data['People of Color (%)'] = 100 * (data['non-white'] / data['total_population'])
-    data['No Computer Households (%)'] = 100 * (data['household_no_computing_device'] / (
-            data['household_no_computing_device'] + data['household_computer'] + data[
-        'household_smartphone_no_computer'] + data['household_no_internet'] + data['household_broadband']))
-    data['200% Below Poverty Level (%)'] = 100 * (
-            data['200_below_pov_level'] / data['population_for_whom_poverty_status_is_determined'])
-    data['Renter Occupied Units (%)'] = 100 * (data['renter-occ_units'] / data['occupied_housing_units'])
-
-    data.rename({
-        'percent_hh_0_veh': 'Zero-Vehicle Households (%)',
-        'vehicle_miles_traveled': 'Vehicle Miles Traveled',
-        # 'household_no_computing_device': 'No Computer Households',
-        # 'household_no_internet': 'No Internet Households',
-        'percent_drive_alone': 'Drive Alone Commuters (%)',
-        # 'number_drive_alone': 'Drive Alone (#)',
-        'mean_travel_time': "Average Commute Time (min)",
-        'walkability_index': "Walkability Index",
-        'percent_public_transport': 'Public Transport Commuters (%)',
-        'percent_bicycle': 'Bicycle Commuters (%)'
-    },
-        axis=1, inplace=True)
-
-    averages = {}
-    epc_averages = {}
-
-    for x in TRANSPORT_CENSUS_HEADERS:
-        averages[x] = data[x].mean()
-        epc_averages[x] = data.loc[data['Census Tract'].isin(epc['Census Tract'])][x].mean()
-    transport_epc = data.loc[data['Census Tract'].isin(epc['Census Tract'])]
-
-    normalized_data = data.copy()
-    normalized_data[TRANSPORT_CENSUS_HEADERS] = preprocessing.MinMaxScaler().fit_transform(
-        normalized_data[TRANSPORT_CENSUS_HEADERS])
-
-    return transport_epc, data, normalized_data, averages, epc_averages
-
-
-def get_equity_geographies(epc: pd.DataFrame, coeff: float) -> pd.DataFrame:
-    concentration_thresholds = dict()
-    averages = dict()
-
-    for header in (EQUITY_CENSUS_POC_LOW_INCOME + EQUITY_CENSUS_REMAINING_HEADERS):
-        averages[header] = epc[header + ' (%)'].mean()
-        concentration_thresholds[header] = averages[header] + coeff * epc[header + ' (%)'].std()
-        epc[header + '_check'] = epc[header + ' (%)'].apply(lambda x: x > concentration_thresholds[header])
-        epc[header + '_check'] = epc[header + '_check'].astype(int)
-
-    epc['criteria_A'] = epc[[x + '_check' for x in EQUITY_CENSUS_POC_LOW_INCOME]].sum(axis=1, numeric_only=True)
-    epc['Criteria A'] = epc['criteria_A'].apply(lambda x: bool(x == 2))
-
-    epc['criteria_B'] = epc[[x + '_check' for x in EQUITY_CENSUS_REMAINING_HEADERS]].sum(axis=1, numeric_only=True)
-    temp = epc['200% Below Poverty Level (%)'].apply(lambda x: x > concentration_thresholds['200% Below Poverty Level'])
-    epc['Criteria B'] = (epc['criteria_B'].apply(lambda x: bool(x >= 3)) + temp.astype(int)) == 2
-
-    df = epc
-
-    epc['Criteria'] = epc[['Criteria A', 'Criteria B']].apply(
-        lambda x: 'Equity Geography (Meets Both Criteria)' if (x['Criteria A'] & x['Criteria B']) else
-        ('Equity Geography (Meets Criteria A)' if x['Criteria A'] else
-         ('Equity Geography (Meets Criteria B)' if x['Criteria B'] else 'Not selected as an Equity Geography')),
-        axis=1)
-    # epc['Criteria'] = epc.apply(lambda x: 'Both' if (x['Criteria A'] | x['Criteria B']) else 'Other')
-    epc = epc.loc[(epc['Criteria A'] | epc['Criteria B'])]
-    df['Category'] = (df['Criteria A'].apply(lambda x: bool(x)) | df['Criteria B'].apply(lambda x: bool(x)))
-    df['Category'] = df['Category'].apply(lambda x: 'Equity Geography' if x is True else 'Other')
-
-    epc_averages = {}
-    for header in (EQUITY_CENSUS_POC_LOW_INCOME + EQUITY_CENSUS_REMAINING_HEADERS):
-        epc_averages[header] = epc[header + ' (%)'].mean()
-
-    return epc, df, concentration_thresholds, averages, epc_averages
-
-
-def clean_equity_data(data: pd.DataFrame) -> pd.DataFrame:
-    data['Age 19 or Under'] = (
-            data['female_under_5'] + data['female_5_to_9'] + data['female_10_to_14'] +
-            data['female_15_to_17'] + data['female_18_and_19'] +
-            data['male_under_5'] + data['male_5_to_9'] + data['male_10_to_14'] +
-            data['male_15_to_17'] + data['male_18_and_19']
-    )
-    data['Age 65 or Over'] = (
-            data['female_65_and_66'] + data['female_67_to_69'] + data['female_70_to_74'] +
-            data['female_75_to_79'] + data['female_80_to_84'] + data['female_85_and_over'] +
-            data['male_65_and_66'] + data['male_67_to_69'] + data['male_70_to_74'] +
-            data['male_75_to_79'] + data['male_80_to_84'] + data['male_85_and_over']
-    )
-
-    data.rename({'below_pov_level': 'Below Poverty Level', '200_below_pov_level': '200% Below Poverty Level'}, axis=1,
-                inplace=True)
-
-    data['total_w_a_disability'] = (data['male_under_5_w_a_disability'] + data['male_5_to_17_w_a_disability'] + data[
-        'male_18_to_34_w_a_disability'] +
-                                    data['male_35_to_64_w_a_disability'] + data['male_65_to_74_w_a_disability'] + data[
-                                        'male_75_and_over_w_a_disability'] +
-                                    data['female_under_5_w_a_disability'] + data['female_5_to_17_w_a_disability'] +
-                                    data['female_18_to_34_w_a_disability'] +
-                                    data['female_35_to_64_w_a_disability'] + data['female_65_to_74_w_a_disability'] +
-                                    data['female_75_and_over_w_a_disability']
-                                    )
-
-    data['speak_eng_not_well'] = (
-            data['foreign_speak_spanish_speak_eng_not_well'] + data['foreign_speak_spanish_speak_eng_not_at_all'] +
-            data['foreign_speak_other_indo-euro_speak_eng_not_well'] + data[
-                'foreign_speak_other_indo-euro_speak_eng_not_at_all'] +
-            data['foreign_speak_asian_or_pac_isl_lang_speak_eng_not_well'] + data[
-                'foreign_speak_asian_or_pac_isl_lang_speak_eng_not_at_all'] +
-            data['foreign_speak_other_speak_eng_not_well'] + data['foreign_speak_other_speak_eng_not_at_all']
-    )
-
-    data['single_parent'] = data['other_male_householder_no_spouse_w_kids'] + data[
-        'other_female_householder_no_spouse_w_kids']
-
-    data['non-white'] = data['total_population'] - data['not_hisp_or_latino_white']
-
-    data['People with Disability (%)'] = data['total_w_a_disability'] / (data['male'] + data['female'])
-    data['200% Below Poverty Level (%)'] = data['200% Below Poverty Level'] / data[
-        'population_for_whom_poverty_status_is_determined']
-    data['Age 19 or Under (%)'] = data['Age 19 or Under'] / data['total_population']
-    data['Age 65 or Over (%)'] = data['Age 65 or Over'] / data['total_population']
-    data['Limited English Proficiency (%)'] = data['speak_eng_not_well'] / (data['native'] + data['foreign_born'])
-    data['Single Parent Family (%)'] = data['single_parent'] / data['total_families']
-    data['Zero-Vehicle Household (%)'] = data['percent_hh_0_veh']
-    data['People of Color (%)'] = data['non-white'] / data['total_population']
-
-    for header in (EQUITY_CENSUS_POC_LOW_INCOME + EQUITY_CENSUS_REMAINING_HEADERS):
-        data[header + ' (%)'] = round(data[header + ' (%)'] * 100)
-
-    data['criteria_A'] = 0
-    data['criteria_B'] = 0
-
-    data['Criteria A'] = False
-    data['Criteria B'] = False
-
+    data.rename(TRANSPORT_RENAMES, axis=1, inplace=True)
     return data
 
 
 def clean_transport_data(data: pd.DataFrame, epc: pd.DataFrame) -> pd.DataFrame:
-    # data['walkability_index'] = round(data['walkability_index'])
-    data['number_drive_alone'] = data['percent_drive_alone'] * data['total_workers_commute']
-    data.drop(['total_workers_commute'], axis=1, inplace=True)
+    return summarize_transport_data(derive_transport_data(data), epc)
 
-    data['non-white'] = data['total_population'] - data['not_hisp_or_latino_white']
-    data['People of Color (%)'] = 100 * (data['non-white'] / data['total_population'])
-    data['No Computer Households (%)'] = 100 * (data['household_no_computing_device'] / (
-                data['household_no_computing_device'] + data['household_computer'] + data[
-            'household_smartphone_no_computer'] + data['household_no_internet'] + data['household_broadband']))
-    data['200% Below Poverty Level (%)'] = 100 * (
-                data['200_below_pov_level'] / data['population_for_whom_poverty_status_is_determined'])
-    data['Renter Occupied Units (%)'] = 100 * (data['renter-occ_units'] / data['occupied_housing_units'])
-    data['Age 19 or Under'] = (
-            data['female_under_5'] + data['female_5_to_9'] + data['female_10_to_14'] +
-            data['female_15_to_17'] + data['female_18_and_19'] +
-            data['male_under_5'] + data['male_5_to_9'] + data['male_10_to_14'] +
-            data['male_15_to_17'] + data['male_18_and_19']
-    )
-    data['Age 19 or Under (%)'] = 100 * (data['Age 19 or Under'] / data['total_population'])
-    data['Age 65 or Over'] = (
-            data['female_65_and_66'] + data['female_67_to_69'] + data['female_70_to_74'] +
-            data['female_75_to_79'] + data['female_80_to_84'] + data['female_85_and_over'] +
-            data['male_65_and_66'] + data['male_67_to_69'] + data['male_70_to_74'] +
-            data['male_75_to_79'] + data['male_80_to_84'] + data['male_85_and_over']
-    )
-    data['Age 65 or Over (%)'] = 100 * (data['Age 65 or Over'] / data['total_population'])
-    data['speak_eng_not_well'] = (
-            data['foreign_speak_spanish_speak_eng_not_well'] + data['foreign_speak_spanish_speak_eng_not_at_all'] +
-            data['foreign_speak_other_indo-euro_speak_eng_not_well'] + data[
-                'foreign_speak_other_indo-euro_speak_eng_not_at_all'] +
-            data['foreign_speak_asian_or_pac_isl_lang_speak_eng_not_well'] + data[
-                'foreign_speak_asian_or_pac_isl_lang_speak_eng_not_at_all'] +
-            data['foreign_speak_other_speak_eng_not_well'] + data['foreign_speak_other_speak_eng_not_at_all']
-    )
-    data['Limited English Proficiency (%)'] = 100 * (
-                data['speak_eng_not_well'] / (data['native'] + data['foreign_born']))
-    data['single_parent'] = data['other_male_householder_no_spouse_w_kids'] + data[
-        'other_female_householder_no_spouse_w_kids']
-    data['Single Parent Family (%)'] = 100 * (data['single_parent'] / data['total_families'])
-
-    data.rename({
-        'percent_hh_0_veh': 'Zero-Vehicle Households (%)',
-        'vehicle_miles_traveled': 'Vehicle Miles Traveled',
-        # 'household_no_computing_device': 'No Computer Households',
-        # 'household_no_internet': 'No Internet Households',
-        'percent_drive_alone': 'Drive Alone Commuters (%)',
-        # 'number_drive_alone': 'Drive Alone (#)',
-        'mean_travel_time': "Average Commute Time (min)",
-        # 'walkability_index': "Walkability Index",
-        'percent_public_transport': 'Public Transport Commuters (%)',
-        'percent_bicycle': 'Bicycle Commuters (%)'
-    },
-        axis=1, inplace=True)
 
+def min_max_normalize(values: np.ndarray, minimums: np.ndarray = None, maximums: np.ndarray = None) -> np.ndarray:
+    # Same transform as MinMaxScaler; bounds can come from streamed statistics of a larger region
+    if minimums is None:
+        minimums = np.nanmin(values, axis=0)
+    if maximums is None:
+        maximums = np.nanmax(values, axis=0)
+    spread = maximums - minimums
+    spread = np.where(spread == 0, 1, spread)
+    return (values - minimums) / spread
+
+
+def summarize_transport_data(data: pd.DataFrame, epc: pd.DataFrame, minimums: np.ndarray = None,
+                             maximums: np.ndarray = None) -> tuple:
     averages = {}
     epc_averages = {}
 
@@ -894,43 +754,94 @@ def clean_transport_data(data: pd.DataFrame, epc: pd.DataFrame) -> pd.DataFrame:
     transport_epc = data.loc[data['Census Tract'].isin(epc['Census Tract'])]
 
     normalized_data = data.copy()
-    normalized_data[TRANSPORT_CENSUS_HEADERS] = preprocessing.MinMaxScaler().fit_transform(
-        normalized_data[TRANSPORT_CENSUS_HEADERS])
+    normalized_data[TRANSPORT_CENSUS_HEADERS] = min_max_normalize(
+        data[TRANSPORT_CENSUS_HEADERS].to_numpy(dtype='float64'), minimums, maximums)
 
     return transport_epc, data, normalized_data, averages, epc_averages
 
 
-def get_equity_geographies(epc: pd.DataFrame, coeff: float) -> pd.DataFrame:
-    concentration_thresholds = dict()
-    averages = dict()
+EQUITY_COEFFICIENTS = {'Low': 0.5, 'Medium': 1, 'High': 1.5}
 
-    for header in (EQUITY_CENSUS_POC_LOW_INCOME + EQUITY_CENSUS_REMAINING_HEADERS):
-        averages[header] = epc[header + ' (%)'].mean()
-        concentration_thresholds[header] = averages[header] + coeff * epc[header + ' (%)'].std()
-        epc[header + '_check'] = epc[header + ' (%)'].apply(lambda x: x > concentration_thresholds[header])
-        epc[header + '_check'] = epc[header + '_check'].astype(int)
+EQUITY_CRITERIA_LABELS = np.array([
+    'Not selected as an Equity Geography',
+    'Equity Geography (Meets Criteria A)',
+    'Equity Geography (Meets Criteria B)',
+    'Equity Geography (Meets Both Criteria)',
+], dtype=object)
 
-    epc['criteria_A'] = epc[[x + '_check' for x in EQUITY_CENSUS_POC_LOW_INCOME]].sum(axis=1, numeric_only=True)
-    epc['Criteria A'] = epc['criteria_A'].apply(lambda x: bool(x == 2))
 
-    epc['criteria_B'] = epc[[x + '_check' for x in EQUITY_CENSUS_REMAINING_HEADERS]].sum(axis=1, numeric_only=True)
-    temp = epc['200% Below Poverty Level (%)'].apply(lambda x: x > concentration_thresholds['200% Below Poverty Level'])
-    epc['Criteria B'] = (epc['criteria_B'].apply(lambda x: bool(x >= 3)) + temp.astype(int)) == 2
+def classify_equity_geographies(epc: pd.DataFrame, coefficients: list = None, means: np.ndarray = None,
+                                stds: np.ndarray = None) -> dict:
+    """
+    Criteria masks for every concentration level in one broadcast. Arrays are indexed
+    [level, tract(, indicator)] with levels in the order of ``coefficients``.
+    Precomputed indicator ``means`` and ``stds`` can be passed instead of being taken from ``epc``.
+    """
+    headers = EQUITY_CENSUS_POC_LOW_INCOME + EQUITY_CENSUS_REMAINING_HEADERS
+    values = epc[[h + ' (%)' for h in headers]].to_numpy(dtype='float64')
+    if coefficients is None:
+        coefficients = list(EQUITY_COEFFICIENTS.values())
+    coeffs = np.asarray(coefficients, dtype='float64')
+
+    if means is None:
+        means = np.nanmean(values, axis=0)
+    if stds is None:
+        stds = pd.DataFrame(values).std().to_numpy()
+    thresholds = means[None, :] + coeffs[:, None] * stds[None, :]
+    # NaN values and NaN thresholds compare False, as before
+    checks = values[None, :, :] > thresholds[:, None, :]
+
+    n_a = len(EQUITY_CENSUS_POC_LOW_INCOME)
+    criteria_a_count = checks[:, :, :n_a].sum(axis=2)
+    criteria_b_count = checks[:, :, n_a:].sum(axis=2)
+    low_income = checks[:, :, headers.index('200% Below Poverty Level')]
+    criteria_a = criteria_a_count == n_a
+    criteria_b = (criteria_b_count >= 3) & low_income
+
+    return {
+        'coefficients': list(coefficients),
+        'headers': headers,
+        'means': means,
+        'thresholds': thresholds,
+        'checks': checks,
+        'criteria_a_count': criteria_a_count,
+        'criteria_b_count': criteria_b_count,
+        'criteria_a': criteria_a,
+        'criteria_b': criteria_b,
+        'codes': criteria_a.astype('int8') + 2 * criteria_b.astype('int8'),
+    }
+
+
+@st.experimental_memo
+def cached_equity_classification(_epc: pd.DataFrame, region: str, data_version: str = DATA_VERSION) -> dict:
+    return classify_equity_geographies(_epc)
+
+
+def get_equity_geographies(epc: pd.DataFrame, coeff: float, classification: dict = None) -> tuple:
+    if classification is None or coeff not in classification['coefficients']:
+        classification = classify_equity_geographies(epc, [coeff])
+    level = classification['coefficients'].index(coeff)
+    headers = classification['headers']
+
+    averages = dict(zip(headers, classification['means']))
+    concentration_thresholds = dict(zip(headers, classification['thresholds'][level]))
+    checks = classification['checks'][level].astype(int)
+    for i, header in enumerate(headers):
+        epc[header + '_check'] = checks[:, i]
+
+    codes = classification['codes'][level]
+    epc['criteria_A'] = classification['criteria_a_count'][level]
+    epc['Criteria A'] = classification['criteria_a'][level]
+    epc['criteria_B'] = classification['criteria_b_count'][level]
+    epc['Criteria B'] = classification['criteria_b'][level]
+    epc['Criteria'] = EQUITY_CRITERIA_LABELS[codes]
 
     df = epc
-
-    epc['Criteria'] = epc[['Criteria A', 'Criteria B']].apply(
-        lambda x: 'Equity Geography (Meets Both Criteria)' if (x['Criteria A'] & x['Criteria B']) else
-        ('Equity Geography (Meets Criteria A)' if x['Criteria A'] else
-         ('Equity Geography (Meets Criteria B)' if x['Criteria B'] else 'Not selected as an Equity Geography')),
-        axis=1)
-    # epc['Criteria'] = epc.apply(lambda x: 'Both' if (x['Criteria A'] | x['Criteria B']) else 'Other')
-    epc = epc.loc[(epc['Criteria A'] | epc['Criteria B'])]
-    df['Category'] = (df['Criteria A'].apply(lambda x: bool(x)) | df['Criteria B'].apply(lambda x: bool(x)))
-    df['Category'] = df['Category'].apply(lambda x: 'Equity Geography' if x is True else 'Other')
+    epc = epc.loc[codes > 0]
+    df['Category'] = np.where(codes > 0, 'Equity Geography', 'Other')
 
     epc_averages = {}
-    for header in (EQUITY_CENSUS_POC_LOW_INCOME + EQUITY_CENSUS_REMAINING_HEADERS):
+    for header in headers:
         epc_averages[header] = epc[header + ' (%)'].mean()
 
     return epc, df, concentration_thresholds, averages, epc_averages
@@ -950,7 +861,11 @@ def get_existing_policies(df: pd.DataFrame) -> pd.DataFrame:
 
     else:
         policy_df = pd.read_excel('Policy Workbook.xlsx', sheet_name='Analysis Data')
-        temp_df = df.merge(policy_df, on='County Name')
+        flat_df = df.reset_index()
+        states = flat_df['State'].unique() if 'State' in flat_df.columns else None
+        policy_df = geography.attach_county_ids(policy_df, all_counties_query(), states)
+        policy_df.drop(['County Name', 'State'], axis=1, inplace=True, errors='ignore')
+        temp_df = df.merge(policy_df, on='county_id')
         if not temp_df.empty and len(df) == len(temp_df):
             return temp_df
         else:
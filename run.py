@@ -3,10 +3,12 @@ import pandas as pd
 import streamlit as st
 
 import data_explorer
+import derived_metrics
 import eviction_analysis
 import equity_explorer
 import queries
 import analysis
+import geography
 import utils
 from constants import STATES
 
@@ -54,7 +56,7 @@ def run_shell() -> pd.DataFrame:
         cost_of_evictions.strip()
         county = res[0].strip().lower()
         state = res[1].strip().lower()
-        df = queries.get_county_data(state, [county])
+        df = queries.get_county_data(state, geography.county_ids(queries.all_counties_query(), state, [county]))
 
         if cost_of_evictions == 'y' or cost_of_evictions == '':
             df = analysis.calculate_cost_estimate(df, rent_type='fmr')
@@ -65,14 +67,14 @@ def run_shell() -> pd.DataFrame:
     elif task == '2':
         state = input("Which state are you looking for? (ie: California)").strip()
         counties = input('Please specify one or more counties, separated by commas.').strip().split(',')
-        df = queries.get_county_data(state, counties)
+        df = queries.get_county_data(state, geography.county_ids(queries.all_counties_query(), state, counties))
         cost_of_evictions = input(
             'Run an analysis to estimate the cost to avoid evictions? (Y/n) ')
         if cost_of_evictions == 'y' or cost_of_evictions == '':
             df = analysis.calculate_cost_estimate(df, rent_type='fmr')
 
         utils.output_table(df, 'Output/' + state + '_selected_counties.xlsx')
-        analysis_df = analysis.rank_counties(df, state + '_selected_counties')
+        analysis_df = analysis.rank_counties(df, state + '_selected_counties', sink='excel_async')
         print_summary(analysis_df, 'Output/' + state + '_selected_counties.xlsx')
         return df
     elif task == '3':
@@ -84,13 +86,10 @@ def run_shell() -> pd.DataFrame:
             df = analysis.calculate_cost_estimate(df, rent_type='fmr')
 
         utils.output_table(df, 'Output/' + state + '.xlsx')
-        analysis_df = analysis.rank_counties(df, state)
+        analysis_df = analysis.rank_counties(df, state, sink='excel_async')
         print_summary(analysis_df, 'Output/' + state + '.xlsx')
-        temp = df.copy()
-        temp.reset_index(inplace=True)
-        counties = temp['County Name'].to_list()
-        geom = queries.get_county_geoms(counties, state.lower())
-        df = df.merge(geom, on='County Name', how='outer')
+        geom = queries.get_county_geoms(df['county_id'].to_list())
+        df = df.merge(geom.drop(['County Name', 'State'], axis=1), on='county_id', how='outer')
         return df
     elif task == '4':
         frames = []
@@ -104,7 +103,7 @@ def run_shell() -> pd.DataFrame:
             df = analysis.calculate_cost_estimate(natl_df, rent_type='fmr')
 
         utils.output_table(natl_df, 'Output/US_national.xlsx')
-        analysis_df = analysis.rank_counties(natl_df, 'US_national')
+        analysis_df = analysis.rank_counties(natl_df, 'US_national', sink='excel_async')
         print_summary(analysis_df, 'Output/US_national.xlsx')
         return df
     else:
@@ -184,9 +183,7 @@ def run_UI():
         with subcol_1:
             st.session_state.data_type = st.radio("Data resolution:", ('County Level', 'Census Tracts'), index=0)
         with subcol_2:
-            # Todo: implement for census level too
-            if st.session_state.data_type =='County Level':
-                st.session_state.data_format = st.radio('Data format', ['Raw Values', 'Per Capita', 'Per Square Mile'], 0)
+            st.session_state.data_format = st.radio('Data format', derived_metrics.FORMATS, 0)
 
         if st.session_state.data_type == 'County Level':
             data_explorer.county_data_explorer()
@@ -1,9 +1,18 @@
 import queries
 import pandas as pd
 import geopandas as gpd
+from shapely import wkb
 from sqlalchemy import create_engine
 import psycopg2
+import aggregation_cube
 import credentials
+import equity_store
+import feature_store
+import geography
+import geometry_store
+import spatial_weights
+import streaming
+from constants import STATES
 
 
 def init_engine():
@@ -13,16 +22,20 @@ def init_engine():
 
 
 def fix_chmura_counties():
-    counties = queries.all_counties_query()
-    counties.set_index(['State', 'County Name'], inplace=True)
     ch_df = queries.generic_select_query('chmura_economic_vulnerability_index',
                                          ['fips', 'name', 'VulnerabilityIndex', 'Rank', 'state', 'county_id'])
-    for i, row in ch_df.iterrows():
-        if pd.isnull(row['county_id']):
-            try:
-                ch_df.at[i, 'county_id'] = counties.loc[row['state'], row['name']]['county_id']
-            except KeyError:
-                print(row['state'], row['name'])
+    ch_df['county_id'] = ch_df['county_id'].fillna(ch_df['fips'])
+
+    # Fall back to names only for rows without any FIPS code
+    missing = ch_df['county_id'].isnull()
+    if missing.any():
+        resolved = geography.attach_county_ids(
+            ch_df.loc[missing, ['state', 'name']].rename({'state': 'State', 'name': 'County Name'}, axis=1)
+                .reset_index(),
+            queries.all_counties_query())
+        ch_df.loc[resolved['index'], 'county_id'] = resolved['county_id'].to_numpy()
+        for _, row in ch_df[ch_df['county_id'].isnull()].iterrows():
+            print(row['state'], row['name'])
 
     queries.write_table(ch_df, 'chmura_economic_vulnerability_index')
 
@@ -115,7 +128,76 @@ def map_ntm():
     # print(df.describe())
 
 
+def build_geometry_stores():
+    conn = queries.init_connection()
+
+    counties = pd.read_sql('SELECT county_id, geom FROM county_geoms;', con=conn)
+    county_geoms = [wkb.loads(g, hex=True).simplify(tolerance=0.0001, preserve_topology=True).buffer(0)
+                    for g in counties['geom']]
+    path = geometry_store.build_store('county', counties['county_id'], county_geoms)
+    print(f'{len(counties)} county geometries written to {path}')
+
+    tracts = pd.read_sql('SELECT tract_id, geom FROM census_tracts_geom;', con=conn)
+    tract_geoms = [wkb.loads(g, hex=True) for g in tracts['geom']]
+    # Denominators for the Per Square Mile and Per Capita formats; areas come from the unsimplified geometries
+    population = pd.read_sql('SELECT tract_id, tot_population_census_2010 FROM resident_population_census_tract;',
+                             con=conn).drop_duplicates('tract_id').set_index('tract_id')['tot_population_census_2010']
+    attributes = {
+        'sqmi': geometry_store.equal_area_sqmi(tract_geoms),
+        'population': tracts['tract_id'].map(population).to_numpy(dtype='float64'),
+    }
+    tract_geoms = [g.simplify(tolerance=0.00005, preserve_topology=False).buffer(0) for g in tract_geoms]
+    path = geometry_store.build_store('tract', tracts['tract_id'], tract_geoms, attributes=attributes)
+    print(f'{len(tracts)} census tract geometries, areas and populations written to {path}')
+
+
+def build_spatial_weights(states: list = None):
+    conn = queries.init_connection()
+    for state in states or [s.strip() for s in STATES]:
+        tracts = pd.read_sql(f"""SELECT census_tracts_geom.tract_id, census_tracts_geom.geom FROM census_tracts_geom
+            INNER JOIN id_index ON census_tracts_geom.tract_id = id_index.tract_id
+            WHERE id_index.state_name = '{state}';""", con=conn).drop_duplicates('tract_id')
+        geoms = [wkb.loads(g, hex=True) for g in tracts['geom']]
+        nnz = spatial_weights.build_weights(tracts['tract_id'], geoms, 'tract', state)
+        print(f'{state}: {len(tracts)} census tracts, neighbor pairs {nnz}')
+
+    counties = pd.read_sql('SELECT county_id, geom FROM county_geoms;', con=conn)
+    geoms = [wkb.loads(g, hex=True) for g in counties['geom']]
+    nnz = spatial_weights.build_weights(counties['county_id'], geoms, 'county', spatial_weights.NATIONAL)
+    print(f'{len(counties)} counties, neighbor pairs {nnz}')
+
+
+def precompute_equity_tables(states: list = None, workers: int = None):
+    states = states or [s.strip() for s in STATES]
+    counts = equity_store.build_store(states, workers=workers)
+    print(f'{sum(counts.values())} census tracts in {len(counts)} states written to {equity_store.STORE_DIR}')
+
+
+def national_equity_thresholds():
+    counties = queries.all_counties_query()
+    stats = streaming.equity_statistics(counties['county_id'].drop_duplicates().to_list())
+    print(stats.frame())
+    print(streaming.equity_thresholds(stats))
+
+
+def build_aggregation_cube(states: list = None):
+    counts = aggregation_cube.build_cube(states)
+    print(', '.join(f'{n} {level} rows' for level, n in counts.items()) + f' written to {aggregation_cube.CUBE_DIR}')
+
+
+def build_feature_store(states: list = None, workers: int = None):
+    states = states or [s.strip() for s in STATES]
+    counts = feature_store.build_store(states, workers=workers)
+    print(f'{len(counts)} state partitions written to {feature_store.STORE_DIR}')
+
+
 if __name__ == '__main__':
+    # build_geometry_stores()
+    # build_spatial_weights()
+    # precompute_equity_tables()
+    # national_equity_thresholds()
+    # build_aggregation_cube()
+    # build_feature_store()
     # fix_chmura_counties()
     # import_geojson()
     # populate_table('temp/new_ntm_stops.csv', 'ntm_stops_new')
@@ -0,0 +1,120 @@
+"""
+Monte Carlo sensitivity of Relative Risk rankings.
+
+Relative Risk is a weighted sum of normalized features (equal weights unless customized). Here thousands of random
+weight vectors around those weights (and optionally multiplicative feature noise) are drawn, the rankings of every batch
+of samples are computed as one matrix product, and the batches are spread over a process pool shared by every call.
+Each shard reduces its rankings to a per-county rank histogram before returning, so only (counties x counties) counts
+cross the process boundary whatever the number of samples. The merged histograms summarize how stable each county's
+rank is, and is cached per selection, weights, sample settings and data version.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from constants import DATA_VERSION
+
+# Samples scored together in one matrix product; bounds the (samples, counties, features) perturbation block
+BATCH_SIZE = 64
+
+WORKERS = min(os.cpu_count() or 1, 8)
+
+# Started once per process and reused by every uncached call; worker processes are spawned on first use
+_pool = ProcessPoolExecutor(max_workers=WORKERS)
+
+
+def sample_weights(rng: np.random.Generator, n_samples: int, n_features: int, concentration: float = 1.0) -> np.ndarray:
+    # Dirichlet weights scaled so the equal-weight baseline sits at the center of the distribution
+    return rng.dirichlet(np.full(n_features, concentration), size=n_samples) * n_features
+
+
+def rank_scores(scores: np.ndarray) -> np.ndarray:
+    """1-based descending ranks along the last axis."""
+    order = np.argsort(-scores, axis=-1, kind='stable')
+    ranks = np.empty(scores.shape, dtype='int32')
+    np.put_along_axis(ranks, order, np.arange(1, scores.shape[-1] + 1, dtype='int32'), axis=-1)
+    return ranks
+
+
+def rank_histogram(ranks: np.ndarray) -> np.ndarray:
+    """``counts[c, r - 1]``: the number of rows of ``ranks`` (samples x counties) ranking county ``c`` at ``r``."""
+    n_counties = ranks.shape[-1]
+    cells = np.arange(n_counties) * n_counties + ranks.reshape(-1, n_counties) - 1
+    return np.bincount(cells.ravel(), minlength=n_counties * n_counties).reshape(n_counties, n_counties)
+
+
+def histogram_percentiles(counts: np.ndarray, q: list) -> list:
+    """``np.percentile(ranks, q, axis=0)`` (linear interpolation) from the rank histogram of ``ranks``."""
+    cumulative = counts.cumsum(axis=1)
+    res = []
+    for p in q:
+        position = p / 100 * (cumulative[:, -1] - 1)
+        lower, upper = np.floor(position), np.ceil(position)
+        # The sorted ranks of a county at positions lower and upper
+        low = (cumulative <= lower[:, None]).sum(axis=1) + 1
+        high = (cumulative <= upper[:, None]).sum(axis=1) + 1
+        res.append(low + (high - low) * (position - lower))
+    return res
+
+
+def _rank_shard(matrix: np.ndarray, sizes: list, perturbation: float, concentration: float, seeds: list) -> np.ndarray:
+    """Rank histogram of a shard of sample batches; batch ``i`` holds ``sizes[i]`` samples drawn from ``seeds[i]``."""
+    n_counties, n_features = matrix.shape
+    counts = np.zeros((n_counties, n_counties), dtype='int64')
+    for size, seed in zip(sizes, seeds):
+        rng = np.random.default_rng(seed)
+        weights = sample_weights(rng, size, n_features, concentration)
+        if perturbation > 0:
+            noise = 1 + perturbation * rng.standard_normal((size, n_counties, n_features))
+            scores = np.einsum('cf,scf,sf->sc', matrix, noise, weights)
+        else:
+            scores = weights @ matrix.T
+        counts += rank_histogram(rank_scores(scores))
+    return counts
+
+
+def rank_sensitivity(normalized: pd.DataFrame, n_samples: int = 2000, perturbation: float = 0.0,
+                     concentration: float = 1.0, top_k: int = 10, workers: int = None,
+                     seed: int = 0, weights: dict = None) -> pd.DataFrame:
+    """
+    Rank intervals and rank-change probabilities for every row of ``normalized`` (rows are counties, columns are
+    the normalized Relative Risk features). ``weights`` are the feature weights of the ranked Relative Risk (1 for
+    features it does not name); sampled weightings are drawn around them.
+    """
+    matrix = np.nan_to_num(normalized.to_numpy(dtype='float64'), nan=0.0)
+    if weights:
+        matrix = matrix * np.array([float(weights.get(c, 1.0)) for c in normalized.columns])
+    baseline = rank_scores(matrix.sum(axis=1))
+
+    sizes = [min(BATCH_SIZE, n_samples - start) for start in range(0, n_samples, BATCH_SIZE)]
+    # Every batch draws from its own seed, so the samples do not depend on how batches are spread over workers
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    workers = workers or WORKERS
+    shards = [s for s in np.array_split(np.arange(len(sizes)), workers) if len(s)]
+    shard_sizes = [[sizes[i] for i in shard] for shard in shards]
+    shard_seeds = [[seeds[i] for i in shard] for shard in shards]
+    if len(shards) > 1:
+        parts = _pool.map(_rank_shard, [matrix] * len(shards), shard_sizes, [perturbation] * len(shards),
+                          [concentration] * len(shards), shard_seeds)
+        counts = sum(parts)
+    else:
+        counts = _rank_shard(matrix, sizes, perturbation, concentration, seeds)
+
+    low, median, high = histogram_percentiles(counts, [5, 50, 95])
+    positions = np.arange(len(baseline))
+    return pd.DataFrame({
+        'Baseline Rank': baseline,
+        'Median Rank': median,
+        'Rank 5%': low,
+        'Rank 95%': high,
+        'Rank Change Probability': (n_samples - counts[positions, baseline - 1]) / n_samples,
+        f'Top {top_k} Probability': counts[:, :top_k].sum(axis=1) / n_samples,
+    }, index=normalized.index).sort_values('Baseline Rank')
+
+
+@st.experimental_memo
+def cached_rank_sensitivity(_normalized: pd.DataFrame, selection: str, weights: tuple, n_samples: int,
+                            perturbation: float, data_version: str = DATA_VERSION) -> pd.DataFrame:
+    return rank_sensitivity(_normalized, n_samples=n_samples, perturbation=perturbation, weights=dict(weights))
@@ -0,0 +1,299 @@
+"""
+Sparse spatial weights for census tracts and counties.
+
+Contiguity is found with a k-d tree over polygon vertices: geometries are queen neighbors when a vertex of one lies
+within ``TOLERANCE`` of a boundary segment of the other, and rook neighbors when two of their boundary segments overlap
+over more than that. Shared edges therefore need not have identical vertices, as at T-junctions where one tract's edge
+runs along two segments of its neighbor. Distance-band weights query a k-d tree of tract or county centroids.
+Matrices are built per state (or nationally) by ``build_weights``, saved as scipy ``.npz`` files under
+``Data/weights/<data version>/<kind>/`` and kept in memory once loaded; weights built from older tables are ignored
+until they are rebuilt.
+
+All statistics are sparse matrix-vector products over the whole region: spatial lag, global Moran's I with a
+permutation test, local Moran's I and Getis-Ord Gi* hotspots.
+"""
+import os
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+import geometry_store
+from constants import DATA_VERSION
+
+WEIGHTS_DIR = os.path.join('Data', 'weights')
+
+METHODS = ['queen', 'rook', 'distance']
+
+# Distance band radius in km
+DISTANCE_BAND = {
+    'tract': 5,
+    'county': 100,
+}
+
+# Distance in degrees (about 0.1 m) within which a vertex touches another geometry's boundary
+TOLERANCE = 1e-6
+
+NATIONAL = 'United States'
+
+# Permutations evaluated per sparse product in the Moran's I test
+PERMUTATION_BATCH = 100
+
+_weights = {}
+
+
+def _rings(geoms: list) -> tuple:
+    coords = []
+    owners = []
+    ring_ids = []
+    n_rings = 0
+    for i, geom in enumerate(geoms):
+        for part in geometry_store.polygon_parts(geom):
+            for ring in [part.exterior] + list(part.interiors):
+                ring_coords = np.asarray(ring.coords, dtype='float64')[:, :2]
+                coords.append(ring_coords)
+                owners.append(np.full(len(ring_coords), i, dtype='int64'))
+                ring_ids.append(np.full(len(ring_coords), n_rings, dtype='int64'))
+                n_rings += 1
+    if not coords:
+        return np.empty((0, 2)), np.empty(0, dtype='int64'), np.empty(0, dtype='int64')
+    return np.concatenate(coords), np.concatenate(owners), np.concatenate(ring_ids)
+
+
+def _binary(matrix) -> sparse.csr_matrix:
+    matrix = sparse.csr_matrix(matrix)
+    matrix.setdiag(0)
+    matrix.eliminate_zeros()
+    matrix.data[:] = 1
+    return matrix.astype('float64')
+
+
+def _segments(geoms: list) -> tuple:
+    """Start and end points and owning geometry of every boundary segment, and the segment preceding it in its ring."""
+    coords, owners, ring_ids = _rings(geoms)
+    same_ring = ring_ids[1:] == ring_ids[:-1]
+    starts, ends, owners, ring_ids = coords[:-1][same_ring], coords[1:][same_ring], owners[:-1][same_ring], \
+        ring_ids[:-1][same_ring]
+    # Rings are closed, so the first segment of a ring follows its last one
+    previous = np.arange(len(starts)) - 1
+    first = np.r_[True, ring_ids[1:] != ring_ids[:-1]]
+    last = np.r_[ring_ids[1:] != ring_ids[:-1], True]
+    previous[first] = np.flatnonzero(last)
+    return starts, ends, owners, previous
+
+
+def _touching(starts: np.ndarray, ends: np.ndarray, tolerance: float) -> tuple:
+    """(segment, vertex) pairs where the vertex starting one segment lies within ``tolerance`` of another segment."""
+    lengths = np.hypot(*(ends - starts).T)
+    # Long segments are queried as pieces no longer than a typical segment, so every ball stays small
+    step = max(np.median(lengths), tolerance)
+    pieces = np.maximum(np.ceil(lengths / step), 1).astype('int64')
+    segment = np.repeat(np.arange(len(starts)), pieces)
+    offset = (np.arange(len(segment)) - np.repeat(np.cumsum(pieces) - pieces, pieces) + 0.5) / pieces[segment]
+    centers = starts[segment] + offset[:, None] * (ends - starts)[segment]
+    pairs = cKDTree(centers).sparse_distance_matrix(cKDTree(starts), step / 2 + tolerance, output_type='ndarray')
+    segment, vertex = segment[pairs['i']], pairs['j'].astype('int64')
+    if (pieces > 1).any():
+        # A vertex near two pieces of the same segment is found twice
+        keys = np.unique(segment * len(starts) + vertex)
+        segment, vertex = keys // len(starts), keys % len(starts)
+
+    direction = (ends - starts)[segment]
+    squared = np.maximum((direction ** 2).sum(axis=1), np.finfo('float64').tiny)
+    t = np.clip(((starts[vertex] - starts[segment]) * direction).sum(axis=1) / squared, 0, 1)
+    distance = np.hypot(*(starts[segment] + t[:, None] * direction - starts[vertex]).T)
+    keep = distance <= tolerance
+    return segment[keep], vertex[keep]
+
+
+def _overlap(starts: np.ndarray, ends: np.ndarray, a: np.ndarray, b: np.ndarray, tolerance: float) -> np.ndarray:
+    """Whether segments ``b`` run along segments ``a`` for more than ``tolerance``."""
+    direction = (ends - starts)[a]
+    length = np.hypot(*direction.T)
+    unit = direction / np.maximum(length, np.finfo('float64').tiny)[:, None]
+    along, across = [], []
+    for points in [starts[b], ends[b]]:
+        offset = points - starts[a]
+        along.append((offset * unit).sum(axis=1))
+        across.append(np.abs(offset[:, 0] * unit[:, 1] - offset[:, 1] * unit[:, 0]))
+    collinear = (across[0] <= tolerance) & (across[1] <= tolerance)
+    shared = np.minimum(length, np.maximum(*along)) - np.maximum(0, np.minimum(*along))
+    return collinear & (length > tolerance) & (shared > tolerance)
+
+
+def contiguity_weights(geoms: list, rook: bool = False, tolerance: float = TOLERANCE) -> sparse.csr_matrix:
+    """Binary queen (touching boundaries) or rook (shared edge) contiguity between ``geoms``."""
+    n = len(geoms)
+    starts, ends, owners, previous = _segments(geoms)
+    if len(starts) == 0:
+        return sparse.csr_matrix((n, n), dtype='float64')
+    segment, vertex = _touching(starts, ends, tolerance)
+    other = owners[segment] != owners[vertex]
+    segment, vertex = segment[other], vertex[other]
+    if rook:
+        # An edge shared over some length ends at a vertex of one geometry lying on a segment of the other, and that
+        # vertex starts or ends one of the shared segments
+        a = np.concatenate([segment, segment])
+        b = np.concatenate([vertex, previous[vertex]])
+        shared = _overlap(starts, ends, a, b, tolerance)
+        segment, vertex = a[shared], b[shared]
+    i, j = owners[segment], owners[vertex]
+    matrix = sparse.csr_matrix((np.ones(len(i)), (i, j)), shape=(n, n))
+    return _binary(matrix + matrix.T)
+
+
+def planar_points(lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+    """Equirectangular km coordinates; accurate enough for neighborhood radii within a state."""
+    lat0 = np.deg2rad(np.nanmean(lat)) if np.isfinite(lat).any() else 0
+    return np.column_stack([lon * 111.32 * np.cos(lat0), lat * 110.57])
+
+
+def distance_band_weights(points: np.ndarray, threshold: float) -> sparse.csr_matrix:
+    """Binary weights between points (km) closer than ``threshold``; points with NaN coordinates have no neighbors."""
+    n = len(points)
+    valid = np.flatnonzero(~np.isnan(points).any(axis=1))
+    pairs = valid[cKDTree(points[valid]).query_pairs(threshold, output_type='ndarray')] if len(valid) \
+        else np.empty((0, 2), dtype='int64')
+    i = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    j = np.concatenate([pairs[:, 1], pairs[:, 0]])
+    return _binary(sparse.csr_matrix((np.ones(len(i)), (i, j)), shape=(n, n)))
+
+
+class SpatialWeights(object):
+
+    def __init__(self, geoids: np.ndarray, matrix: sparse.csr_matrix):
+        self.geoids = np.asarray(geoids, dtype='int64')
+        self.matrix = sparse.csr_matrix(matrix)
+
+    def __len__(self):
+        return len(self.geoids)
+
+    def subset(self, ids) -> sparse.csr_matrix:
+        """Weights between ``ids`` in the given order; ids without weights have no neighbors."""
+        ids = np.asarray(pd.to_numeric(pd.Series(ids), errors='coerce').fillna(-1), dtype='int64')
+        order = np.argsort(self.geoids)
+        pos = np.searchsorted(self.geoids, ids, sorter=order)
+        pos = np.minimum(pos, len(order) - 1)
+        found = self.geoids[order[pos]] == ids
+        rows = np.flatnonzero(found)
+        selector = sparse.csr_matrix((np.ones(len(rows)), (rows, order[pos][found])), shape=(len(ids), len(self)))
+        return (selector @ self.matrix @ selector.T).tocsr()
+
+
+def save_weights(weights: SpatialWeights, kind: str, name: str, method: str, directory: str = WEIGHTS_DIR) -> str:
+    path = os.path.join(directory, DATA_VERSION, kind)
+    os.makedirs(path, exist_ok=True)
+    sparse.save_npz(os.path.join(path, f'{name}_{method}.npz'), weights.matrix)
+    np.save(os.path.join(path, f'{name}_geoids.npy'), weights.geoids)
+    _weights.pop((kind, name, method, directory), None)
+    return path
+
+
+def load_weights(name: str, kind: str = 'tract', method: str = 'queen', directory: str = WEIGHTS_DIR):
+    """Weights of a state (or NATIONAL), or None when they have not been built."""
+    key = (kind, name, method, directory)
+    if key not in _weights:
+        path = os.path.join(directory, DATA_VERSION, kind)
+        matrix_path = os.path.join(path, f'{name}_{method}.npz')
+        if not os.path.exists(matrix_path):
+            return None
+        _weights[key] = SpatialWeights(np.load(os.path.join(path, f'{name}_geoids.npy')),
+                                       sparse.load_npz(matrix_path))
+    return _weights[key]
+
+
+def build_weights(geoids, geoms: list, kind: str, name: str, directory: str = WEIGHTS_DIR) -> dict:
+    """Builds and saves queen, rook and distance band weights for one region."""
+    geoids = np.asarray(pd.to_numeric(pd.Series(geoids)), dtype='int64')
+    centroids = np.array([[g.centroid.x, g.centroid.y] if g is not None and not g.is_empty else [np.nan, np.nan]
+                          for g in geoms]).reshape(-1, 2)
+    points = planar_points(centroids[:, 0], centroids[:, 1])
+    matrices = {
+        'queen': contiguity_weights(geoms),
+        'rook': contiguity_weights(geoms, rook=True),
+        'distance': distance_band_weights(points, DISTANCE_BAND[kind]),
+    }
+    for method, matrix in matrices.items():
+        save_weights(SpatialWeights(geoids, matrix), kind, name, method, directory)
+    return {method: int(matrix.nnz) for method, matrix in matrices.items()}
+
+
+def row_standardize(matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+    row_sums = np.asarray(matrix.sum(axis=1)).ravel()
+    with np.errstate(divide='ignore'):
+        scale = np.where(row_sums > 0, 1 / row_sums, 0)
+    return sparse.diags(scale) @ matrix
+
+
+def _observed(matrix: sparse.csr_matrix, values) -> tuple:
+    # Statistics use the tracts with a value; neighbors without one are dropped
+    x = np.asarray(values, dtype='float64')
+    valid = ~np.isnan(x)
+    if valid.all():
+        return matrix, x, valid
+    idx = np.flatnonzero(valid)
+    return matrix[idx][:, idx], x[idx], valid
+
+
+def spatial_lag(matrix: sparse.csr_matrix, values) -> np.ndarray:
+    """Neighbor average of ``values`` (NaN where a geography has no neighbor with a value)."""
+    x = np.asarray(values, dtype='float64')
+    valid = ~np.isnan(x)
+    observed = matrix @ sparse.diags(valid.astype('float64'))
+    total = observed @ np.where(valid, x, 0)
+    counts = np.asarray(observed.sum(axis=1)).ravel()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(counts > 0, total / counts, np.nan)
+
+
+def morans_i(matrix: sparse.csr_matrix, values, permutations: int = 999, seed: int = 0) -> dict:
+    """Global Moran's I with row-standardized weights and a pseudo p-value from column-stacked permutations."""
+    matrix, x, _ = _observed(matrix, values)
+    n = len(x)
+    w = row_standardize(matrix)
+    s0 = w.sum()
+    z = x - x.mean()
+    denom = (z ** 2).sum()
+    if n < 3 or s0 == 0 or denom == 0:
+        return {'I': np.nan, 'expected': np.nan, 'p_value': np.nan, 'n': n}
+    stat = n / s0 * (z @ (w @ z)) / denom
+
+    rng = np.random.default_rng(seed)
+    simulated = np.empty(permutations)
+    for start in range(0, permutations, PERMUTATION_BATCH):
+        stop = min(start + PERMUTATION_BATCH, permutations)
+        zp = rng.permuted(np.repeat(z[:, None], stop - start, axis=1), axis=0)
+        simulated[start:stop] = n / s0 * np.einsum('ij,ij->j', zp, w @ zp) / denom
+    larger = (simulated >= stat).sum() if stat >= simulated.mean() else (simulated <= stat).sum()
+    return {'I': stat, 'expected': -1 / (n - 1), 'p_value': (larger + 1) / (permutations + 1), 'n': n}
+
+
+def local_morans(matrix: sparse.csr_matrix, values) -> np.ndarray:
+    """Local Moran's I_i = z_i * lag(z)_i / m2 with row-standardized weights."""
+    matrix, x, valid = _observed(matrix, values)
+    z = x - x.mean()
+    m2 = (z ** 2).mean()
+    res = np.full(len(valid), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        res[valid] = z * (row_standardize(matrix) @ z) / m2
+    return res
+
+
+def getis_ord(matrix: sparse.csr_matrix, values) -> np.ndarray:
+    """Getis-Ord Gi* z-scores (binary weights including the geography itself)."""
+    matrix, x, valid = _observed(matrix, values)
+    n = len(x)
+    w = _binary(matrix) + sparse.identity(n, format='csr')
+    mean = x.mean()
+    s = np.sqrt((x ** 2).mean() - mean ** 2)
+    w_sum = np.asarray(w.sum(axis=1)).ravel()
+    w_sq = np.asarray(w.multiply(w).sum(axis=1)).ravel()
+    res = np.full(len(valid), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        res[valid] = (w @ x - mean * w_sum) / (s * np.sqrt((n * w_sq - w_sum ** 2) / (n - 1)))
+    return res
+
+
+def hotspots(matrix: sparse.csr_matrix, values, z: float = 1.96) -> np.ndarray:
+    scores = getis_ord(matrix, values)
+    return np.where(scores >= z, 'Hot Spot', np.where(scores <= -z, 'Cold Spot', 'Not Significant'))
@@ -0,0 +1,125 @@
+"""
+One-pass statistics over tract data streamed from the query layer.
+
+``RunningStats`` keeps per-column counts, means and sums of squared deviations (Welford / Chan merges), minima, maxima
+and a fixed-size uniform row sample for approximate quantiles. Memory is bounded by the number of columns and the sample
+size, so equity thresholds and transport normalization bounds can be computed for several states or the whole country
+one chunk of counties at a time, by batch jobs such as ``scripts.national_equity_thresholds`` that never hold the whole
+region in memory. The explorers load their selection anyway and take the statistics from that frame.
+"""
+import numpy as np
+import pandas as pd
+
+import queries
+
+SAMPLE_SIZE = 20000
+
+
+class RunningStats(object):
+
+    def __init__(self, columns: list, sample_size: int = SAMPLE_SIZE, seed: int = 0):
+        self.columns = list(columns)
+        n = len(self.columns)
+        self.count = np.zeros(n, dtype='int64')
+        self.mean = np.zeros(n, dtype='float64')
+        self.m2 = np.zeros(n, dtype='float64')
+        self.minimum = np.full(n, np.nan)
+        self.maximum = np.full(n, np.nan)
+        self.sample_size = sample_size
+        self._rng = np.random.default_rng(seed)
+        self._keys = np.empty(0, dtype='float64')
+        self._sample = np.empty((0, n), dtype='float64')
+
+    def update(self, chunk) -> 'RunningStats':
+        if isinstance(chunk, pd.DataFrame):
+            chunk = chunk[self.columns]
+        values = np.asarray(chunk, dtype='float64').reshape(-1, len(self.columns))
+        valid = ~np.isnan(values)
+        count = valid.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.nansum(values, axis=0) / count
+            m2 = np.nansum((values - mean) ** 2, axis=0)
+        self._merge_moments(count, np.where(count > 0, mean, 0), m2)
+        if len(values):
+            self.minimum = np.fmin(self.minimum, np.fmin.reduce(values, axis=0))
+            self.maximum = np.fmax(self.maximum, np.fmax.reduce(values, axis=0))
+            # Bottom-k sampling on uniform keys is a uniform sample of every row seen so far
+            self._keep(self._rng.random(len(values)), values)
+        return self
+
+    def merge(self, other: 'RunningStats') -> 'RunningStats':
+        self._merge_moments(other.count, other.mean, other.m2)
+        self.minimum = np.fmin(self.minimum, other.minimum)
+        self.maximum = np.fmax(self.maximum, other.maximum)
+        self._keep(other._keys, other._sample)
+        return self
+
+    def _merge_moments(self, count: np.ndarray, mean: np.ndarray, m2: np.ndarray):
+        total = self.count + count
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = mean - self.mean
+            self.mean = np.where(total > 0, self.mean + delta * count / total, 0)
+            self.m2 = np.where(total > 0, self.m2 + m2 + delta ** 2 * self.count * count / total, 0)
+        self.count = total
+
+    def _keep(self, keys: np.ndarray, rows: np.ndarray):
+        keys = np.concatenate([self._keys, keys])
+        rows = np.concatenate([self._sample, rows])
+        if len(keys) > self.sample_size:
+            keep = np.argpartition(keys, self.sample_size - 1)[:self.sample_size]
+            keys, rows = keys[keep], rows[keep]
+        self._keys, self._sample = keys, rows
+
+    def means(self) -> np.ndarray:
+        return np.where(self.count > 0, self.mean, np.nan)
+
+    def variances(self, ddof: int = 1) -> np.ndarray:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.count > ddof, self.m2 / (self.count - ddof), np.nan)
+
+    def stds(self, ddof: int = 1) -> np.ndarray:
+        return np.sqrt(self.variances(ddof))
+
+    def quantiles(self, q) -> np.ndarray:
+        """Approximate quantiles from the row sample; exact while fewer than ``sample_size`` rows were seen."""
+        if len(self._sample) == 0:
+            return np.full(np.shape(q) + (len(self.columns),), np.nan)
+        return np.nanquantile(self._sample, q, axis=0)
+
+    def frame(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            'count': self.count,
+            'mean': self.means(),
+            'std': self.stds(),
+            'min': self.minimum,
+            'max': self.maximum,
+        }, index=self.columns)
+
+
+def stream(chunks, columns: list, prepare=None, sample_size: int = SAMPLE_SIZE) -> RunningStats:
+    stats = RunningStats(columns, sample_size)
+    for chunk in chunks:
+        stats.update(prepare(chunk) if prepare is not None else chunk)
+    return stats
+
+
+def equity_statistics(county_ids: list, chunk_counties: int = queries.CHUNK_COUNTIES) -> RunningStats:
+    """Equity indicator statistics; ``means()`` and ``stds()`` feed queries.classify_equity_geographies."""
+    headers = queries.EQUITY_CENSUS_POC_LOW_INCOME + queries.EQUITY_CENSUS_REMAINING_HEADERS
+    chunks = queries.iter_census_tracts(county_ids, queries.EQUITY_CENSUS_TABLES, queries.EQUITY_CENSUS_COLUMNS,
+                                        chunk_counties)
+    return stream(chunks, [h + ' (%)' for h in headers], queries.clean_equity_data)
+
+
+def transport_statistics(county_ids: list, chunk_counties: int = queries.CHUNK_COUNTIES) -> RunningStats:
+    """Transport indicator statistics; ``minimum`` and ``maximum`` feed queries.summarize_transport_data."""
+    chunks = queries.iter_census_tracts(county_ids, queries.TRANSPORT_CENSUS_TABLES, queries.TRANSPORT_CENSUS_COLUMNS,
+                                        chunk_counties)
+    return stream(chunks, queries.TRANSPORT_CENSUS_HEADERS, queries.derive_transport_data)
+
+
+def equity_thresholds(stats: RunningStats) -> pd.DataFrame:
+    """Concentration thresholds (average + coefficient x standard deviation) per level and indicator."""
+    coeffs = np.array(list(queries.EQUITY_COEFFICIENTS.values()), dtype='float64')
+    thresholds = stats.means()[None, :] + coeffs[:, None] * stats.stds()[None, :]
+    return pd.DataFrame(thresholds, index=list(queries.EQUITY_COEFFICIENTS), columns=stats.columns)
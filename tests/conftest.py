@@ -0,0 +1,36 @@
+import functools
+import inspect
+import os
+import sys
+
+# The application modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def memoize(func):
+    """Caches ``func`` on its arguments not starting with an underscore, as ``st.experimental_memo`` does."""
+    func = inspect.unwrap(func)
+    signature = inspect.signature(func)
+    cache = {}
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = tuple((name, repr(value)) for name, value in bound.arguments.items() if not name.startswith('_'))
+        if key not in cache:
+            cache[key] = func(*args, **kwargs)
+        return cache[key]
+
+    return wrapper
+
+
+def assert_ignores_other_data_versions(monkeypatch, module, load, *caches):
+    """``load()`` finds a store built for ``module.DATA_VERSION`` and nothing once the version is bumped."""
+    for cache in caches:
+        cache.clear()
+    assert load() is not None
+    monkeypatch.setattr(module, 'DATA_VERSION', module.DATA_VERSION + '.next')
+    for cache in caches:
+        cache.clear()
+    assert load() is None
@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('streamlit')
+
+import aggregation_cube
+from conftest import assert_ignores_other_data_versions
+
+WEIGHT = aggregation_cube.WEIGHT
+
+
+@pytest.fixture(autouse=True)
+def measures(monkeypatch):
+    for table in ['t', 'counts', 'incomes', 'first', 'second']:
+        monkeypatch.setitem(aggregation_cube.MEASURES, table, {'rates': ['median_income'], 'counts': ['households']})
+
+
+@pytest.fixture
+def tracts():
+    # Two states, three counties, seven tracts
+    return pd.DataFrame({
+        'Census Tract': [1, 2, 3, 4, 5, 6, 7],
+        'county_id': [10, 10, 11, 11, 11, 20, 20],
+        'county_name': ['A', 'A', 'B', 'B', 'B', 'C', 'C'],
+        'state_name': ['S', 'S', 'S', 'S', 'S', 'T', 'T'],
+        WEIGHT: [100.0, 300.0, 200.0, 200.0, 600.0, 50.0, 150.0],
+        'households': [40.0, 120.0, np.nan, 90.0, 210.0, 20.0, 60.0],
+        'median_income': [50.0, 30.0, 40.0, np.nan, 20.0, np.nan, np.nan],
+    })
+
+
+def reference(tracts: pd.DataFrame, keys: list) -> pd.DataFrame:
+    """Sums and population-weighted means per group, computed tract by tract."""
+    rows = []
+    for key, group in tracts.groupby(keys):
+        key = key if isinstance(key, tuple) else (key,)
+        income = group.dropna(subset=['median_income'])
+        rows.append(dict(zip(keys, key), **{
+            WEIGHT: group[WEIGHT].sum(),
+            'tracts': float(len(group)),
+            'households': group['households'].sum() if group['households'].notna().any() else np.nan,
+            'median_income': ((income['median_income'] * income[WEIGHT]).sum() / income[WEIGHT].sum()
+                              if len(income) else np.nan),
+        }))
+    return pd.DataFrame(rows)
+
+
+def check(levels: dict, tracts: pd.DataFrame, features: list = ('households', 'median_income')):
+    nation = tracts.assign(nation=aggregation_cube.NATION)
+    for level, source in [('county', tracts), ('state', tracts), ('nation', nation)]:
+        keys = aggregation_cube.LEVEL_KEYS[level]
+        expected = reference(source, keys)[keys + [WEIGHT, 'tracts'] + list(features)]
+        pd.testing.assert_frame_equal(levels[level][expected.columns].reset_index(drop=True), expected,
+                                      check_dtype=False)
+
+
+def test_is_rate(monkeypatch):
+    assert aggregation_cube.is_rate('trip_miles', 'vehicle_miles_traveled')
+    assert aggregation_cube.is_rate('median_household_income', 'median_income')
+    assert not aggregation_cube.is_rate('commuting_characteristics', 'total_workers_commute')
+    assert not aggregation_cube.is_rate('poverty_status', 'below_pov_level')
+    # Listed columns take precedence over the rest of the table
+    monkeypatch.setitem(aggregation_cube.MEASURES, 'mixed', {'rates': ['percent_x'], 'counts': aggregation_cube.ALL})
+    assert aggregation_cube.is_rate('mixed', 'percent_x')
+    assert not aggregation_cube.is_rate('mixed', 'x')
+    for table, column in [('trip_miles', 'trips'), ('unknown', 'households')]:
+        with pytest.raises(ValueError, match=f"Column '{column}' of census table '{table}' is not declared"):
+            aggregation_cube.is_rate(table, column)
+
+
+def test_levels_from_chunks_match_tract_by_tract_reference(tracts):
+    chunks = [('t', tracts.iloc[:3]), ('t', tracts.iloc[3:])]
+    levels = aggregation_cube.build_levels(chunks)
+
+    check(levels, tracts)
+    # A county with no value for a feature has no aggregate for it rather than zero
+    assert np.isnan(levels['county'].set_index('county_id').loc[20, 'median_income'])
+    assert levels['nation']['households'].iloc[0] == tracts['households'].sum()
+
+
+def test_levels_from_tables_with_different_tracts(tracts):
+    counts = tracts[['Census Tract', 'county_id', 'county_name', 'state_name', WEIGHT, 'households']]
+    incomes = tracts[['Census Tract', 'county_id', 'county_name', 'state_name', WEIGHT, 'median_income']]
+    chunks = [
+        ('counts', counts.iloc[:4]),
+        # A tract the counts table has no data for, and a chunk where a feature is missing entirely
+        ('incomes', incomes.iloc[[0, 1, 2, 3, 4]]),
+        ('incomes', incomes.iloc[[5, 6]].assign(median_income=None)),
+        ('counts', counts.iloc[4:]),
+    ]
+    levels = aggregation_cube.build_levels(chunks)
+
+    check(levels, tracts)
+    assert list(levels['county'].columns[-2:]) == ['households', 'median_income']
+
+
+def test_duplicate_tracts_are_counted_once(tracts):
+    duplicated = pd.concat([tracts, tracts.iloc[[0, 4]]]).sort_values('Census Tract')
+    levels = aggregation_cube.build_levels([('t', duplicated.iloc[:5]), ('t', duplicated.iloc[5:])])
+    check(levels, tracts)
+
+
+def test_shared_column_is_taken_from_the_first_table(tracts):
+    first = tracts[['Census Tract', 'county_id', 'county_name', 'state_name', WEIGHT, 'households']]
+    second = first.assign(households=first['households'] * 100)
+    levels = aggregation_cube.build_levels([('first', first), ('second', second)])
+
+    assert 'median_income' not in levels['county'].columns
+    check(levels, tracts, ['households'])
+
+
+def test_average_columns_are_weighted_means(tracts):
+    trips = tracts.rename(columns={'median_income': 'vehicle_miles_traveled'})[
+        ['Census Tract', 'county_id', 'county_name', 'state_name', WEIGHT, 'vehicle_miles_traveled']]
+    levels = aggregation_cube.build_levels([('trip_miles', trips)])
+
+    expected = reference(tracts, aggregation_cube.LEVEL_KEYS['state'])['median_income']
+    np.testing.assert_allclose(levels['state']['vehicle_miles_traveled'], expected)
+    # 50 * 100 + 30 * 300 + 40 * 200 + 20 * 600 over the 1200 people of the tracts with a value
+    assert levels['nation']['vehicle_miles_traveled'].iloc[0] == pytest.approx(34000 / 1200)
+
+
+def test_undeclared_columns_stop_the_build(tracts):
+    with pytest.raises(ValueError, match="Column 'households' of census table 'trip_miles' is not declared"):
+        aggregation_cube.build_levels([('trip_miles', tracts)])
+
+
+def test_cube_of_another_data_version_is_ignored(tracts, tmp_path, monkeypatch):
+    counties = tracts[['county_id', 'county_name', 'state_name']].drop_duplicates()
+    monkeypatch.setattr(aggregation_cube.queries, 'all_counties_query', lambda: counties)
+    monkeypatch.setattr(aggregation_cube.queries, 'CENSUS_TABLES', ['t'])
+    monkeypatch.setattr(aggregation_cube.queries, 'iter_census_tracts',
+                        lambda county_ids, tables, columns, chunk_counties: iter([tracts]))
+    assert aggregation_cube.build_cube(directory=str(tmp_path)) == {'county': 3, 'state': 2, 'nation': 1}
+    assert aggregation_cube.features('state', str(tmp_path)) == ['households', 'median_income']
+    assert_ignores_other_data_versions(monkeypatch, aggregation_cube,
+                                       lambda: aggregation_cube.load_level('county', str(tmp_path)),
+                                       aggregation_cube._levels)
@@ -0,0 +1,211 @@
+import itertools
+import math
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('streamlit')
+
+import analysis
+import queries
+from conftest import memoize
+
+
+@pytest.fixture
+def counties():
+    rng = np.random.default_rng(0)
+    n = 12
+    df = pd.DataFrame({
+        'burdened_households': rng.uniform(100, 5000, n),
+        'unemployment_rate': rng.uniform(2, 12, n),
+        'Non-White Population (%)': rng.uniform(5, 80, n),
+        'Total Population': rng.uniform(1e4, 1e6, n),
+        'Policy Value': rng.uniform(0, 1, n),
+        'Countdown': rng.integers(0, 90, n).astype('float64'),
+    }, index=pd.Index([f'County {i}' for i in range(n)], name='County Name'))
+    df.iloc[2, 1] = np.nan
+    df.iloc[5, 2] = np.nan
+    return df
+
+
+def test_incremental_rank_counties_matches_rank_counties(counties, monkeypatch):
+    monkeypatch.setattr(analysis.st, 'session_state', {})
+    columns = list(counties.columns)
+    candidates = sorted(columns)
+
+    expected = analysis.rank_counties(counties[columns], 'test', sink='none')
+    ranks = analysis.incremental_rank_counties(counties, candidates, columns, 'test:counties')
+
+    assert list(ranks.columns) == list(expected.columns)
+    assert 'Rank' in ranks.columns
+    pd.testing.assert_frame_equal(ranks, expected)
+    # Missing values are shown as missing, not as zero
+    assert ranks['unemployment_rate'].isna().sum() == 1
+
+
+def test_incremental_rank_counties_after_removing_policy_columns(counties, monkeypatch):
+    monkeypatch.setattr(analysis.st, 'session_state', {})
+    candidates = sorted(counties.columns)
+    analysis.incremental_rank_counties(counties, candidates, list(counties.columns), 'test:counties')
+
+    columns = ['burdened_households', 'unemployment_rate', 'Total Population']
+    expected = analysis.rank_counties(counties[columns], 'test', sink='none')
+    ranks = analysis.incremental_rank_counties(counties, candidates, columns, 'test:counties')
+
+    assert 'Rank' not in ranks.columns
+    pd.testing.assert_frame_equal(ranks, expected)
+
+
+def reference_rank_counties(df: pd.DataFrame) -> pd.DataFrame:
+    # percent_to_population -> MaxAbsScaler -> priority_indicator, as rank_counties was before vectorizing
+    analysis_df = df.copy()
+    for col in list(analysis_df.columns):
+        if '(%)' in col:
+            name = 'Population Unemployed' if col == 'Unemployment Rate (%)' else col.replace(' (%)', '')
+            analysis_df[name] = (analysis_df[col].astype(float) / 100 *
+                                 analysis_df['Total Population'].astype(float) * 1000)
+    analysis_df = analysis_df.drop(['Policy Value', 'Countdown'] + analysis.PERCENT_COLS_TO_DROP, axis=1,
+                                   errors='ignore')
+    scale = analysis_df.abs().max()
+    analysis_df = analysis_df / scale.where(scale != 0, 1)
+
+    analysis_df['Relative Risk'] = analysis_df.sum(axis=1)
+    analysis_df['Relative Risk'] = analysis_df['Relative Risk'] / analysis_df['Relative Risk'].max()
+    analysis_df['Policy Value'] = df['Policy Value']
+    analysis_df['Countdown'] = df['Countdown']
+
+    def priority_indicator(socioeconomic_index, policy_index, time_left):
+        if time_left < 1:
+            time_left = 1
+        return float(socioeconomic_index) * (1 - float(policy_index)) / math.sqrt(time_left)
+
+    analysis_df['Rank'] = analysis_df.apply(
+        lambda x: priority_indicator(x['Relative Risk'], x['Policy Value'], x['Countdown']), axis=1)
+    return analysis_df
+
+
+def test_rank_counties_matches_the_row_wise_pipeline(counties):
+    df = counties.copy()
+    df['Unemployment Rate (%)'] = np.linspace(2, 13, len(df))
+    df['Burdened Households (%)'] = np.linspace(40, 10, len(df))
+    df['Zero Column'] = 0.0
+    df.loc['County 7', 'Burdened Households (%)'] = np.nan
+    df.loc['County 9', 'Total Population'] = np.nan
+    df['Countdown'] = [0, -3, 0.5, 1, 4, 9, 16, 25, 0, 2, 30, 60]
+
+    ranks = analysis.rank_counties(df, 'test', sink='none')
+    expected = reference_rank_counties(df)
+    pd.testing.assert_frame_equal(ranks, expected)
+
+
+@pytest.fixture
+def rent_tables(monkeypatch):
+    rng = np.random.default_rng(2)
+    tables = {}
+    for table, rent_type in [('fair_market_rents_new', 'fmr'), ('median_rents_new', 'rent50')]:
+        rents = pd.DataFrame(rng.uniform(500, 3000, (6, 5)), columns=[f'{rent_type}_{b}' for b in range(5)])
+        rents.insert(0, 'county_id', [1, 3, 4, 6, 8, 9])
+        tables[table] = rents
+    monkeypatch.setattr(queries, 'static_data_single_table', lambda table, columns: tables[table].copy())
+    monkeypatch.setattr(queries, 'rent_reference', memoize(queries.rent_reference))
+    return tables
+
+
+@pytest.fixture
+def eviction_counties():
+    rng = np.random.default_rng(3)
+    n = 5
+    # County 5 has no rents
+    return pd.DataFrame({
+        'county_id': [1, 3, 5, 8, 9],
+        'Renter Occupied Units': rng.uniform(1e3, 1e5, n),
+        'burdened_households': rng.uniform(10, 60, n),
+    }, index=pd.MultiIndex.from_tuples([('S', f'County {i}') for i in range(n)], names=['State', 'County Name']))
+
+
+def test_cost_scenario_sweep_matches_cost_estimates(rent_tables, eviction_counties):
+    metro_areas = pd.DataFrame(np.random.default_rng(4).dirichlet(np.ones(5), 3),
+                               columns=[f'{b}_br_pct' for b in analysis.BEDROOMS],
+                               index=pd.Index(['A', 'B', 'C'], name='location'))
+    proportions = [5, 50, 100]
+    sweep = analysis.cost_scenario_sweep(eviction_counties, metro_areas, proportions)
+
+    assert len(sweep) == len(analysis.RENT_TYPES) * len(metro_areas) * len(proportions) * len(eviction_counties)
+    for (rent_type, location, pct), scenario in sweep.groupby(['rent_type', 'location', 'pct_burdened']):
+        distribution = dict(zip(analysis.BEDROOMS, metro_areas.loc[location]))
+        expected = analysis.calculate_cost_estimate(eviction_counties, pct, distribution, rent_type)
+        np.testing.assert_array_equal(scenario['county_id'], expected['county_id'])
+        np.testing.assert_array_equal(scenario['County Name'], expected.index.get_level_values('County Name'))
+        np.testing.assert_allclose(scenario['total_cost'], expected['total_cost'])
+    assert sweep.loc[sweep['county_id'] == 5, 'total_cost'].isna().all()
+    assert sweep.loc[sweep['county_id'] != 5, 'total_cost'].notna().all()
+
+
+def test_rent_matrix_of_unknown_counties(rent_tables):
+    fmr = rent_tables['fair_market_rents_new'].set_index('county_id')
+    rents = analysis.rent_matrix(pd.Series([3, 2, -1, np.nan, 100, 9, None]), 'fmr')
+
+    assert rents.shape == (7, 5)
+    np.testing.assert_array_equal(rents[0], fmr.loc[3])
+    np.testing.assert_array_equal(rents[5], fmr.loc[9])
+    assert np.isnan(rents[1:5]).all() and np.isnan(rents[6]).all()
+
+
+def test_rent_reference_keeps_the_first_row_of_a_county(rent_tables, eviction_counties):
+    fmr = rent_tables['fair_market_rents_new']
+    duplicate = fmr.iloc[[1]].assign(fmr_0=1.0)
+    missing = fmr.iloc[[0]].assign(county_id=np.nan)
+    rent_tables['fair_market_rents_new'] = pd.concat([fmr, duplicate, missing], ignore_index=True)
+
+    estimate = analysis.calculate_cost_estimate(eviction_counties, 50, dict.fromkeys(analysis.BEDROOMS, 0.2))
+    # The old left merge produced one row per matching rent row
+    assert len(estimate) == len(eviction_counties)
+    np.testing.assert_array_equal(estimate.loc[estimate['county_id'] == 3, 'fmr_0'], fmr.loc[1, 'fmr_0'])
+
+
+@pytest.mark.parametrize('memory_budget', [8 * 12 * 2 * 3, analysis.CROSS_MEMORY_BUDGET])
+def test_interaction_features_match_pairwise_products(memory_budget):
+    matrix = np.random.default_rng(1).normal(size=(12, 5))
+    matrix[3, 1] = np.nan
+    crossed, combos = analysis.interaction_features(matrix, max_order=3, memory_budget=memory_budget)
+    assert combos == [c for r in [2, 3] for c in itertools.combinations(range(5), r)]
+    frame = pd.DataFrame(matrix)
+    expected = np.column_stack([frame[list(c)].product(axis=1).abs() for c in combos])
+    np.testing.assert_allclose(crossed, expected)
+
+    mean, _ = analysis.interaction_features(matrix, max_order=3, memory_budget=memory_budget, mean_only=True)
+    np.testing.assert_allclose(mean, expected.mean(axis=1))
+
+
+def test_vulnerability_index_matches_melted_sum():
+    normalized = pd.DataFrame({
+        'Census Tract': [1, 2, 3],
+        'a': [0.5, np.nan, 1.0],
+        'b': [0.2, 0.4, np.nan],
+        'unused': [9.0, 9.0, 9.0],
+    })
+    weights = {'a': 60, 'b': 40}
+    scores, contributions = analysis.vulnerability_index(normalized, weights)
+
+    # The baseline melted the indicators, scaled them by their weight and summed per tract; NaN adds nothing
+    melted = normalized.melt('Census Tract', list(weights), 'Indicators')
+    melted['value'] = melted['Indicators'].map(weights) * melted['value']
+    expected = melted.groupby('Census Tract')['value'].sum()
+    np.testing.assert_allclose(scores, expected.to_numpy())
+    np.testing.assert_allclose(contributions, [[30, 8], [0, 16], [60, 0]])
+    np.testing.assert_allclose(contributions.sum(axis=1), scores)
+
+
+@pytest.mark.parametrize('k, expected', [
+    (0, []),
+    (1, [1]),
+    (3, [1, 3, 0]),
+    (4, [1, 3, 0, 4]),
+    (6, [1, 3, 0, 4, 2, 5]),
+    (10, [1, 3, 0, 4, 2, 5]),
+])
+def test_top_k(k, expected):
+    scores = np.array([5.0, 9.0, np.nan, 7.0, 5.0, np.nan])
+    top = analysis.top_k(scores, k)
+    assert top.tolist() == expected
+    assert top.dtype == np.int64
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import chart_data
+
+
+@pytest.fixture
+def tracts():
+    rng = np.random.default_rng(9)
+    n = 5000
+    df = pd.DataFrame({
+        'Census Tract': np.arange(n),
+        'county_name': rng.choice(['A', 'B', 'C'], n),
+        'value': rng.normal(size=n),
+        'other': rng.uniform(size=n),
+    })
+    df.loc[rng.uniform(size=n) < 0.05, 'value'] = np.nan
+    return df.set_index('county_name', append=True)
+
+
+def test_project_keeps_only_the_encoded_fields(tracts):
+    data = chart_data.project(tracts, ['county_name', 'value', 'value'])
+    assert list(data.columns) == ['county_name', 'value']
+    assert isinstance(data.index, pd.RangeIndex)
+    np.testing.assert_array_equal(data['value'], tracts['value'])
+
+
+def test_count_by_matches_value_counts(tracts):
+    df = tracts.assign(category=np.where(tracts['other'] > 0.5, 'high', 'low'))
+    counts = chart_data.count_by(df, 'county_name', 'category').set_index(['county_name', 'category'])['tract count']
+    expected = df.reset_index().groupby(['county_name', 'category']).size()
+    pd.testing.assert_series_equal(counts, expected, check_names=False)
+
+
+def test_downsample_keeps_evenly_spaced_sorted_rows(tracts):
+    df = tracts.reset_index()
+    data = chart_data.downsample(df, 'value', 101)
+    assert len(data) == 101
+    values = df['value'].dropna().sort_values().to_numpy()
+    positions = np.linspace(0, len(values) - 1, 101).round().astype(int)
+    np.testing.assert_array_equal(np.sort(data['value']), values[positions])
+    # Rows keep their original order
+    assert data['Census Tract'].is_monotonic_increasing
+
+
+def test_bar_data_below_the_limit(tracts):
+    data, n_rows = chart_data.bar_data(tracts.iloc[:50], 'Census Tract', 'value')
+    assert n_rows == 50
+    assert data['value'].notna().all()
+    assert len(data) == tracts['value'].iloc[:50].notna().sum()
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(10)
+    df = pd.DataFrame({'x': rng.normal(size=20000), 'y': rng.normal(size=20000) * 3})
+    df.loc[:9, 'x'] = 50.0
+    return df
+
+
+def test_scatter_sample_keeps_outliers_and_density(points):
+    sample = chart_data.scatter_sample(points, 'x', 'y', max_points=2000, bins=10)
+    outliers = chart_data.outlier_mask(points['x'].to_numpy()) | chart_data.outlier_mask(points['y'].to_numpy())
+    assert set(points.index[outliers]) <= set(sample.index)
+    assert len(sample) <= 2000 + 100
+    # Every occupied grid cell keeps at least one point, and the sampled share of each cell is close to the budget
+    inliers = points.loc[~outliers]
+    share = (len(sample) - outliers.sum()) / len(inliers)
+    cells = pd.cut(inliers['x'], 10, labels=False) * 10 + pd.cut(inliers['y'], 10, labels=False)
+    kept = cells.index.isin(sample.index)
+    per_cell = pd.Series(kept).groupby(cells.to_numpy()).agg(['sum', 'size'])
+    assert (per_cell['sum'] >= 1).all()
+    large = per_cell['size'] >= 200
+    np.testing.assert_allclose(per_cell.loc[large, 'sum'] / per_cell.loc[large, 'size'], share, atol=0.02)
+
+
+def test_scatter_sample_below_the_limit(points):
+    assert len(chart_data.scatter_sample(points.iloc[:100], 'x', 'y')) == 100
+
+
+def test_hexbin_counts_match_nearest_hexagon_centers(points):
+    gridsize = 12
+    bins = chart_data.hexbin(points, 'x', 'y', gridsize)
+    assert bins['points'].sum() == len(points)
+
+    # Hexagons are the Voronoi cells of their centers: every point belongs to the nearest center
+    x, y = points['x'].to_numpy(), points['y'].to_numpy()
+    px = (x - x.min()) / (x.max() - x.min()) * gridsize
+    py = (y - y.min()) / (y.max() - y.min()) * gridsize
+    r, q = np.meshgrid(np.arange(-2, gridsize + 3), np.arange(-gridsize, gridsize + 3), indexing='ij')
+    cx, cy = (np.sqrt(3) * (q + r / 2)).ravel(), (1.5 * r).ravel()
+    distances = (px[:, None] - cx[None, :]) ** 2 + (py[:, None] - cy[None, :]) ** 2
+    nearest = np.argmin(distances, axis=1)
+    # Points on the edge between two hexagons (the extremes can be) may go to either
+    closest = np.sort(distances, axis=1)[:, :2]
+    ties = np.isclose(closest[:, 0], closest[:, 1]).sum()
+    counts = np.bincount(nearest, minlength=len(cx))
+    expected = pd.DataFrame({
+        'x': x.min() + cx / gridsize * (x.max() - x.min()),
+        'y': y.min() + cy / gridsize * (y.max() - y.min()),
+        'expected': counts,
+    }).round(9)
+    merged = bins.round({'x': 9, 'y': 9}).merge(expected, on=['x', 'y'], how='outer').fillna(0)
+    assert len(merged) == len(expected)
+    assert (merged['points'] - merged['expected']).abs().sum() <= 2 * ties
+    assert ties < 10
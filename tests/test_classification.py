@@ -0,0 +1,116 @@
+import itertools
+import numpy as np
+import pytest
+
+pytest.importorskip('streamlit')
+
+import classification
+from conftest import memoize
+from constants import BREAKS
+
+
+@pytest.fixture
+def values():
+    rng = np.random.default_rng(11)
+    values = np.concatenate([rng.normal(10, 2, 300), rng.normal(40, 5, 150), rng.exponential(20, 50) + 60])
+    values[::37] = np.nan
+    return values
+
+
+def jenks_brute_force(x: np.ndarray, k: int) -> np.ndarray:
+    """Upper bounds of the split of sorted ``x`` into ``k`` runs with the least total squared deviation."""
+    best, best_cuts = np.inf, None
+    for cuts in itertools.combinations(range(1, len(x)), k - 1):
+        runs = np.split(x, cuts)
+        cost = sum(((run - run.mean()) ** 2).sum() for run in runs)
+        if cost < best - 1e-12:
+            best, best_cuts = cost, cuts
+    return np.array([run[-1] for run in np.split(x, best_cuts)])
+
+
+def test_cached_breaks_follow_the_values(monkeypatch):
+    monkeypatch.setattr(classification, 'cached_breaks', memoize(classification.cached_breaks))
+    values = np.arange(10.0)
+    classification.colors(values, classification.QUANTILE, 'feature', 'region')
+
+    # Same feature, region and length, different values
+    mixed = classification.colors(np.r_[values[:5], values[5:] * 100], classification.QUANTILE, 'feature', 'region')
+    np.testing.assert_array_equal(mixed, classification.colors(np.r_[values[:5], values[5:] * 100],
+                                                               classification.QUANTILE))
+    assert classification.fingerprint(values) != classification.fingerprint(values + 100)
+    assert classification.fingerprint(values) == classification.fingerprint(values[::-1])
+    assert classification.fingerprint([1.0, np.nan]) == classification.fingerprint([1.0])
+
+
+def test_equal_interval_breaks(values):
+    breaks = classification.equal_interval_breaks(values)
+    low, high = np.nanmin(values), np.nanmax(values)
+    np.testing.assert_allclose(breaks, low + np.array(BREAKS) * (high - low))
+    np.testing.assert_allclose(classification.equal_interval_breaks(values, 4), np.linspace(low, high, 4))
+
+
+@pytest.mark.parametrize('k', [3, 5, classification.N_CLASSES])
+def test_quantile_breaks_match_numpy(values, k):
+    expected = np.nanquantile(values, np.arange(1, k + 1) / k)
+    np.testing.assert_allclose(classification.quantile_breaks(values, k), expected)
+    classes = classification.classify(values[~np.isnan(values)], expected)
+    # Every class holds about the same number of values
+    assert np.ptp(np.bincount(classes, minlength=k)) <= 2
+
+
+@pytest.mark.parametrize('k', [2, 3, 4])
+def test_jenks_breaks_match_brute_force(k):
+    x = np.sort(np.random.default_rng(12).choice([1.0, 2.0, 2.5, 7.0, 8.0, 8.5, 9.0, 20.0, 21.0, 35.0], 10,
+                                                 replace=False))
+    np.testing.assert_allclose(classification.jenks_breaks(x, k), jenks_brute_force(x, k))
+
+
+def test_jenks_breaks_on_a_sample(values):
+    breaks = classification.jenks_breaks(values, 3, sample_size=200)
+    assert len(breaks) == 3
+    assert breaks[-1] == np.nanmax(values)
+    # The three clusters are separated
+    assert 14 < breaks[0] < 30
+    assert 50 < breaks[1] < 62
+
+
+def test_breaks_with_few_distinct_values():
+    np.testing.assert_array_equal(classification.jenks_breaks([1, 1, 2, np.nan], 4), [1, 2, 2, 2])
+    assert len(classification.quantile_breaks([np.nan, np.inf])) == 0
+    np.testing.assert_array_equal(classification.classify([1.0, np.nan], np.empty(0)), [0, 0])
+
+
+def test_classify_matches_searchsorted(values):
+    breaks = classification.quantile_breaks(values, 6)
+    classes = classification.classify(values, breaks)
+    finite = ~np.isnan(values)
+    np.testing.assert_array_equal(classes[finite], np.searchsorted(breaks, values[finite], side='left'))
+    # Missing values go to the last class
+    assert (classes[~finite] == 5).all()
+
+
+def test_class_colors_spread_over_the_palette():
+    palette = np.array(classification.COLOR_RANGE)
+    np.testing.assert_array_equal(classification.class_colors(np.arange(classification.N_CLASSES)), palette)
+    colors = classification.class_colors(np.array([0, 1, 2]), 3)
+    # Fewer classes use the ends of the palette and a color from its middle
+    np.testing.assert_array_equal(colors[[0, 2]], palette[[0, -1]])
+    assert len(np.unique(colors, axis=0)) == 3
+    assert any((colors[1] == c).all() for c in palette[1:-1])
+
+
+def test_colors_match_breaks_and_palette(values):
+    for scheme in classification.SCHEMES:
+        breaks = classification.breaks(values, scheme)
+        expected = classification.class_colors(classification.classify(values, breaks), len(breaks))
+        np.testing.assert_array_equal(classification.colors(values, scheme), expected)
+
+
+def test_rgba():
+    rgb = classification.class_colors(np.array([0, 3, 9]))
+    colors = classification.rgba(rgb)
+    assert colors.dtype == np.uint8 and colors.shape == (3, 4)
+    np.testing.assert_array_equal(colors[:, :3], rgb)
+    assert (colors[:, 3] == 255).all()
+    np.testing.assert_array_equal(classification.rgba(rgb, np.array([0, 25, 255]))[:, 3], [0, 25, 255])
+    np.testing.assert_array_equal(classification.rgba([1, 2, 3], 7), [[1, 2, 3, 7]])
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('streamlit')
+
+import correlation
+
+
+@pytest.fixture
+def df():
+    rng = np.random.default_rng(8)
+    n = 300
+    a = rng.normal(size=n)
+    df = pd.DataFrame({
+        'a': a * 1000 + 1e6,
+        'b': 2 * a + rng.normal(scale=0.5, size=n),
+        'c': rng.normal(size=n),
+        'count': rng.integers(0, 50, n),
+        'constant': 3.0,
+        'name': ['x'] * n,
+    })
+    df.loc[rng.uniform(size=n) < 0.15, 'b'] = np.nan
+    df.loc[rng.uniform(size=n) < 0.3, 'c'] = np.nan
+    return df
+
+
+@pytest.mark.parametrize('row_block', [7, 20000])
+def test_correlation_matrix_matches_pandas(df, monkeypatch, row_block):
+    monkeypatch.setattr(correlation, 'ROW_BLOCK', row_block)
+    corr = correlation.correlation_matrix(df)
+    expected = df.drop(columns='name').corr()
+    assert list(corr.columns) == ['a', 'b', 'c', 'count', 'constant']
+    pd.testing.assert_frame_equal(corr, expected, atol=1e-10, rtol=0)
+
+
+def test_pairs_without_common_rows(df):
+    df = df[['a', 'b']].copy()
+    df.loc[:150, 'a'] = np.nan
+    df.loc[150:, 'b'] = np.nan
+    corr = correlation.correlation_matrix(df)
+    assert np.isnan(corr.loc['a', 'b'])
+    pd.testing.assert_frame_equal(corr, df.corr())
+
+
+def test_correlations_slice_the_full_matrix(df):
+    corr = correlation.correlations(df, ['c', 'a'], 'test:correlation')
+    pd.testing.assert_frame_equal(corr, df[['c', 'a']].corr(), atol=1e-10, rtol=0)
+
+
+def test_top_pairs(df):
+    corr = df[['a', 'b', 'c', 'count']].corr()
+    pairs = correlation.top_pairs(corr, 2)
+    assert (pairs['variable'].iloc[0], pairs['variable2'].iloc[0]) == ('a', 'b')
+    stacked = corr.where(np.triu(np.ones(corr.shape, dtype=bool), k=1)).stack()
+    expected = stacked.reindex(stacked.abs().sort_values(ascending=False).index)[:2]
+    np.testing.assert_allclose(pairs['correlation'], expected.to_numpy())
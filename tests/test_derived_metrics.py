@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('streamlit')
+
+import derived_metrics
+from conftest import memoize
+
+
+@pytest.fixture
+def counties():
+    return pd.DataFrame({
+        'County Name': ['A', 'B', 'C'],
+        'households': [10.0, 20.0, 30.0],
+        'Total Population': [100.0, 50.0, 300.0],
+        'sqmi': [2.0, 4.0, 5.0],
+    })
+
+
+def test_derived_metrics(counties):
+    block = derived_metrics.derived_metrics(counties)
+    np.testing.assert_allclose(block['households per capita'], [0.1, 0.4, 0.1])
+    np.testing.assert_allclose(block['households per sqmi'], [5.0, 5.0, 6.0])
+
+
+def test_cached_values_follow_the_fingerprint_in_the_dataset_key(counties, monkeypatch):
+    monkeypatch.setattr(derived_metrics, 'cached_derived_metrics', memoize(derived_metrics.cached_derived_metrics))
+    # Same length and columns, different values
+    changed = counties.assign(households=[1.0, 2.0, 3.0])
+    for df, expected in [(counties, [0.1, 0.4, 0.1]), (changed, [0.01, 0.04, 0.01])]:
+        dataset = 'test:' + derived_metrics.fingerprint(df)
+        np.testing.assert_allclose(derived_metrics.feature_values(df, ['households'], 'Per Capita', dataset).iloc[:, 0],
+                                   expected)
+
+
+def test_fingerprint(counties):
+    assert derived_metrics.fingerprint(counties) == derived_metrics.fingerprint(counties.copy())
+    assert derived_metrics.fingerprint(counties) != derived_metrics.fingerprint(counties.iloc[::-1])
+    assert derived_metrics.fingerprint(counties) != derived_metrics.fingerprint(
+        counties.rename(columns={'households': 'families'}))
+    assert derived_metrics.fingerprint(counties[['County Name']]) != derived_metrics.fingerprint(
+        counties[['County Name']].iloc[:2])
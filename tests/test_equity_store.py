@@ -0,0 +1,124 @@
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('streamlit')
+
+import equity_store
+import queries
+from conftest import assert_ignores_other_data_versions
+
+
+@pytest.fixture
+def tracts():
+    rng = np.random.default_rng(5)
+    n = 40
+    values = rng.integers(0, 100, (n, len(equity_store.EQUITY_COLUMNS))).astype('float32')
+    values[rng.uniform(size=values.shape) < 0.1] = np.nan
+    df = pd.DataFrame(values, columns=equity_store.EQUITY_COLUMNS)
+    df.insert(0, 'Census Tract', np.arange(n))
+    # County 4 has a single tract
+    df.insert(1, 'county_id', [1] * 15 + [2] * 14 + [3] * 10 + [4])
+    df.insert(2, 'state_name', 'S')
+    df.insert(3, 'county_name', df['county_id'].map(str))
+    return df
+
+
+@pytest.mark.parametrize('county_ids', [[1, 2, 3, 4], [2], [1, 4], [4]])
+def test_pooled_moments_match_selected_tracts(tracts, county_ids):
+    stats = equity_store.county_moments(tracts)
+    means, stds = equity_store.pooled_moments(stats, county_ids)
+
+    values = tracts.loc[tracts['county_id'].isin(county_ids), equity_store.EQUITY_COLUMNS].to_numpy(dtype='float64')
+    with warnings.catch_warnings():
+        # Indicators without values, or with a single one, have no mean or standard deviation
+        warnings.simplefilter('ignore', RuntimeWarning)
+        expected_means = np.nanmean(values, axis=0)
+        expected_stds = np.nanstd(values, axis=0, ddof=1)
+    np.testing.assert_allclose(means, expected_means)
+    np.testing.assert_allclose(stds, expected_stds)
+
+
+def test_classification_from_pooled_moments(tracts):
+    selected = tracts.loc[tracts['county_id'].isin([1, 3])]
+    means, stds = equity_store.pooled_moments(equity_store.county_moments(tracts), [1, 3])
+
+    pooled = queries.classify_equity_geographies(selected, means=means, stds=stds)
+    direct = queries.classify_equity_geographies(selected)
+    np.testing.assert_array_equal(pooled['codes'], direct['codes'])
+
+
+def test_criteria_flags_match_classification_of_state_and_county(tracts):
+    flags = equity_store.criteria_flags(tracts, equity_store.county_moments(tracts))
+    state = flags[equity_store.criteria_columns('State')].to_numpy().T
+    np.testing.assert_array_equal(state, queries.classify_equity_geographies(tracts)['codes'])
+    for county_id, rows in tracts.groupby('county_id').indices.items():
+        county = flags[equity_store.criteria_columns('County')].to_numpy()[rows].T
+        with warnings.catch_warnings():
+            # The single tract of county 4 misses some indicators
+            warnings.simplefilter('ignore', RuntimeWarning)
+            expected = queries.classify_equity_geographies(tracts.iloc[rows])['codes']
+        np.testing.assert_array_equal(county, expected)
+    assert (flags[equity_store.criteria_columns('County')].dtypes == 'uint8').all()
+
+
+def test_stored_codes_of_a_state_or_a_county(tracts):
+    flags = equity_store.criteria_flags(tracts, equity_store.county_moments(tracts))
+    tract_ids = tracts['Census Tract'].iloc[::-1]
+    np.testing.assert_array_equal(equity_store.stored_codes(flags, [1, 2, 3, 4], tract_ids),
+                                  flags[equity_store.criteria_columns('State')].to_numpy()[::-1].T)
+    county = tracts['county_id'] == 2
+    np.testing.assert_array_equal(equity_store.stored_codes(flags, [2], tracts.loc[county, 'Census Tract']),
+                                  flags.loc[county, equity_store.criteria_columns('County')].to_numpy().T)
+    # Other selections are classified from pooled moments
+    assert equity_store.stored_codes(flags, [1, 3], tracts['Census Tract']) is None
+
+
+def test_stored_codes_with_repeated_tracts(tracts):
+    flags = equity_store.criteria_flags(tracts, equity_store.county_moments(tracts))
+    columns = equity_store.criteria_columns('State')
+    repeated = pd.concat([flags.iloc[[1]], flags], ignore_index=True)
+
+    codes = equity_store.stored_codes(repeated, [1, 2, 3, 4], pd.Series([2, 1, 1, 0]))
+    np.testing.assert_array_equal(codes, flags[columns].to_numpy()[[2, 1, 1, 0]].T)
+
+
+def test_build_state_writes_plain_tables(tracts, tmp_path, monkeypatch):
+    def memoized(*args, **kwargs):
+        raise AssertionError('workers must not call cached queries')
+
+    def census_tracts_query(county_ids, tables, columns=None, geometry=True, table_columns=None):
+        assert not geometry and table_columns == {'table': ['column']}
+        df = tracts.loc[tracts['county_id'].isin(county_ids)].iloc[::-1]
+        # Tract 3 is listed twice by the census tables
+        df = pd.concat([df, df.loc[df['Census Tract'] == 3]])
+        return df.assign(**{c: 1.0 for c in equity_store.TRANSPORT_COLUMNS})
+
+    monkeypatch.setattr(queries, 'census_tracts_query', census_tracts_query)
+    monkeypatch.setattr(queries, 'latest_data_census_tracts', memoized)
+    monkeypatch.setattr(queries, 'all_counties_query', memoized)
+    monkeypatch.setattr(queries, 'clean_equity_data', lambda df: df)
+    monkeypatch.setattr(queries, 'derive_transport_data', lambda df: df)
+
+    assert equity_store.build_state('S', [1, 2], {'table': ['column']}, str(tmp_path)) == 29
+    stored = equity_store.load_state('S', str(tmp_path))
+    assert list(stored['tracts'].columns) == equity_store.KEY_COLUMNS + equity_store.EQUITY_COLUMNS
+    assert stored['tracts']['Census Tract'].is_monotonic_increasing
+    for table in equity_store.TABLES:
+        if 'Census Tract' in stored[table].columns:
+            assert stored[table]['Census Tract'].is_unique
+    assert list(stored['transport'].columns) == equity_store.KEY_COLUMNS + equity_store.TRANSPORT_COLUMNS
+    pd.testing.assert_frame_equal(stored['stats'], equity_store.county_moments(stored['tracts']))
+    pd.testing.assert_frame_equal(stored['criteria'],
+                                  equity_store.criteria_flags(stored['tracts'], stored['stats']))
+
+
+
+def test_store_of_another_data_version_is_ignored(tracts, tmp_path, monkeypatch):
+    path = tmp_path / equity_store.DATA_VERSION / 'S'
+    path.mkdir(parents=True)
+    for table in equity_store.TABLES:
+        equity_store.county_moments(tracts).to_parquet(path / (table + '.parquet'))
+    assert_ignores_other_data_versions(monkeypatch, equity_store, lambda: equity_store.load_state('S', str(tmp_path)),
+                                       equity_store._states)
@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('streamlit')
+
+import feature_store
+import queries
+from conftest import assert_ignores_other_data_versions
+
+TABLES = {
+    # Tract 4 has no poverty data and tract 1 no housing data; both tables hold 'total_units'
+    'poverty': pd.DataFrame({'Census Tract': [1, 2, 3], 'poverty_rate': [0.1, 0.2, 0.3],
+                             'total_units': [10.0, 20.0, 30.0]}),
+    'housing': pd.DataFrame({'Census Tract': [2, 3, 4], 'vacant_units': [1.0, 2.0, 3.0],
+                             'total_units': [21.0, 31.0, 41.0]}),
+    'empty': pd.DataFrame({'Census Tract': [], 'unused': []}),
+}
+
+KEYS = pd.DataFrame({
+    'Census Tract': [1, 2, 3, 4],
+    'county_id': [7, 7, 8, 8],
+    'county_name': ['A', 'A', 'B', 'B'],
+    'state_name': ['S', 'S', 'S', 'S'],
+    'tot_population_census_2010': [100, 200, 300, 400],
+})
+
+
+def census_tracts_query(county_ids, tables, columns=None, geometry=True):
+    """Tables joined on their common tracts, keeping a shared column from the first table (as the database query)."""
+    res = None
+    for table in tables:
+        df = TABLES[table].merge(KEYS, on='Census Tract')
+        df = df.loc[df['county_id'].isin(county_ids)]
+        if res is None:
+            res = df
+            continue
+        res = res.merge(df, on='Census Tract', how='inner', suffixes=('', '_y'))
+        res = res.drop(res.filter(regex='_y$').columns.tolist(), axis=1)
+    return res
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(queries, 'CENSUS_TABLES', list(TABLES))
+    monkeypatch.setattr(queries, 'census_tracts_query', census_tracts_query)
+    monkeypatch.setattr(queries, 'all_counties_query', lambda: KEYS[['county_id', 'county_name', 'state_name']])
+    monkeypatch.setattr(feature_store, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    feature_store._partitions.clear()
+    feature_store._manifests.clear()
+    directory = str(tmp_path)
+    counts = feature_store.build_store(['S'], workers=1, directory=directory)
+    assert counts == {'S': 4}
+    return directory
+
+
+@pytest.mark.parametrize('tables', [['poverty'], ['housing'], ['poverty', 'housing'], ['housing', 'poverty']])
+@pytest.mark.parametrize('county_ids', [[7, 8], [8]])
+def test_tract_data_matches_census_tracts_query(store, tables, county_ids):
+    data = feature_store.tract_data('S', county_ids, tables, store)
+    expected = census_tracts_query(county_ids, tables)
+    expected = expected[feature_store.KEY_COLUMNS + [c for c in expected.columns if c not in feature_store.KEY_COLUMNS]]
+    pd.testing.assert_frame_equal(data, expected.sort_values('Census Tract').reset_index(drop=True),
+                                  check_dtype=False)
+
+
+def test_shared_columns_keep_every_table_values(store):
+    partition = pd.read_parquet(feature_store.partition_path('S', store))
+    np.testing.assert_array_equal(partition['poverty/total_units'], [10, 20, 30, np.nan])
+    np.testing.assert_array_equal(partition['housing/total_units'], [np.nan, 21, 31, 41])
+    assert not partition['has_empty'].any()
+
+
+def test_missing_table_is_not_served(store):
+    assert feature_store.tract_data('S', [7], ['poverty', 'unknown'], store) is None
+
+
+def test_build_state_takes_its_counties_from_the_caller(store, monkeypatch):
+    def all_counties_query():
+        raise AssertionError('workers must not query the counties')
+
+    monkeypatch.setattr(queries, 'all_counties_query', all_counties_query)
+    manifest = feature_store.build_state('S', [8], store)
+    assert sorted(manifest['table'].unique()) == ['housing', 'poverty']
+    assert feature_store.tract_data('S', [7, 8], ['housing'], store)['Census Tract'].to_list() == [3, 4]
+
+
+
+def test_store_of_another_data_version_is_ignored(store, monkeypatch):
+    assert_ignores_other_data_versions(monkeypatch, feature_store,
+                                       lambda: feature_store.tract_data('S', [7, 8], ['poverty'], store),
+                                       feature_store._partitions, feature_store._manifests)
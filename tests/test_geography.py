@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import geography
+
+
+@pytest.fixture
+def counties():
+    return pd.DataFrame({
+        'state_name': ['Ohio', 'Ohio', 'Indiana', 'Indiana', ' Texas '],
+        'county_name': ['Adams', 'Franklin', 'Adams', 'Marion', 'Travis'],
+        'county_id': [39001, 39049, 18001, 18097, 48453],
+    })
+
+
+def test_to_fips():
+    keys = geography.to_fips(['01001', 39049.0, '48453'])
+    assert keys.dtype == 'int32'
+    assert keys.tolist() == [1001, 39049, 48453]
+
+    tracts = geography.to_fips([1001020100, None, 'x'], 'int64')
+    assert tracts.dtype == 'Int64'
+    assert tracts.isna().tolist() == [False, True, True]
+    assert geography.to_fips([1, np.nan]).dtype == 'Int32'
+
+
+def test_normalize_keys():
+    df = pd.DataFrame({'county_id': ['01001', '39049'], 'tract_id': [1.0, np.nan], 'name': ['a', 'b']})
+    df = geography.normalize_keys(df)
+    assert str(df['county_id'].dtype) == 'int32'
+    assert str(df['tract_id'].dtype) == 'Int64'
+    assert df['name'].tolist() == ['a', 'b']
+
+
+def test_sql_in():
+    assert geography.sql_in([1001, '39049', 1001.0]) == "('01001','39049')"
+    assert geography.sql_in([6], 'state') == "('06')"
+    assert geography.sql_in([1001020100], 'tract') == "('01001020100')"
+    assert geography.sql_in([]) == '(NULL)'
+    assert geography.sql_in([None, np.nan]) == '(NULL)'
+
+
+def test_county_ids(counties):
+    assert geography.county_ids(counties, 'ohio ', ['Adams', ' franklin', 'Marion']) == [39001, 39049]
+    assert geography.county_ids(counties, 'Texas', ['Travis']) == [48453]
+
+
+def test_attach_county_ids_by_state_and_name(counties):
+    df = pd.DataFrame({'State': ['Ohio', 'indiana', 'Ohio'], 'County Name': ['Adams ', 'Adams', 'Nowhere'],
+                       'value': [1, 2, 3]})
+    res = geography.attach_county_ids(df, counties)
+    assert res['county_id'].tolist() == [39001, 18001]
+    assert res['value'].tolist() == [1, 2]
+    assert str(res['county_id'].dtype) == 'int32'
+    assert not any(c.startswith('_') for c in res.columns)
+
+
+def test_attach_county_ids_without_states_drops_ambiguous_names(counties):
+    df = pd.DataFrame({'County Name': ['Adams', 'Franklin', 'Marion'], 'value': [1, 2, 3]})
+    res = geography.attach_county_ids(df, counties)
+    assert res['county_id'].tolist() == [39049, 18097]
+
+    # Within a state filter the name is no longer ambiguous
+    res = geography.attach_county_ids(df, counties, states=[' Indiana'])
+    assert res['county_id'].tolist() == [18001, 18097]
+    assert res['value'].tolist() == [1, 3]
+
+
+def test_attach_county_ids_keeps_existing_ids(counties):
+    df = pd.DataFrame({'county_id': ['39001'], 'County Name': ['Somewhere else']})
+    assert geography.attach_county_ids(df, counties)['county_id'].tolist() == [39001]
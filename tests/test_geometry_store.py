@@ -0,0 +1,90 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import MultiPolygon, Polygon, box
+
+import geometry_store
+
+DONUT = Polygon([(0, 0), (4, 0), (4, 4), (0, 4), (0, 0)],
+                [[(1, 1), (2, 1), (2, 2), (1, 2), (1, 1)], [(2.5, 2.5), (3, 2.5), (3, 3), (2.5, 2.5)]])
+
+
+@pytest.fixture
+def store(tmp_path):
+    # Ids are given out of order; 30 has no geometry
+    geometry_store.build_store('tract', [30, 20, 10],
+                               [None, MultiPolygon([DONUT, box(5, 5, 6, 6)]), box(0, 0, 1, 1)],
+                               str(tmp_path), attributes={'sqmi': [3.0, 2.0, 1.0], 'population': [300, 200, 100]})
+    return geometry_store.load_store('tract', str(tmp_path))
+
+
+def ring(coords) -> list:
+    return [list(c) for c in coords]
+
+
+def test_offsets_follow_parts_and_rings(store):
+    np.testing.assert_array_equal(store.geoids, [10, 20, 30])
+    # 10: one part with one ring; 20: a polygon with two holes and a square; 30: nothing
+    np.testing.assert_array_equal(store.geom_offsets, [0, 1, 3, 3])
+    np.testing.assert_array_equal(store.part_offsets, [0, 1, 4, 5])
+    np.testing.assert_array_equal(store.ring_offsets, [0, 5, 10, 15, 19, 24])
+    assert store.coords.shape == (24, 2)
+    np.testing.assert_array_equal(store.coords[10:15], ring(DONUT.interiors[0].coords))
+    np.testing.assert_array_equal(store.coords[15:19], ring(DONUT.interiors[1].coords))
+
+
+def test_coordinates_of_missing_ids_are_empty(store):
+    coords = store.coordinates([20, 99, 30, 10])
+    assert [len(c) for c in coords] == [24 - 5, 0, 0, 5]
+    np.testing.assert_array_equal(coords[3], ring(box(0, 0, 1, 1).exterior.coords))
+    np.testing.assert_array_equal(store.positions([10, 99, np.nan, 30]), [0, -1, -1, 2])
+
+
+def test_slice_spans_positions(store):
+    np.testing.assert_array_equal(store.slice(0, 1), store.coords[:5])
+    np.testing.assert_array_equal(store.slice(1, 3), store.coords[5:])
+    np.testing.assert_array_equal(store.slice(0, 3), store.coords)
+
+
+def test_attributes_in_requested_order(store):
+    attributes = store.attributes([30, 99, 10])
+    np.testing.assert_array_equal(attributes['sqmi'], [3.0, np.nan, 1.0])
+    np.testing.assert_array_equal(attributes['population'], [300.0, np.nan, 100.0])
+
+
+def test_attributes_not_built(tmp_path):
+    geometry_store.build_store('county', [1], [box(0, 0, 1, 1)], str(tmp_path))
+    assert geometry_store.load_store('county', str(tmp_path)).attributes([1]) is None
+
+
+def test_rebuild_leaves_mapped_store_intact(store, tmp_path):
+    old_coords = np.array(store.coords)
+    geometry_store.build_store('tract', [40], [box(7, 7, 8, 8)], str(tmp_path))
+
+    # The open store still reads its own (now unlinked) files
+    np.testing.assert_array_equal(store.coords, old_coords)
+    rebuilt = geometry_store.load_store('tract', str(tmp_path))
+    assert rebuilt is not store
+    np.testing.assert_array_equal(rebuilt.geoids, [40])
+    assert rebuilt.attributes([40]) is None
+    assert sorted(os.listdir(os.path.join(str(tmp_path), geometry_store.DATA_VERSION))) == ['tract']
+
+
+def test_store_is_keyed_by_data_version(monkeypatch, store, tmp_path):
+    assert geometry_store.load_store('tract', str(tmp_path)) is store
+    monkeypatch.setattr(geometry_store, 'DATA_VERSION', geometry_store.DATA_VERSION + '.next')
+    assert geometry_store.load_store('tract', str(tmp_path)) is None
+
+
+def test_polygon_frame_leaves_out_ids_without_geometry(monkeypatch, store):
+    monkeypatch.setattr(geometry_store, 'load_store', lambda kind: store)
+    data = pd.DataFrame({'Census Tract': [30, 10, 99, 20], 'value': [0.1234, 1.0, 2.0, 3.0]})
+    frame = geometry_store.polygon_frame(data, ['value'])
+
+    assert frame['Census Tract'].tolist() == [10, 20]
+    assert frame['value'].tolist() == [1.0, 3.0]
+    assert frame['name'].tolist() == ['10', '20']
+    # The first row anchors the map's view state
+    assert frame['coordinates'][0][0][0] == list(box(0, 0, 1, 1).exterior.coords[0])
+    assert [len(c[0]) for c in frame['coordinates']] == [5, 24 - 5]
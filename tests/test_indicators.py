@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('streamlit')
+
+import indicators
+import queries
+
+RAW_COLUMNS = sorted(set(queries.EQUITY_CENSUS_COLUMNS) | set(queries.TRANSPORT_CENSUS_COLUMNS) |
+                     {'total_workers_commute'})
+
+
+@pytest.fixture
+def raw():
+    rng = np.random.default_rng(8)
+    n = 60
+    df = pd.DataFrame(rng.integers(0, 500, (n, len(RAW_COLUMNS))).astype('float64'), columns=RAW_COLUMNS)
+    for col in ['percent_hh_0_veh', 'percent_drive_alone']:
+        df[col] = rng.uniform(0, 1, n)
+    df.iloc[3, 5] = np.nan
+    # Tract 0 has no population, so its percentages divide by zero
+    df.loc[0, ['total_population', 'male', 'female']] = 0
+    df.insert(0, 'Census Tract', np.arange(n))
+    return df
+
+
+def total(data: pd.DataFrame, cols: list) -> pd.Series:
+    res = data[cols[0]]
+    for col in cols[1:]:
+        res = res + data[col]
+    return res
+
+
+def reference_equity(data: pd.DataFrame) -> pd.DataFrame:
+    # The formulas of clean_equity_data before the registry
+    data = data.copy()
+    data['Age 19 or Under'] = total(data, indicators.AGE_19_OR_UNDER_COLUMNS)
+    data['Age 65 or Over'] = total(data, indicators.AGE_65_OR_OVER_COLUMNS)
+    data.rename({'below_pov_level': 'Below Poverty Level', '200_below_pov_level': '200% Below Poverty Level'}, axis=1,
+                inplace=True)
+    data['total_w_a_disability'] = total(data, indicators.DISABILITY_COLUMNS)
+    data['speak_eng_not_well'] = total(data, indicators.ENGLISH_NOT_WELL_COLUMNS)
+    data['single_parent'] = (data['other_male_householder_no_spouse_w_kids'] +
+                             data['other_female_householder_no_spouse_w_kids'])
+    data['non-white'] = data['total_population'] - data['not_hisp_or_latino_white']
+    data['People with Disability (%)'] = data['total_w_a_disability'] / (data['male'] + data['female'])
+    data['200% Below Poverty Level (%)'] = (data['200% Below Poverty Level'] /
+                                            data['population_for_whom_poverty_status_is_determined'])
+    data['Age 19 or Under (%)'] = data['Age 19 or Under'] / data['total_population']
+    data['Age 65 or Over (%)'] = data['Age 65 or Over'] / data['total_population']
+    data['Limited English Proficiency (%)'] = data['speak_eng_not_well'] / (data['native'] + data['foreign_born'])
+    data['Single Parent Family (%)'] = data['single_parent'] / data['total_families']
+    data['Zero-Vehicle Household (%)'] = data['percent_hh_0_veh']
+    data['People of Color (%)'] = data['non-white'] / data['total_population']
+    for header in queries.EQUITY_CENSUS_POC_LOW_INCOME + queries.EQUITY_CENSUS_REMAINING_HEADERS:
+        data[header + ' (%)'] = round(data[header + ' (%)'] * 100)
+    return data
+
+
+def reference_transport(data: pd.DataFrame) -> pd.DataFrame:
+    # The formulas of clean_transport_data before the registry
+    data = data.copy()
+    data['number_drive_alone'] = data['percent_drive_alone'] * data['total_workers_commute']
+    data.drop(['total_workers_commute'], axis=1, inplace=True)
+    data['non-white'] = data['total_population'] - data['not_hisp_or_latino_white']
+    data['People of Color (%)'] = 100 * (data['non-white'] / data['total_population'])
+    data['No Computer Households (%)'] = 100 * (data['household_no_computing_device'] /
+                                                total(data, indicators.COMPUTER_COLUMNS))
+    data['200% Below Poverty Level (%)'] = 100 * (data['200_below_pov_level'] /
+                                                  data['population_for_whom_poverty_status_is_determined'])
+    data['Renter Occupied Units (%)'] = 100 * (data['renter-occ_units'] / data['occupied_housing_units'])
+    data['Age 19 or Under'] = total(data, indicators.AGE_19_OR_UNDER_COLUMNS)
+    data['Age 19 or Under (%)'] = 100 * (data['Age 19 or Under'] / data['total_population'])
+    data['Age 65 or Over'] = total(data, indicators.AGE_65_OR_OVER_COLUMNS)
+    data['Age 65 or Over (%)'] = 100 * (data['Age 65 or Over'] / data['total_population'])
+    data['speak_eng_not_well'] = total(data, indicators.ENGLISH_NOT_WELL_COLUMNS)
+    data['Limited English Proficiency (%)'] = 100 * (data['speak_eng_not_well'] /
+                                                     (data['native'] + data['foreign_born']))
+    data['single_parent'] = (data['other_male_householder_no_spouse_w_kids'] +
+                             data['other_female_householder_no_spouse_w_kids'])
+    data['Single Parent Family (%)'] = 100 * (data['single_parent'] / data['total_families'])
+    data.rename(queries.TRANSPORT_RENAMES, axis=1, inplace=True)
+    return data
+
+
+def test_equity_indicators_match_the_baseline_formulas(raw):
+    expected = reference_equity(raw)
+    data = queries.clean_equity_data(raw.copy())
+
+    columns = [h + ' (%)' for h in queries.EQUITY_CENSUS_POC_LOW_INCOME + queries.EQUITY_CENSUS_REMAINING_HEADERS]
+    columns += ['Age 19 or Under', 'Age 65 or Over', 'total_w_a_disability', 'speak_eng_not_well', 'single_parent',
+                'non-white', '200% Below Poverty Level']
+    pd.testing.assert_frame_equal(data[columns], expected[columns])
+    # Zero-vehicle shares are fractions in the census table and whole percentages once derived
+    np.testing.assert_array_equal(data['Zero-Vehicle Household (%)'], np.round(raw['percent_hh_0_veh'] * 100))
+
+
+def test_transport_indicators_match_the_baseline_formulas(raw):
+    expected = reference_transport(raw)
+    data = queries.derive_transport_data(raw.copy())
+
+    assert 'total_workers_commute' not in data.columns
+    assert sorted(data.columns) == sorted(expected.columns)
+    pd.testing.assert_frame_equal(data[expected.columns], expected)
+    # The zero-vehicle share is renamed, not scaled
+    np.testing.assert_array_equal(data['Zero-Vehicle Households (%)'], raw['percent_hh_0_veh'])
+    assert 'Zero-Vehicle Household (%)' not in data.columns
+
+
+def test_evaluation_order_puts_dependencies_first():
+    order = indicators.evaluation_order(['People of Color (%)', 'number_drive_alone'])
+    assert order == ['non-white', 'People of Color (%)', 'number_drive_alone']
+
+
+def test_required_columns():
+    assert indicators.required_columns(['People of Color (%)']) == ['not_hisp_or_latino_white', 'total_population']
+    assert indicators.required_columns(['No Computer Households (%)']) == sorted(indicators.COMPUTER_COLUMNS)
+    assert set(indicators.required_columns(indicators.EQUITY_INDICATORS)).isdisjoint(indicators.INDICATORS)
+    # Renamed transport columns are queried as well
+    assert set(queries.TRANSPORT_RENAMES) <= set(queries.TRANSPORT_CENSUS_COLUMNS)
+
+
+def test_circular_definitions_are_rejected(monkeypatch):
+    monkeypatch.setitem(indicators.INDICATORS, 'a', {'sum': ['b', 'raw']})
+    monkeypatch.setitem(indicators.INDICATORS, 'b', {'sum': ['c']})
+    monkeypatch.setitem(indicators.INDICATORS, 'c', {'sum': ['a']})
+    with pytest.raises(ValueError, match='Circular indicator definition'):
+        indicators._compile(('a',))
+    monkeypatch.setitem(indicators.INDICATORS, 'c', {'sum': ['raw'], 'per': ['other']})
+    assert indicators._compile(('a',)) == (('c', 'b', 'a'), ('other', 'raw'))
+    indicators._compile.cache_clear()
@@ -0,0 +1,148 @@
+import re
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('streamlit')
+
+import queries
+
+HEADERS = queries.EQUITY_CENSUS_POC_LOW_INCOME + queries.EQUITY_CENSUS_REMAINING_HEADERS
+
+
+@pytest.fixture
+def tracts():
+    rng = np.random.default_rng(9)
+    n = 200
+    # Few distinct whole percentages, so many tracts sit exactly on a threshold; a shared component makes some tracts
+    # high on every indicator
+    values = (rng.integers(0, 8, (n, len(HEADERS))) + 10 * (rng.uniform(size=(n, 1)) < 0.15)).astype('float64') * 5
+    values[rng.uniform(size=values.shape) < 0.1] = np.nan
+    df = pd.DataFrame(values, columns=[h + ' (%)' for h in HEADERS])
+    df.insert(0, 'Census Tract', np.arange(n))
+    return df
+
+
+def reference_equity_geographies(epc: pd.DataFrame, coeff: float) -> tuple:
+    # The per-row rules of get_equity_geographies before the broadcast classifier
+    concentration_thresholds = dict()
+    averages = dict()
+    for header in HEADERS:
+        averages[header] = epc[header + ' (%)'].mean()
+        concentration_thresholds[header] = averages[header] + coeff * epc[header + ' (%)'].std()
+        epc[header + '_check'] = epc[header + ' (%)'].apply(lambda x: x > concentration_thresholds[header])
+        epc[header + '_check'] = epc[header + '_check'].astype(int)
+
+    epc['criteria_A'] = epc[[x + '_check' for x in queries.EQUITY_CENSUS_POC_LOW_INCOME]].sum(axis=1)
+    epc['Criteria A'] = epc['criteria_A'].apply(lambda x: bool(x == 2))
+    epc['criteria_B'] = epc[[x + '_check' for x in queries.EQUITY_CENSUS_REMAINING_HEADERS]].sum(axis=1)
+    temp = epc['200% Below Poverty Level (%)'].apply(lambda x: x > concentration_thresholds['200% Below Poverty Level'])
+    epc['Criteria B'] = (epc['criteria_B'].apply(lambda x: bool(x >= 3)) + temp.astype(int)) == 2
+
+    df = epc
+    epc['Criteria'] = epc[['Criteria A', 'Criteria B']].apply(
+        lambda x: 'Equity Geography (Meets Both Criteria)' if (x['Criteria A'] & x['Criteria B']) else
+        ('Equity Geography (Meets Criteria A)' if x['Criteria A'] else
+         ('Equity Geography (Meets Criteria B)' if x['Criteria B'] else 'Not selected as an Equity Geography')),
+        axis=1)
+    epc = epc.loc[(epc['Criteria A'] | epc['Criteria B'])]
+    df['Category'] = (df['Criteria A'] | df['Criteria B']).map({True: 'Equity Geography', False: 'Other'})
+
+    epc_averages = {header: epc[header + ' (%)'].mean() for header in HEADERS}
+    return epc, df, concentration_thresholds, averages, epc_averages
+
+
+@pytest.mark.parametrize('all_levels', [False, True])
+@pytest.mark.parametrize('coeff', list(queries.EQUITY_COEFFICIENTS.values()))
+def test_equity_geographies_match_the_per_row_rules(tracts, coeff, all_levels):
+    classification = queries.classify_equity_geographies(tracts) if all_levels else None
+    epc, df, thresholds, averages, epc_averages = queries.get_equity_geographies(tracts.copy(), coeff, classification)
+    expected = reference_equity_geographies(tracts.copy(), coeff)
+
+    columns = ([h + '_check' for h in HEADERS] +
+               ['criteria_A', 'Criteria A', 'criteria_B', 'Criteria B', 'Criteria', 'Category'])
+    pd.testing.assert_frame_equal(df[columns], expected[1][columns], check_dtype=False)
+    pd.testing.assert_index_equal(epc.index, expected[0].index)
+    for result, reference in zip([thresholds, averages, epc_averages], expected[2:]):
+        assert list(result) == list(reference)
+        np.testing.assert_allclose(list(result.values()), list(reference.values()))
+    # Some tracts meet each criterion, and NaN values never do
+    assert df['Criteria A'].any() and df['Criteria B'].any()
+    poverty = tracts['200% Below Poverty Level (%)'].isna()
+    assert not df.loc[poverty, 'Criteria A'].any() and not df.loc[poverty, 'Criteria B'].any()
+
+
+TABLE_COLUMNS = {
+    'first': ['tract_id', 'a', 'b'],
+    'second': ['tract_id', 'b', 'c'],
+    'third': ['tract_id', 'a'],
+}
+
+
+class FakeCursor(object):
+    """Answers census tract queries from TABLE_COLUMNS, recording each query."""
+
+    def __init__(self, queries_run: list):
+        self.queries_run = queries_run
+        self.description = None
+        self.rows = []
+
+    def execute(self, query):
+        self.queries_run.append(query)
+        table = re.search(r'FROM (\w+)', query).group(1)
+        select = re.search(r'SELECT (.*?), id_index\.county_name', query, re.S).group(1)
+        columns = TABLE_COLUMNS[table] if select == f'{table}.*' else re.findall(r'"(\w+)"', select)
+        columns = columns + ['county_name', 'county_id', 'state_name', 'tract_id', 'tot_population_census_2010']
+        self.description = [(c,) for c in columns]
+        self.rows = [tuple(f'{table}.{c}' if c in 'abc' else i for c in columns) for i in (1, 2)]
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.queries_run = []
+
+    def cursor(self):
+        return FakeCursor(self.queries_run)
+
+    def commit(self):
+        pass
+
+
+def test_census_select_list_takes_each_column_once():
+    selects = queries.census_select_list(['first', 'second', 'third'], ['a', 'b', 'c'], TABLE_COLUMNS)
+    assert selects == {'first': 'first."a", first."b"', 'second': 'second."c"'}
+    assert queries.census_select_list(['second', 'first'], ['a', 'b'], TABLE_COLUMNS) == {
+        'second': 'second."b"', 'first': 'first."a"'}
+    assert queries.census_select_list(['first', 'third'], None, TABLE_COLUMNS) == {
+        'first': 'first.*', 'third': 'third.*'}
+
+
+def test_census_tracts_query_projects_columns(monkeypatch):
+    conn = FakeConnection()
+    monkeypatch.setattr(queries, 'init_connection', lambda: conn)
+
+    df = queries.census_tracts_query([1001], ['first', 'second', 'third'], ['a', 'c'], geometry=False,
+                                     table_columns=TABLE_COLUMNS)
+    # The third table only holds a column the first one already provides, so it is not queried
+    assert [re.search(r'FROM (\w+)', q).group(1) for q in conn.queries_run] == ['first', 'second']
+    assert all("IN ('01001')" in q for q in conn.queries_run)
+    assert df['a'].tolist() == ['first.a'] * 2
+    assert df['c'].tolist() == ['second.c'] * 2
+    assert 'b' not in df.columns
+    assert df['Census Tract'].tolist() == [1, 2]
+
+
+def test_census_tracts_query_without_columns_selects_everything(monkeypatch):
+    conn = FakeConnection()
+    monkeypatch.setattr(queries, 'init_connection', lambda: conn)
+    monkeypatch.setattr(queries, 'table_columns_query', lambda tables: pytest.fail('no columns to look up'))
+
+    df = queries.census_tracts_query([1001], ['first', 'second'], geometry=False)
+    assert [q.split('SELECT ')[1].split(',')[0] for q in conn.queries_run] == ['first.*', 'second.*']
+    # Columns the second table shares with the first are taken from the first
+    assert df['b'].tolist() == ['first.b'] * 2
+    assert df['c'].tolist() == ['second.c'] * 2
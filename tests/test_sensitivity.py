@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('streamlit')
+
+import sensitivity
+
+
+@pytest.fixture
+def normalized():
+    rng = np.random.default_rng(1)
+    return pd.DataFrame(rng.uniform(0, 1, (15, 4)), columns=['a', 'b', 'c', 'd'],
+                        index=[f'County {i}' for i in range(15)])
+
+
+def test_rank_scores_matches_argsort():
+    scores = np.random.default_rng(2).uniform(size=(5, 30))
+    expected = np.argsort(np.argsort(-scores, axis=1), axis=1) + 1
+    np.testing.assert_array_equal(sensitivity.rank_scores(scores), expected)
+
+
+def test_sample_weights_are_dirichlet_around_equal_weights():
+    weights = sensitivity.sample_weights(np.random.default_rng(3), 20000, 4)
+    assert weights.shape == (20000, 4)
+    assert (weights >= 0).all()
+    np.testing.assert_allclose(weights.sum(axis=1), 4)
+    # Dirichlet(1, ..., 1) marginals have mean 1 / n and variance (n - 1) / (n^2 (n + 1)), scaled by n here
+    np.testing.assert_allclose(weights.mean(axis=0), 1, atol=0.02)
+    np.testing.assert_allclose(weights.var(axis=0), 3 / 5, atol=0.02)
+
+
+def test_rank_shard_matches_sample_by_sample_ranking(normalized):
+    matrix = normalized.to_numpy()
+    sizes = [sensitivity.BATCH_SIZE, 100 - sensitivity.BATCH_SIZE]
+    seeds = np.random.SeedSequence(4).spawn(2)
+    counts = sensitivity._rank_shard(matrix, sizes, 0.0, 1.0, seeds)
+
+    expected = []
+    for size, seed in zip(sizes, seeds):
+        weights = sensitivity.sample_weights(np.random.default_rng(seed), size, matrix.shape[1])
+        for w in weights:
+            expected.append(np.argsort(np.argsort(-(matrix @ w), kind='stable'), kind='stable') + 1)
+    np.testing.assert_array_equal(counts, sensitivity.rank_histogram(np.array(expected)))
+    assert (counts.sum(axis=0) == 100).all() and (counts.sum(axis=1) == 100).all()
+
+
+def test_rank_histogram_summaries_match_the_ranks():
+    rng = np.random.default_rng(5)
+    ranks = sensitivity.rank_scores(rng.uniform(size=(101, 12)))
+    counts = sensitivity.rank_histogram(ranks)
+    assert counts[3, ranks[0, 3] - 1] == (ranks[:, 3] == ranks[0, 3]).sum()
+
+    q = [0, 5, 37.5, 50, 95, 100]
+    np.testing.assert_allclose(sensitivity.histogram_percentiles(counts, q), np.percentile(ranks, q, axis=0))
+    # An even number of samples interpolates between two ranks
+    np.testing.assert_allclose(sensitivity.histogram_percentiles(sensitivity.rank_histogram(ranks[:40]), q),
+                               np.percentile(ranks[:40], q, axis=0))
+
+
+def test_baseline_rank_uses_the_ranking_weights(normalized):
+    weights = {'a': 3.0, 'c': 0.0}
+    stability = sensitivity.rank_sensitivity(normalized, n_samples=200, workers=1, weights=weights)
+
+    scores = normalized['a'] * 3 + normalized['b'] + normalized['d']
+    expected = scores.rank(ascending=False, method='first').astype('int32')
+    pd.testing.assert_series_equal(stability['Baseline Rank'], expected.loc[stability.index], check_names=False)
+
+
+def test_rank_sensitivity_summary(normalized):
+    # A county dominating every feature keeps the first rank under any weighting
+    normalized = normalized.copy()
+    normalized.iloc[0] = 2.0
+    stability = sensitivity.rank_sensitivity(normalized, n_samples=300, workers=1, top_k=3)
+
+    top = stability.loc['County 0']
+    assert top['Baseline Rank'] == top['Median Rank'] == top['Rank 5%'] == top['Rank 95%'] == 1
+    assert top['Rank Change Probability'] == 0
+    assert top['Top 3 Probability'] == 1
+    assert (stability['Rank 5%'] <= stability['Median Rank']).all()
+    assert (stability['Median Rank'] <= stability['Rank 95%']).all()
+    assert stability['Rank Change Probability'].between(0, 1).all()
+
+
+def test_rank_sensitivity_is_independent_of_worker_count(normalized):
+    single = sensitivity.rank_sensitivity(normalized, n_samples=200, perturbation=0.1, workers=1)
+    for workers in [2, 3]:
+        pooled = sensitivity.rank_sensitivity(normalized, n_samples=200, perturbation=0.1, workers=workers)
+        pd.testing.assert_frame_equal(single, pooled)
@@ -0,0 +1,142 @@
+import numpy as np
+import pytest
+from shapely.geometry import Polygon, box
+
+import spatial_weights
+from conftest import assert_ignores_other_data_versions
+
+
+@pytest.fixture
+def grid():
+    # 4 x 3 lattice of unit squares, numbered row by row
+    return [box(col, row, col + 1, row + 1) for row in range(3) for col in range(4)]
+
+
+@pytest.fixture
+def values():
+    return np.array([1.0, 2.0, 3.0, 4.0, 2.0, 3.0, 9.0, 5.0, 3.0, 4.0, 5.0, 8.0])
+
+
+def lattice(rook: bool) -> np.ndarray:
+    dense = np.zeros((12, 12))
+    for i in range(12):
+        for j in range(12):
+            dr, dc = abs(i // 4 - j // 4), abs(i % 4 - j % 4)
+            if i != j and max(dr, dc) == 1 and (not rook or dr + dc == 1):
+                dense[i, j] = 1
+    return dense
+
+
+def morans_i(w: np.ndarray, x: np.ndarray) -> float:
+    # Global Moran's I as in esda.Moran with transformation='r'
+    w = w / w.sum(axis=1, keepdims=True)
+    z = x - x.mean()
+    return len(x) / w.sum() * (z @ w @ z) / (z @ z)
+
+
+@pytest.mark.parametrize('rook', [False, True])
+def test_contiguity_weights_match_lattice(grid, rook):
+    matrix = spatial_weights.contiguity_weights(grid, rook=rook)
+    np.testing.assert_array_equal(matrix.toarray(), lattice(rook))
+
+
+@pytest.mark.parametrize('rook', [False, True])
+def test_contiguity_across_a_t_junction(rook):
+    # The right rectangle's left edge has no vertex where the two squares on its left meet
+    geoms = [box(0, 0, 1, 1), box(0, 1, 1, 2), box(1, 0, 2, 2), box(2, 1.5, 3, 3)]
+    # Vertices off by less than the tolerance still touch
+    geoms[3] = Polygon([(2 + 1e-7, 1.5), (3, 1.5), (3, 3), (2 - 1e-7, 3)])
+    expected = np.array([[0, 1, 1, 0], [1, 0, 1, 0], [1, 1, 0, 1], [0, 0, 1, 0]])
+    np.testing.assert_array_equal(spatial_weights.contiguity_weights(geoms, rook=rook).toarray(), expected)
+
+
+def test_corner_contact_is_not_a_rook_neighbor():
+    # The second square touches the long edge of the first at a single point
+    geoms = [box(0, 0, 4, 1), Polygon([(1, 1), (2, 2), (1, 3), (0, 2)])]
+    assert spatial_weights.contiguity_weights(geoms).nnz == 2
+    assert spatial_weights.contiguity_weights(geoms, rook=True).nnz == 0
+
+
+def test_distance_band_weights_match_brute_force():
+    points = np.random.default_rng(7).uniform(0, 10, (60, 2))
+    points[5] = np.nan
+    matrix = spatial_weights.distance_band_weights(points, 2.0)
+    distances = np.sqrt(((points[:, None, :] - points[None, :, :]) ** 2).sum(axis=2))
+    expected = (distances <= 2.0) & ~np.eye(60, dtype=bool)
+    np.testing.assert_array_equal(matrix.toarray(), expected.astype('float64'))
+
+
+def test_subset_and_store_round_trip(grid, tmp_path):
+    spatial_weights.build_weights([10 + i for i in range(12)], grid, 'tract', 'S', str(tmp_path))
+    weights = spatial_weights.load_weights('S', 'tract', 'rook', str(tmp_path))
+    dense = lattice(True)
+
+    subset = weights.subset([15, 14, 99, 11]).toarray()
+    expected = dense[np.ix_([5, 4, 1], [5, 4, 1])]
+    np.testing.assert_array_equal(subset[[0, 1, 3]][:, [0, 1, 3]], expected)
+    assert subset[2].sum() == subset[:, 2].sum() == 0
+
+
+def test_weights_of_another_data_version_are_ignored(grid, tmp_path, monkeypatch):
+    spatial_weights.build_weights([10 + i for i in range(12)], grid, 'tract', 'S', str(tmp_path))
+    assert_ignores_other_data_versions(monkeypatch, spatial_weights,
+                                       lambda: spatial_weights.load_weights('S', 'tract', 'queen', str(tmp_path)),
+                                       spatial_weights._weights)
+
+
+def test_spatial_lag(grid, values):
+    w = lattice(False)
+    x = values.copy()
+    x[6] = np.nan
+    lag = spatial_weights.spatial_lag(spatial_weights.contiguity_weights(grid), x)
+    observed = ~np.isnan(x)
+    expected = (w[:, observed] @ x[observed]) / w[:, observed].sum(axis=1)
+    np.testing.assert_allclose(lag, expected)
+
+
+def test_morans_i_matches_dense_formula(grid, values):
+    result = spatial_weights.morans_i(spatial_weights.contiguity_weights(grid), values, permutations=199)
+    assert result['I'] == pytest.approx(morans_i(lattice(False), values))
+    assert result['expected'] == pytest.approx(-1 / 11)
+    assert 1 / 200 <= result['p_value'] <= 1
+
+    # Values missing from some geographies drop them and their links
+    x = values.copy()
+    x[[0, 7]] = np.nan
+    keep = ~np.isnan(x)
+    result = spatial_weights.morans_i(spatial_weights.contiguity_weights(grid), x, permutations=9)
+    assert result['n'] == 10
+    assert result['I'] == pytest.approx(morans_i(lattice(False)[np.ix_(keep, keep)], x[keep]))
+
+
+def test_clustered_values_have_significant_positive_autocorrelation(grid):
+    values = np.array([0, 0, 5, 5] * 3, dtype='float64')
+    result = spatial_weights.morans_i(spatial_weights.contiguity_weights(grid, rook=True), values)
+    assert result['I'] > 0.5
+    assert result['p_value'] < 0.05
+
+
+def test_local_morans_match_dense_formula(grid, values):
+    w = lattice(False)
+    w = w / w.sum(axis=1, keepdims=True)
+    z = values - values.mean()
+    expected = z * (w @ z) / (z ** 2).mean()
+    np.testing.assert_allclose(spatial_weights.local_morans(spatial_weights.contiguity_weights(grid), values), expected)
+    # Local statistics average to the global one
+    assert expected.mean() == pytest.approx(morans_i(lattice(False), values))
+
+
+def test_getis_ord_matches_dense_formula(grid, values):
+    # Gi* with binary weights including the geography itself (esda.G_Local with star=True, transform='B')
+    w = lattice(False) + np.eye(12)
+    n = len(values)
+    mean = values.mean()
+    s = np.sqrt((values ** 2).mean() - mean ** 2)
+    w_sum = w.sum(axis=1)
+    expected = (w @ values - mean * w_sum) / (s * np.sqrt((n * (w ** 2).sum(axis=1) - w_sum ** 2) / (n - 1)))
+    scores = spatial_weights.getis_ord(spatial_weights.contiguity_weights(grid), values)
+    np.testing.assert_allclose(scores, expected)
+
+    labels = spatial_weights.hotspots(spatial_weights.contiguity_weights(grid), values, z=1.0)
+    np.testing.assert_array_equal(labels == 'Hot Spot', expected >= 1.0)
+    np.testing.assert_array_equal(labels == 'Cold Spot', expected <= -1.0)
@@ -0,0 +1,99 @@
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('streamlit')
+
+import queries
+import streaming
+
+
+@pytest.fixture
+def values():
+    rng = np.random.default_rng(6)
+    values = rng.normal(50, 20, (500, 4))
+    values[rng.uniform(size=values.shape) < 0.2] = np.nan
+    # The last column has no values at all, the third a single one
+    values[:, 3] = np.nan
+    values[:, 2] = np.nan
+    values[123, 2] = 7.0
+    return values
+
+
+def reference(values: np.ndarray) -> dict:
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return {
+            'means': np.nanmean(values, axis=0),
+            'stds': np.nanstd(values, axis=0, ddof=1),
+            'minimum': np.nanmin(values, axis=0),
+            'maximum': np.nanmax(values, axis=0),
+        }
+
+
+def check(stats: streaming.RunningStats, values: np.ndarray):
+    expected = reference(values)
+    np.testing.assert_array_equal(stats.count, (~np.isnan(values)).sum(axis=0))
+    np.testing.assert_allclose(stats.means(), expected['means'])
+    np.testing.assert_allclose(stats.stds(), expected['stds'])
+    np.testing.assert_array_equal(stats.minimum, expected['minimum'])
+    np.testing.assert_array_equal(stats.maximum, expected['maximum'])
+
+
+def test_updates_match_numpy(values):
+    stats = streaming.RunningStats(list('abcd'))
+    for chunk in np.array_split(values, 7):
+        stats.update(pd.DataFrame(chunk, columns=list('abcd')))
+    check(stats, values)
+
+
+def test_merged_chunks_match_numpy(values):
+    parts = [streaming.RunningStats(list('abcd'), seed=i).update(chunk)
+             for i, chunk in enumerate(np.array_split(values, [0, 3, 200, 201, 450]))]
+    stats = parts[0]
+    for part in parts[1:]:
+        stats.merge(part)
+    check(stats, values)
+
+
+def test_quantiles_are_exact_below_the_sample_size(values):
+    stats = streaming.RunningStats(list('abcd'), sample_size=1000)
+    for chunk in np.array_split(values, 3):
+        stats.update(chunk)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        expected = np.nanquantile(values, [0.25, 0.5], axis=0)
+        quantiles = stats.quantiles([0.25, 0.5])
+    np.testing.assert_allclose(quantiles, expected)
+
+
+def test_streamed_statistics_match_the_loaded_frame(monkeypatch):
+    rng = np.random.default_rng(7)
+    headers = queries.EQUITY_CENSUS_POC_LOW_INCOME + queries.EQUITY_CENSUS_REMAINING_HEADERS
+    columns = list(dict.fromkeys([h + ' (%)' for h in headers] + queries.TRANSPORT_CENSUS_HEADERS))
+    tracts = pd.DataFrame(rng.uniform(0, 100, (300, len(columns))), columns=columns)
+    tracts.iloc[::17, 3] = np.nan
+    tracts['county_id'] = np.arange(300) % 120
+    tracts['Census Tract'] = np.arange(300)
+
+    def census_tracts_query(county_ids, tables, columns=None, geometry=True, table_columns=None):
+        assert not geometry and len(county_ids) <= queries.CHUNK_COUNTIES
+        return tracts.loc[tracts['county_id'].isin(county_ids)]
+
+    monkeypatch.setattr(queries, 'census_tracts_query', census_tracts_query)
+    monkeypatch.setattr(queries, 'clean_equity_data', lambda df: df)
+    monkeypatch.setattr(queries, 'derive_transport_data', lambda df: df)
+
+    county_ids = list(range(120))
+    stats = streaming.equity_statistics(county_ids)
+    streamed = queries.classify_equity_geographies(tracts, means=stats.means(), stds=stats.stds())
+    loaded = queries.classify_equity_geographies(tracts)
+    np.testing.assert_allclose(streamed['thresholds'], loaded['thresholds'])
+    np.testing.assert_array_equal(streamed['codes'], loaded['codes'])
+    np.testing.assert_allclose(streaming.equity_thresholds(stats).to_numpy(), loaded['thresholds'])
+
+    stats = streaming.transport_statistics(county_ids)
+    _, _, normalized, _, _ = queries.summarize_transport_data(tracts, tracts.iloc[:10], stats.minimum, stats.maximum)
+    _, _, expected, _, _ = queries.summarize_transport_data(tracts, tracts.iloc[:10])
+    pd.testing.assert_frame_equal(normalized, expected)
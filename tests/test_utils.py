@@ -0,0 +1,40 @@
+import logging
+import pandas as pd
+import pytest
+
+pytest.importorskip('geopandas')
+
+import utils
+
+
+def wait_for_writes():
+    utils._writer.submit(lambda: None).result()
+
+
+def test_excel_async_writes_a_copy_in_the_background(tmp_path, monkeypatch):
+    monkeypatch.setattr(pd.DataFrame, 'to_excel', lambda df, path: df.to_csv(path))
+    df = pd.DataFrame({'a': [1, 2, 3]})
+    path = utils.write_output(df, str(tmp_path / 'out'), sink='excel_async')
+    df.loc[0, 'a'] = 100
+    wait_for_writes()
+
+    assert path == str(tmp_path / 'out.xlsx')
+    assert pd.read_csv(path, index_col=0)['a'].to_list() == [1, 2, 3]
+
+
+def test_excel_async_logs_failures(tmp_path, monkeypatch, caplog):
+    def to_excel(df, path):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(pd.DataFrame, 'to_excel', to_excel)
+    with caplog.at_level(logging.ERROR, logger=utils.__name__):
+        utils.write_output(pd.DataFrame({'a': [1]}), str(tmp_path / 'out'), sink='excel_async')
+        wait_for_writes()
+
+    assert 'out.xlsx failed' in caplog.text
+    assert 'disk full' in caplog.text
+
+
+def test_unknown_sink():
+    with pytest.raises(ValueError):
+        utils.write_output(pd.DataFrame(), 'out', sink='xml')
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import box
+
+pytest.importorskip('streamlit')
+pytest.importorskip('pydeck')
+pytest.importorskip('geopandas')
+
+import geometry_store
+import visualization
+
+
+@pytest.fixture
+def deck_calls(monkeypatch):
+    calls = {}
+    monkeypatch.setattr(visualization.pdk, 'Layer', lambda *args, **kwargs: calls.setdefault('layers', []).append(
+        (args, kwargs)))
+    monkeypatch.setattr(visualization.pdk, 'Deck', lambda **kwargs: calls.setdefault('deck', kwargs))
+    monkeypatch.setattr(visualization.st, 'pydeck_chart', lambda deck: None)
+    return calls
+
+
+@pytest.fixture
+def tract_store(tmp_path, monkeypatch):
+    geometry_store.build_store('tract', [101, 102, 103], [box(0, 0, 1, 1), box(1, 0, 2, 1), box(2, 0, 3, 1)],
+                               str(tmp_path))
+    load_store = geometry_store.load_store
+    monkeypatch.setattr(geometry_store, 'load_store', lambda kind, directory=None: load_store(kind, str(tmp_path)))
+
+
+def test_tract_map_per_capita_keeps_tooltip_column(deck_calls, tract_store):
+    df = pd.DataFrame({
+        'Census Tract': [101, 102, 103],
+        'households': [10.0, 20.0, 30.0],
+        'Total Population': [100.0, 50.0, 300.0],
+    })
+    geo_df = pd.DataFrame({'Census Tract': [101, 102, 103], 'geom': [None] * 3})
+
+    visualization.make_map(geo_df, df, 'households', data_format='Per Capita')
+
+    (_, data), _ = deck_calls['layers'][0]
+    html = deck_calls['deck']['tooltip']['html']
+    assert '{households per capita}' in html
+    assert 'households per capita' in data.columns
+    assert data['households per capita'].tolist() == pytest.approx([0.1, 0.4, 0.1])
+
+
+def test_set_fill_color():
+    frame = pd.DataFrame({'name': ['a', 'b']})
+    visualization.set_fill_color(frame, np.array([[1, 2, 3, 4], [5, 6, 7, 8]], dtype='uint8'))
+    assert frame[visualization.FILL_COLUMNS].to_numpy().tolist() == [[1, 2, 3, 4], [5, 6, 7, 8]]
+    assert visualization.FILL_COLOR == '[' + ', '.join(visualization.FILL_COLUMNS) + ']'
+
+
+def test_make_stacked_downsamples_large_regions(monkeypatch):
+    charts, captions = [], []
+    monkeypatch.setattr(visualization.st, 'altair_chart', lambda chart, **kwargs: charts.append(chart))
+    monkeypatch.setattr(visualization.st, 'caption', captions.append)
+    contributions = np.random.default_rng(0).uniform(0, 50, (6000, 2))
+    tract_ids = np.arange(6000) + 1000
+
+    visualization.make_stacked(tract_ids, contributions, ['a', 'b'])
+
+    charts[0].to_dict()
+    data = charts[0].data
+    assert list(data.columns) == ['Census Tract', 'a', 'b']
+    assert len(data) == visualization.chart_data.MAX_ROWS
+    np.testing.assert_array_equal(data[['a', 'b']].to_numpy(), contributions[data['Census Tract'] - 1000])
+    totals = contributions.sum(axis=1)
+    assert data[['a', 'b']].sum(axis=1).max() == totals.max()
+    assert captions == [f'Showing {visualization.chart_data.MAX_ROWS} of 6000 census tracts, evenly spaced across '
+                        f'the sorted values']
@@ -1,4 +1,6 @@
 import base64
+import logging
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 from six import BytesIO
@@ -29,6 +31,44 @@ def output_table(df: pd.DataFrame, path: str):
     df.to_excel(path)
 
 
+OUTPUT_SINKS = ['none', 'excel', 'excel_async', 'parquet', 'csv']
+
+logger = logging.getLogger(__name__)
+
+# Single worker so background writes to the same file never interleave
+_writer = ThreadPoolExecutor(max_workers=1)
+
+
+def _log_failure(future, path: str):
+    if future.exception() is not None:
+        logger.error('Writing %s failed', path, exc_info=future.exception())
+
+
+def write_output(df: pd.DataFrame, path: str, sink: str = 'excel'):
+    """Persists ``df`` at ``path`` (without extension) through the chosen sink; returns the file path or None.
+
+    ``excel_async`` returns immediately and writes a copy of ``df`` on a background thread; failures are logged.
+    """
+    if sink == 'none':
+        return None
+    elif sink == 'excel':
+        path += '.xlsx'
+        df.to_excel(path)
+    elif sink == 'excel_async':
+        path += '.xlsx'
+        future = _writer.submit(df.copy().to_excel, path)
+        future.add_done_callback(lambda f: _log_failure(f, path))
+    elif sink == 'parquet':
+        path += '.parquet'
+        df.to_parquet(path)
+    elif sink == 'csv':
+        path += '.csv'
+        df.to_csv(path)
+    else:
+        raise ValueError(f'Unknown output sink {sink}. Use one of {OUTPUT_SINKS}.')
+    return path
+
+
 def make_geojson(geo_df: pd.DataFrame, features: list) -> dict:
     geojson = {"type": "FeatureCollection", "features": []}
     if 'Census Tract' in geo_df.columns:
@@ -1,47 +1,74 @@
 import random
 import streamlit as st
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 import pydeck as pdk
 import altair as alt
-from sklearn import preprocessing as pre
 
-from constants import BREAKS, COLOR_RANGE, COLOR_VALUES
+from constants import BREAKS, COLOR_VALUES
+import chart_data
+import classification
+import correlation
+import derived_metrics
+import geography
+import geometry_store
 import utils
 import queries
 
 
-def color_scale(val: float) -> list:
-    for i, b in enumerate(BREAKS):
-        if val <= b:
-            return COLOR_RANGE[i]
-    return COLOR_RANGE[i]
+# Unit hexagon (pointy top) as an SVG path for Vega-Lite point marks
+HEXAGON = 'M0,-1L0.866,-0.5L0.866,0.5L0,1L-0.866,0.5L-0.866,-0.5Z'
+
+# Map fill colors are kept as four uint8 columns and read by pydeck with an array expression
+FILL_COLUMNS = ['fill_r', 'fill_g', 'fill_b', 'fill_a']
+FILL_COLOR = '[' + ', '.join(FILL_COLUMNS) + ']'
+
+NOT_SELECTED_COLOR = [0, 0, 0, 25]
+
+# Columns a map frame is joined to its geometries on
+MAP_KEYS = ['county_id', 'County Name', 'Census Tract']
+
+
+def set_fill_color(frame: pd.DataFrame, rgba: np.ndarray):
+    for i, col in enumerate(FILL_COLUMNS):
+        frame[col] = rgba[:, i]
+
+
+def geometry_frame(geo_df: pd.DataFrame, df: pd.DataFrame, features: list) -> pd.DataFrame:
+    frame = geometry_store.polygon_frame(df, features)
+    if frame is not None:
+        key = 'Census Tract' if 'Census Tract' in frame.columns else 'county_id'
+        extra = [c for c in geo_df.columns if c not in frame.columns and c not in ('geom', 'index')]
+        if extra and key in geo_df.columns:
+            frame = frame.merge(geo_df[[key] + extra].drop_duplicates(subset=[key]), on=key, how='left')
+        return frame
+
+    geo_df_copy = geo_df.copy()
+    geojson = utils.convert_geom(geo_df_copy, df, features)
+    geojson_df = pd.DataFrame(geojson)
+
+    geo_df_copy["coordinates"] = geojson_df["features"].apply(lambda row: row["geometry"]["coordinates"])
+    geo_df_copy["name"] = geojson_df["features"].apply(lambda row: row["properties"]["name"])
+    for header in features:
+        geo_df_copy[header] = geojson_df["features"].apply(lambda row: row["properties"][header])
+    return geo_df_copy
 
 
 def make_map(geo_df: pd.DataFrame, df: pd.DataFrame, map_feature: str, data_format: str = 'Raw Values',
-             show_transit: bool = False):
+             show_transit: bool = False, scheme: str = classification.EQUAL_INTERVAL, region: str = None):
     if 'Census Tract' in geo_df.columns:
         geo_df.reset_index(inplace=True)
     if 'Census Tract' in df.columns:
         df.reset_index(inplace=True)
-    geo_df_copy = geo_df.copy()
-
-    label = map_feature
-    if data_format == 'Per Capita':
-        label = f"{map_feature} per capita"
-        df[label] = df[map_feature] / df['Total Population']
-        pass
-    elif data_format == 'Per Square Mile':
-        label = f"{map_feature} per sqmi"
-        df[label] = df[map_feature] / df['sqmi']
 
-    geojson = utils.convert_geom(geo_df_copy, df, [label])
-    geojson_df = pd.DataFrame(geojson)
+    label = derived_metrics.label(map_feature, data_format)
+    map_df = df
+    if label != map_feature:
+        keys = [c for c in MAP_KEYS if c in df.columns]
+        map_df = derived_metrics.with_feature_values(df, [map_feature], data_format, keys, region)
 
-    geo_df_copy["coordinates"] = geojson_df["features"].apply(lambda row: row["geometry"]["coordinates"])
-    geo_df_copy["name"] = geojson_df["features"].apply(lambda row: row["properties"]["name"])
-    geo_df_copy[label] = geojson_df["features"].apply(lambda row: row["properties"][label])
-    scaler = pre.MinMaxScaler()
+    geo_df_copy = geometry_frame(geo_df, map_df, [label])
     feat_series = geo_df_copy[label]
     feat_type = None
 
@@ -51,32 +78,24 @@ def make_map(geo_df: pd.DataFrame, df: pd.DataFrame, map_feature: str, data_form
             #     feat_series.unique())}  # max 10 categories, following from constants.BREAK, enumerated rather than encoded
             # normalized_vals = feat_series.apply(lambda x: feat_dict[x])  # getting normalized vals, manually.
             color_lookup = pdk.data_utils.assign_random_colors(geo_df_copy[map_feature])
-            geo_df_copy['fill_color'] = geo_df_copy.apply(lambda row: color_lookup.get(row[map_feature]), axis=1)
+            set_fill_color(geo_df_copy, classification.rgba(geo_df_copy[map_feature].map(color_lookup).tolist()))
         except TypeError:
-            normalized_vals = scaler.fit_transform(
-                pd.DataFrame(feat_series)
-            )
-            colors = list(map(color_scale, normalized_vals))
-            geo_df_copy['fill_color'] = colors
+            set_fill_color(geo_df_copy, classification.rgba(classification.colors(feat_series, scheme, label, region)))
             geo_df_copy.fillna(0, inplace=True)
             geo_df_copy = geo_df_copy.astype({label: 'float64'})
     else:
-        normalized_vals = scaler.fit_transform(
-            pd.DataFrame(feat_series)
-        )
-        colors = list(map(color_scale, normalized_vals))
-        geo_df_copy['fill_color'] = colors
+        set_fill_color(geo_df_copy, classification.rgba(classification.colors(feat_series, scheme, label, region)))
         geo_df_copy.fillna(0, inplace=True)
         geo_df_copy = geo_df_copy.astype({label: 'float64'})
 
 
     tooltip = {"html": ""}
     if 'Census Tract' in set(geo_df_copy.columns):
-        keep_cols = ['coordinates', 'name', 'fill_color', 'geom', map_feature]
+        keep_cols = ['coordinates', 'name', 'geom', map_feature, label] + FILL_COLUMNS
         geo_df_copy.drop(list(set(geo_df_copy.columns) - set(keep_cols)), axis=1, inplace=True)
         tooltip = {"html": "<b>Tract:</b> {name} </br>" + "<b>" + str(label) + ":</b> {" + str(label) + "}"}
     elif 'County Name' in set(geo_df_copy.columns):
-        geo_df_copy.drop(['geom', 'County Name'], axis=1, inplace=True)
+        geo_df_copy.drop(['geom', 'County Name'], axis=1, inplace=True, errors='ignore')
         tooltip = {
             "html": "<b>County:</b> {name} </br>" + "<b>" + str(label) + ":</b> {" + str(label) + "}"}
     if len(geo_df_copy['coordinates'][0][0][0]) > 0:
@@ -92,7 +111,7 @@ def make_map(geo_df: pd.DataFrame, df: pd.DataFrame, map_feature: str, data_form
         geo_df_copy,
         get_polygon="coordinates",
         filled=True,
-        get_fill_color='fill_color',
+        get_fill_color=FILL_COLOR,
         stroked=False,
         opacity=0.15,
         pickable=True,
@@ -115,12 +134,11 @@ def make_map(geo_df: pd.DataFrame, df: pd.DataFrame, map_feature: str, data_form
         print(e)
 
 
-def make_correlation_plot(df: pd.DataFrame, feature_cols: list):
+def make_correlation_plot(df: pd.DataFrame, feature_cols: list, dataset: str = None):
     for feature in feature_cols:
         feat_type = 'category' if df[feature].dtype == 'object' else 'numerical'
         if feat_type == 'category':
             return
-    df = df.astype('float64')
     st.subheader('Correlation Plot')
     st.write('''
     This plot shows how individual features in the database correlate to each other. Values range from -1 to 1. 
@@ -133,8 +151,16 @@ def make_correlation_plot(df: pd.DataFrame, feature_cols: list):
     avail_cols.sort()
     cols_to_compare = st.multiselect('Columns to consider', avail_cols, feature_cols)
     if len(cols_to_compare) > 2:
-        df_corr = df[cols_to_compare].corr().stack().reset_index().rename(
-            columns={0: 'correlation', 'level_0': 'variable', 'level_1': 'variable2'})
+        corr = correlation.correlations(df, cols_to_compare, dataset)
+        n_pairs = len(cols_to_compare) * (len(cols_to_compare) - 1) // 2
+        top_n = st.slider('Strongest pairs to show', min_value=1, max_value=n_pairs, value=n_pairs)
+        if top_n < n_pairs:
+            pairs = correlation.top_pairs(corr, top_n)
+            df_corr = pd.concat([pairs, pairs.rename(columns={'variable': 'variable2', 'variable2': 'variable'})],
+                                ignore_index=True)
+        else:
+            df_corr = corr.stack().reset_index().rename(
+                columns={0: 'correlation', 'level_0': 'variable', 'level_1': 'variable2'})
         df_corr['correlation_label'] = df_corr['correlation'].map('{:.2f}'.format)
 
         base = alt.Chart(df_corr).encode(
@@ -164,19 +190,13 @@ def make_correlation_plot(df: pd.DataFrame, feature_cols: list):
         st.altair_chart(cor_plot + text)
 
 
-def make_chart(df: pd.DataFrame, feature: str, data_format: str = 'Raw Values'):
-    data_df = pd.DataFrame(df[[feature, 'County Name']])
+def make_chart(df: pd.DataFrame, feature: str, data_format: str = 'Raw Values', dataset: str = None):
     # feat_type = 'category' if data_df[feature].dtype == 'object' else 'numerical'
     # if feat_type == 'category':
     #     print("Categorical Data called on make_chart")
     # else:
-    label = feature
-    if data_format == 'Per Capita':
-        label = f"{feature} per capita"
-        data_df[label] = data_df[feature] / df['Total Population']
-    elif data_format == 'Per Square Mile':
-        label = f"{feature} per sqmi"
-        data_df[label] = data_df[feature] / df['sqmi']
+    label = derived_metrics.label(feature, data_format)
+    data_df = derived_metrics.with_feature_values(df, [feature], data_format, ['County Name'], dataset)
     data_df = data_df.round(3)
 
     bar = alt.Chart(data_df) \
@@ -188,13 +208,15 @@ def make_chart(df: pd.DataFrame, feature: str, data_format: str = 'Raw Values'):
     st.altair_chart(bar, use_container_width=True)
 
 
-def make_census_chart(df: pd.DataFrame, feature: str):
+def downsampled_caption(data_df: pd.DataFrame, n_rows: int):
+    if len(data_df) < n_rows:
+        st.caption(f'Showing {len(data_df)} of {n_rows} census tracts, evenly spaced across the sorted values')
+
+
+def make_census_chart(df: pd.DataFrame, feature: str, data_format: str = 'Raw Values', dataset: str = None):
     feat_type = 'category' if df[feature].dtype == 'object' else 'numerical'
-    data_df = pd.DataFrame(df[[feature, 'Census Tract', 'county_name']])
     if feat_type == 'category':
-        data_df = pd.DataFrame(data_df.groupby(['county_name', feature]).size())
-        data_df = data_df.rename(columns={0: "tract count"})
-        data_df = data_df.reset_index()
+        data_df = chart_data.count_by(df, 'county_name', feature)
         bar = alt.Chart(data_df) \
             .mark_bar() \
             .encode(x='county_name',
@@ -203,50 +225,68 @@ def make_census_chart(df: pd.DataFrame, feature: str):
                     tooltip=['county_name', feature, "tract count"]) \
             .interactive()
     else:
-        bar = alt.Chart(df) \
+        label = derived_metrics.label(feature, data_format)
+        if label != feature:
+            df = derived_metrics.with_feature_values(df, [feature], data_format, ['Census Tract'], dataset)
+        data_df, n_rows = chart_data.bar_data(df, 'Census Tract', label)
+        downsampled_caption(data_df, n_rows)
+        bar = alt.Chart(data_df) \
             .mark_bar() \
             .encode(x='Census Tract',
-                    y=feature + ':Q',
-                    tooltip=['Census Tract', feature]) \
+                    y=label + ':Q',
+                    tooltip=['Census Tract', label]) \
             .interactive()
     st.altair_chart(bar, use_container_width=True)
 
 
 def make_scatter_plot_counties(df: pd.DataFrame, feature_1: str, feature_2: str,
-                               scaling_feature: str = 'Total Population', data_format: str = 'Raw Values'):
-    label_1 = feature_1
-    label_2 = feature_2
-    if data_format == 'Per Capita':
-        label_1 = f"{feature_1} per capita"
-        df[label_1] = df[feature_1] / df['Total Population']
-        label_2 = f"{feature_2} per capita"
-        df[label_2] = df[feature_2] / df['Total Population']
-    elif data_format == 'Per Square Mile':
-        label_1 = f"{feature_1} per sqmi"
-        df[label_1] = df[feature_1] / df['sqmi']
-        label_2 = f"{feature_2} per sqmi"
-        df[label_2] = df[feature_2] / df['sqmi']
-    df = df.round(3)
-
-    scatter_df = df[[label_1, label_2, 'County Name', scaling_feature]]
-    scatter = alt.Chart(scatter_df).mark_point() \
-        .encode(x=label_1 + ':Q', y=label_2 + ':Q',
-                tooltip=['County Name', scaling_feature, label_1, label_2],
-                size=scaling_feature).interactive()
-    st.altair_chart(scatter, use_container_width=True)
+                               scaling_feature: str = 'Total Population', data_format: str = 'Raw Values',
+                               dataset: str = None):
+    label_1 = derived_metrics.label(feature_1, data_format)
+    label_2 = derived_metrics.label(feature_2, data_format)
+    scatter_df = derived_metrics.with_feature_values(df, [feature_1, feature_2], data_format,
+                                                     ['County Name', scaling_feature], dataset)
+    scatter_df = scatter_df.round(3)[[label_1, label_2, 'County Name', scaling_feature]]
+    make_scatter(scatter_df, label_1, label_2, 'County Name', scaling_feature)
 
 
 def make_scatter_plot_census_tracts(df: pd.DataFrame, feature_1: str, feature_2: str,
-                                    scaling_feature: str = 'tot_population_census_2010'):
-    scatter_df = df.reset_index(drop=True)[[feature_1, feature_2, 'Census Tract', scaling_feature]]
+                                    scaling_feature: str = 'tot_population_census_2010',
+                                    data_format: str = 'Raw Values', dataset: str = None):
+    label_1 = derived_metrics.label(feature_1, data_format)
+    label_2 = derived_metrics.label(feature_2, data_format)
+    scatter_df = derived_metrics.with_feature_values(df, [feature_1, feature_2], data_format,
+                                                     ['Census Tract', scaling_feature], dataset)
+    scatter_df = scatter_df.reset_index(drop=True)[[label_1, label_2, 'Census Tract', scaling_feature]]
+    make_scatter(scatter_df, label_1, label_2, 'Census Tract', scaling_feature)
+
+
+def make_scatter(scatter_df: pd.DataFrame, x: str, y: str, id_field: str, scaling_feature: str,
+                 max_points: int = chart_data.SCATTER_MAX_POINTS):
+    n_points = len(scatter_df)
+    if n_points > max_points:
+        if st.checkbox('Show point density as hexagons', key=f'hexbin {x} {y}'):
+            hex_df = chart_data.hexbin(scatter_df, x, y)
+            hexagons = alt.Chart(hex_df).mark_point(shape=HEXAGON, filled=True, opacity=1,
+                                                    size=(600 / chart_data.HEX_GRIDSIZE) ** 2) \
+                .encode(x=alt.X(x + ':Q'), y=alt.Y(y + ':Q'),
+                        color=alt.Color('points:Q', scale=alt.Scale(scheme='blues'), title='Points'),
+                        tooltip=['points']).interactive()
+            st.altair_chart(hexagons, use_container_width=True)
+            return
+        scatter_df = chart_data.scatter_sample(scatter_df, x, y, max_points)
+        st.caption(f'Showing {len(scatter_df)} of {n_points} points: all outliers and a density-proportional '
+                   f'sample of the rest')
+
     scatter = alt.Chart(scatter_df).mark_point() \
-        .encode(x=feature_1 + ':Q', y=feature_2 + ':Q',
-                tooltip=['Census Tract', scaling_feature, feature_1, feature_2],
+        .encode(x=x + ':Q', y=y + ':Q',
+                tooltip=[id_field, scaling_feature, x, y],
                 size=scaling_feature).interactive()
     st.altair_chart(scatter, use_container_width=True)
 
 
-def make_equity_census_map(geo_df: pd.DataFrame, df: pd.DataFrame, map_feature: str):
+def make_equity_census_map(geo_df: pd.DataFrame, df: pd.DataFrame, map_feature: str,
+                           scheme: str = classification.EQUAL_INTERVAL, region: str = None):
     EQUITY_MAP_HEADERS = [map_feature] + [x + '_check' for x in queries.EQUITY_CENSUS_POC_LOW_INCOME] + [x + '_check'
                                                                                                          for x in
                                                                                                          queries.EQUITY_CENSUS_REMAINING_HEADERS]
@@ -255,42 +295,28 @@ def make_equity_census_map(geo_df: pd.DataFrame, df: pd.DataFrame, map_feature:
         geo_df.reset_index(inplace=True)
     if 'Census Tract' in df.columns:
         df.reset_index(inplace=True)
-    geo_df_copy = geo_df.copy()
-    geojson = utils.convert_geom(geo_df_copy, df, EQUITY_MAP_HEADERS)
-    geojson_df = pd.DataFrame(geojson)
-
-    geo_df_copy["coordinates"] = geojson_df["features"].apply(lambda row: row["geometry"]["coordinates"])
-    geo_df_copy["name"] = geojson_df["features"].apply(lambda row: row["properties"]["name"])
-
-    for header in EQUITY_MAP_HEADERS:
-        geo_df_copy[header] = geojson_df["features"].apply(lambda row: row["properties"][header])
+    geo_df_copy = geometry_frame(geo_df, df, EQUITY_MAP_HEADERS)
 
-    scaler = pre.MinMaxScaler()
     feat_series = geo_df_copy[map_feature]
     feat_type = None
     if feat_series.dtype == 'object':
         feat_type = 'category'
         feat_dict = {k: (i % 10) / 10 for i, k in enumerate(
             feat_series.unique())}  # max 10 categories, following from constants.BREAK, enumerated rather than encoded
-        normalized_vals = feat_series.apply(lambda x: feat_dict[x])  # getting normalized vals, manually.
+        normalized_vals = feat_series.map(feat_dict)  # getting normalized vals, manually.
+        colors = classification.class_colors(classification.classify(normalized_vals, np.array(BREAKS)))
     else:
         feat_type = 'numerical'
-        normalized_vals = scaler.fit_transform(
-            pd.DataFrame(feat_series)
-        )
+        colors = classification.colors(feat_series, scheme, map_feature, region)
 
-    colors = list(map(color_scale, normalized_vals))
-    geo_df_copy['fill_color'] = colors
+    fill = classification.rgba(colors)
+    fill[(feat_series == 'Not selected as an Equity Geography').to_numpy()] = NOT_SELECTED_COLOR
+    set_fill_color(geo_df_copy, fill)
     geo_df_copy.fillna(0, inplace=True)
 
-    for x in range(len(geo_df_copy.index)):
-        geo_df_copy['fill_color'].iloc[x] = [0, 0, 0, 25] if df[map_feature].iloc[
-                                                                 x] == 'Not selected as an Equity Geography' else \
-            geo_df_copy['fill_color'].iloc[x]
-
     tooltip = {"html": ""}
     if 'Census Tract' in set(geo_df_copy.columns):
-        keep_cols = ['coordinates', 'name', 'fill_color', 'geom', map_feature]
+        keep_cols = ['coordinates', 'name', 'geom', map_feature] + FILL_COLUMNS
         geo_df_copy.drop(list(set(geo_df_copy.columns) - set(keep_cols)), axis=1, inplace=True)
         if feat_type == 'numerical':
             tooltip = {
@@ -304,7 +330,7 @@ def make_equity_census_map(geo_df: pd.DataFrame, df: pd.DataFrame, map_feature:
             }
 
     elif 'County Name' in set(geo_df_copy.columns):
-        geo_df_copy.drop(['geom', 'County Name'], axis=1, inplace=True)
+        geo_df_copy.drop(['geom', 'County Name'], axis=1, inplace=True, errors='ignore')
         tooltip = {
             "html": "<b>County:</b> {name} </br>" + "<b>" + str(map_feature) + ":</b> {" + str(map_feature) + "}"
         }
@@ -324,7 +350,7 @@ def make_equity_census_map(geo_df: pd.DataFrame, df: pd.DataFrame, map_feature:
         geo_df_copy,
         get_polygon="coordinates",
         filled=True,
-        get_fill_color='fill_color',
+        get_fill_color=FILL_COLOR,
         stroked=False,
         opacity=0.15,
         pickable=True,
@@ -341,42 +367,32 @@ def make_equity_census_map(geo_df: pd.DataFrame, df: pd.DataFrame, map_feature:
     st.pydeck_chart(r)
 
 
-def make_transport_census_map(geo_df: pd.DataFrame, df: pd.DataFrame, map_feature: str, show_transit: bool = False):
+def make_transport_census_map(geo_df: pd.DataFrame, df: pd.DataFrame, map_feature: str, show_transit: bool = False,
+                              scheme: str = classification.EQUAL_INTERVAL, region: str = None):
     if 'Census Tract' in geo_df.columns:
         geo_df.reset_index(inplace=True)
     if 'Census Tract' in df.columns:
         df.reset_index(inplace=True)
-    geo_df_copy = geo_df.copy()
-    geojson = utils.convert_geom(geo_df_copy, df, queries.TRANSPORT_CENSUS_HEADERS)
-    geojson_df = pd.DataFrame(geojson)
+    geo_df_copy = geometry_frame(geo_df, df, queries.TRANSPORT_CENSUS_HEADERS)
 
-    geo_df_copy["coordinates"] = geojson_df["features"].apply(lambda row: row["geometry"]["coordinates"])
-    geo_df_copy["name"] = geojson_df["features"].apply(lambda row: row["properties"]["name"])
-
-    for header in queries.TRANSPORT_CENSUS_HEADERS:
-        geo_df_copy[header] = geojson_df["features"].apply(lambda row: row["properties"][header])
-
-    scaler = pre.MinMaxScaler()
     feat_series = geo_df_copy[map_feature]
     feat_type = None
     if feat_series.dtype == 'object':
         feat_type = 'category'
         feat_dict = {k: (i % 10) / 10 for i, k in enumerate(
             feat_series.unique())}  # max 10 categories, following from constants.BREAK, enumerated rather than encoded
-        normalized_vals = feat_series.apply(lambda x: feat_dict[x])  # getting normalized vals, manually.
+        normalized_vals = feat_series.map(feat_dict)  # getting normalized vals, manually.
+        colors = classification.class_colors(classification.classify(normalized_vals, np.array(BREAKS)))
     else:
         feat_type = 'numerical'
-        normalized_vals = scaler.fit_transform(
-            pd.DataFrame(feat_series)
-        )
+        colors = classification.colors(feat_series, scheme, map_feature, region)
 
-    colors = list(map(color_scale, normalized_vals))
-    geo_df_copy['fill_color'] = colors
+    set_fill_color(geo_df_copy, classification.rgba(colors))
     geo_df_copy.fillna(0, inplace=True)
 
     tooltip = {"html": ""}
     if 'Census Tract' in set(geo_df_copy.columns):
-        keep_cols = ['coordinates', 'name', 'fill_color', 'geom', map_feature]
+        keep_cols = ['coordinates', 'name', 'geom', map_feature] + FILL_COLUMNS
         geo_df_copy.drop(list(set(geo_df_copy.columns) - set(keep_cols)), axis=1, inplace=True)
         if map_feature == 'Index Value':
             tooltip = {
@@ -433,7 +449,7 @@ def make_transport_census_map(geo_df: pd.DataFrame, df: pd.DataFrame, map_featur
             geo_df_copy,
             get_polygon="coordinates",
             filled=True,
-            get_fill_color='fill_color',
+            get_fill_color=FILL_COLOR,
             stroked=False,
             opacity=0.15,
             pickable=True,
@@ -452,20 +468,14 @@ def make_transport_census_map(geo_df: pd.DataFrame, df: pd.DataFrame, map_featur
 
 
 def make_equity_census_chart(df: pd.DataFrame, threshold: dict, average: dict, feature: str):
-    df['average'] = average[feature]
-    df['threshold'] = threshold[feature]
-
     baselines = pd.DataFrame([{"name": 'average', "value": average[feature]},
                               {"name": 'concentration threshold', "value": threshold[feature]}])
 
     feature = feature + ' (%)'
     feat_type = 'category' if df[feature].dtype == 'object' else 'numerical'
-    data_df = pd.DataFrame(df[[feature, 'Census Tract', 'county_name']])
 
     if feat_type == 'category':
-        data_df = pd.DataFrame(data_df.groupby(['county_name', feature]).size())
-        data_df = data_df.rename(columns={0: "tract count"})
-        data_df = data_df.reset_index()
+        data_df = chart_data.count_by(df, 'county_name', feature)
         bar = alt.Chart(data_df) \
             .mark_bar() \
             .encode(x=alt.X('county_name', axis=alt.Axis(labels=False)),
@@ -474,7 +484,9 @@ def make_equity_census_chart(df: pd.DataFrame, threshold: dict, average: dict, f
                     tooltip=['county_name', feature, "tract count"]) \
             .interactive()
     else:
-        bar = alt.Chart(df) \
+        data_df, n_rows = chart_data.bar_data(df, 'Census Tract', feature)
+        downsampled_caption(data_df, n_rows)
+        bar = alt.Chart(data_df) \
             .mark_bar() \
             .encode(x=alt.X('Census Tract:O', axis=alt.Axis(labels=False), title='Census Tract Distribution', sort='y'),
                     y=alt.Y(feature + ':Q', title=feature),
@@ -498,17 +510,12 @@ def make_equity_census_chart(df: pd.DataFrame, threshold: dict, average: dict, f
 
 
 def make_transport_census_chart(df: pd.DataFrame, average: dict, feature: str):
-    df['average'] = average[feature]
-
     baselines = pd.DataFrame([{"name": 'county average', "value": average[feature]}])
 
     feat_type = 'category' if df[feature].dtype == 'object' else 'numerical'
-    data_df = pd.DataFrame(df[[feature, 'Census Tract', 'county_name']])
 
     if feat_type == 'category':
-        data_df = pd.DataFrame(data_df.groupby(['county_name', feature]).size())
-        data_df = data_df.rename(columns={0: "tract count"})
-        data_df = data_df.reset_index()
+        data_df = chart_data.count_by(df, 'county_name', feature)
         bar = alt.Chart(data_df) \
             .mark_bar() \
             .encode(x=alt.X('county_name', axis=alt.Axis(labels=False)),
@@ -517,7 +524,9 @@ def make_transport_census_chart(df: pd.DataFrame, average: dict, feature: str):
                     tooltip=['county_name', feature, "tract count"]) \
             .interactive()
     else:
-        bar = alt.Chart(df) \
+        data_df, n_rows = chart_data.bar_data(df, 'Census Tract', feature)
+        downsampled_caption(data_df, n_rows)
+        bar = alt.Chart(data_df) \
             .mark_bar() \
             .encode(x=alt.X('Census Tract:O', axis=alt.Axis(labels=False), title='Census Tracts', sort='y'),
                     y=alt.Y(feature + ':Q', title='Households(%)'),
@@ -563,8 +572,18 @@ def make_grouped_bar_chart(df: pd.DataFrame, id_var: str, features: list, featur
     st.altair_chart(bar, use_container_width=True)
 
 
-def make_stacked(df: pd.DataFrame):
+def make_stacked(tract_ids, contributions, indicators: list):
+    # Tracts are downsampled on their index value, then the wide (tract, indicator) contributions of the kept tracts
+    # are folded by Vega-Lite instead of melting in pandas
+    contributions = np.asarray(contributions)
+    totals = pd.DataFrame({'Census Tract': np.asarray(tract_ids), 'Index Value': contributions.sum(axis=1),
+                           'row': np.arange(len(contributions))})
+    data_df = chart_data.downsample(totals, 'Index Value')
+    downsampled_caption(data_df, len(totals))
+    df = pd.DataFrame(contributions[data_df['row'].to_numpy()], columns=indicators)
+    df.insert(0, 'Census Tract', data_df['Census Tract'].to_numpy())
     bar = alt.Chart(df) \
+        .transform_fold(indicators, as_=['Indicators', 'Index Value']) \
         .mark_bar() \
         .encode(x=alt.X('Census Tract:O', axis=alt.Axis(labels=False), title='Census Tracts', sort='y'),
                 y=alt.Y('sum(Index Value):Q', title='Transportation Vulnerability Index'),
@@ -575,6 +594,19 @@ def make_stacked(df: pd.DataFrame):
     st.altair_chart(bar, use_container_width=True)
 
 
+def make_scenario_chart(sweep_df: pd.DataFrame):
+    totals = sweep_df.groupby(['rent_type', 'location', 'pct_burdened'], as_index=False)['total_cost'].sum()
+    line = alt.Chart(totals) \
+        .mark_line(point=True) \
+        .encode(x=alt.X('pct_burdened:O', title='Percent of Burdened Population Supported'),
+                y=alt.Y('total_cost:Q', title='Total Monthly Cost'),
+                color=alt.Color('location:N', legend=alt.Legend(orient='bottom')),
+                column=alt.Column('rent_type:N', title='Rent Type'),
+                tooltip=['location', 'rent_type', 'pct_burdened', 'total_cost']) \
+        .interactive()
+    st.altair_chart(line)
+
+
 def make_histogram(df: pd.DataFrame, feature: str):
     base = alt.Chart(df)
     hist = base.mark_bar().encode(
@@ -600,8 +632,7 @@ def make_simple_chart(df: pd.DataFrame, feature: str):
 
 
 def make_transit_layers(tract_df: pd.DataFrame, pickable: bool = True):
-    tracts = tract_df['Census Tract'].to_list()
-    tracts_str = str(tuple(tracts)).replace(',)', ')')
+    tracts_str = geography.sql_in(tract_df['Census Tract'], 'tract')
 
     NTM_shapes = queries.get_transit_shapes_geoms(
         columns=['route_desc', 'route_type_text', 'length', 'geom', 'tract_id', 'route_long_name'],